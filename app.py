@@ -1,14 +1,25 @@
+import asyncio
 import io
 import json
 import os
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 import gradio as gr
 from PIL import Image
 
 # Local imports
-from kontext.runner import run_restyle_plan, save_image
+from kontext.backends import FAL, backend_names
+from kontext.brand_assets import plan_logo_colors
+from kontext.checkpoint import completed_prefix, load_manifest
+from kontext.frame_archive import load_frame
+from kontext.frames import make_thumbnail
+from kontext.regions import REGION_HINT_HELP
+from kontext.runner import iter_restyle_plan_async, iter_resume_restyle_plan_async
+from kontext.tracing import Trace
+from kontext.transfer import TRANSFER_LABELS, prepare_input
 from restyle.planner import (
     EXAMPLE_TOKENS,
     load_tokens_from_json,
@@ -17,8 +28,11 @@ from restyle.planner import (
     DEFAULT_STEP_KEYS,
     DEFAULT_STEP_LABELS,
     ALL_STEP_LABELS,
+    RECOLOR_STEP_KEYS,
+    labels_from_keys,
     steps_from_labels,
 )
+from restyle.optimizer import DEFAULT_PROFILE, PLAN_PROFILES, describe_call_counts, optimize_plan
 
 # Load .env if present
 try:
@@ -30,6 +44,31 @@ except Exception:
 
 ROOT = Path(__file__).parent.resolve()
 TOKENS_PATH = ROOT / "scripts" / "tokens" / "example_tokens.json"
+# Restyles run as async handlers on the server's event loop. The Gradio queue admits up to
+# MAX_CONCURRENT_RUNS plans at once; across all of them, at most MAX_INFLIGHT_CALLS local model
+# calls are in flight (the rest wait on the semaphore, not on a worker thread). FAL calls are
+# capped, rate-limited and shared round-robin between browser sessions by kontext/scheduler.py.
+MAX_CONCURRENT_RUNS = int(os.getenv("KONTEXT_MAX_CONCURRENT_RUNS", "32"))
+MAX_INFLIGHT_CALLS = int(os.getenv("KONTEXT_MAX_INFLIGHT_CALLS", "16"))
+_LIMITS: Dict[str, asyncio.Semaphore] = {}
+# Browser session → folder of its last failed run, for "Resume failed run" (kontext/checkpoint.py).
+# Only the most recent MAX_FAILED_RUNS sessions are kept; older runs resume from the checkpoint CLI.
+MAX_FAILED_RUNS = 256
+_FAILED_RUNS: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _remember_failed_run(session: str, run_path: str) -> None:
+    _FAILED_RUNS[session] = run_path
+    _FAILED_RUNS.move_to_end(session)
+    while len(_FAILED_RUNS) > MAX_FAILED_RUNS:
+        _FAILED_RUNS.popitem(last=False)
+
+
+def _inflight() -> asyncio.Semaphore:
+    # Created on first use, inside the server's event loop.
+    if "calls" not in _LIMITS:
+        _LIMITS["calls"] = asyncio.Semaphore(max(1, MAX_INFLIGHT_CALLS))
+    return _LIMITS["calls"]
 
 
 def _load_sample_tokens() -> str:
@@ -73,7 +112,7 @@ def on_click_build_tokens(
     return json.dumps(tokens, indent=2)
 
 
-def on_click_restyle(
+async def _restyle(
     image: Image.Image,
     brand_logo: Optional[Image.Image],
     tokens_json: str,
@@ -83,7 +122,27 @@ def on_click_restyle(
     backend: str,
     jitter: bool,
     show_step_outputs: bool,
-) -> Tuple[Image.Image, List[Image.Image], str]:
+    use_cache: bool = True,
+    remote_chain: bool = True,
+    transfer_label: str = TRANSFER_LABELS["webp_lossless"],
+    region_hints_json: str = "",
+    plan_profile: str = DEFAULT_PROFILE,
+    recolor_labels: Optional[List[str]] = None,
+    drift_retry: float = 0.0,
+    drift_abort: float = 0.0,
+    hedge: bool = False,
+    candidates: int = 1,
+    preview_long_edge: Optional[int] = None,
+    step_seeds: Optional[List[int]] = None,
+    linked_run: Optional[Dict] = None,
+    session: Optional[str] = None,
+) -> AsyncIterator[Tuple[Image.Image, List[Image.Image], str, Optional[Dict], List[str]]]:
+    """
+    Yields (latest frame, step thumbnails, log, None, frame paths) as each step lands, then
+    the final (image, gallery, info, record, frame paths). Only the latest frame goes to the
+    browser at full resolution; the gallery gets thumbnails (see `on_select_frame`).
+    `session` (the browser session) is this run's turn-taking key in the FAL scheduler.
+    """
     if image is None:
         raise gr.Error("Please upload a screenshot image (PNG/JPG).")
 
@@ -99,12 +158,34 @@ def on_click_restyle(
     if "convert_light_mode" in step_keys and "convert_dark_mode" in step_keys:
         raise gr.Error("Select either light mode or dark mode conversion, not both.")
 
+    try:
+        region_hints = json.loads(region_hints_json) if (region_hints_json or "").strip() else {}
+        if not isinstance(region_hints, dict):
+            raise ValueError("expected an object of step key → region")
+    except Exception as e:
+        raise gr.Error(f"Invalid region hints JSON: {e}")
+
     # Build edit plan (ordered steps with prompts)
-    plan = build_edit_plan(tokens=tokens, steps=step_keys, brand_logo=brand_logo)
+    trace = Trace()
+    plan_started = time.perf_counter()
+    plan = await asyncio.to_thread(
+        build_edit_plan,
+        tokens=tokens,
+        steps=step_keys,
+        brand_logo=brand_logo,
+        region_hints=region_hints,
+        recolor_steps=steps_from_labels(recolor_labels or []),
+        logo_colors=await asyncio.to_thread(plan_logo_colors, brand_logo),
+    )
+    plan_summary = describe_call_counts(plan, plan_profile)
+    plan = optimize_plan(plan, plan_profile)
+    trace.add("plan_build", plan_started, time.perf_counter() - plan_started, steps=len(plan))
 
     # Run plan via Kontext backend
-    outputs, log = run_restyle_plan(
-        image=image.convert("RGBA"),
+    transfer = {label: mode for mode, label in TRANSFER_LABELS.items()}.get(transfer_label, "png")
+    record: Dict = {}
+    updates = iter_restyle_plan_async(
+        image=await asyncio.to_thread(prepare_input, image),
         plan=plan,
         seed=seed,
         backend=backend,
@@ -112,15 +193,151 @@ def on_click_restyle(
         seed_jitter=jitter,
         save_dir=ROOT / "outputs",
         brand_logo=brand_logo,
+        use_cache=use_cache,
+        remote_chain=remote_chain,
+        transfer_encoding=transfer,
+        preview_long_edge=preview_long_edge,
+        step_seeds=step_seeds,
+        linked_run=linked_run,
+        record=record,
+        drift_retry=float(drift_retry) or None,
+        drift_abort=float(drift_abort) or None,
+        trace=trace,
+        inflight=None if backend == FAL else _inflight(),
+        session=session,
+        priority="interactive",
+        hedge=bool(hedge),
+        candidates=int(candidates or 1),
+        tokens=tokens,
+    )
+    async for out in _stream_run(updates, record, image, show_step_outputs, [plan_summary], session):
+        yield out
+
+
+async def _stream_run(
+    updates: AsyncIterator[Dict],
+    record: Dict,
+    image: Optional[Image.Image],
+    show_step_outputs: bool,
+    header: List[str],
+    session: Optional[str],
+) -> AsyncIterator[Tuple[Image.Image, List[Image.Image], str, Optional[Dict], List[str]]]:
+    """Turn a run's update stream into UI tuples (see `_restyle`); a failed run is kept for resuming."""
+    thumbs: Dict[int, Image.Image] = {}
+    latest: Tuple[int, Optional[Image.Image]] = (-1, None)  # remote frames can land out of order
+    paths: Dict[int, str] = {}
+    streamed = list(header)
+    outputs: List[Image.Image] = []
+    log: List[str] = []
+    try:
+        async for update in updates:
+            if update.get("done"):
+                outputs, log = update["frames"], update["logs"]
+                continue
+            streamed.append(update["log"] + f" ({update['step_s']:.1f}s)")
+            if update.get("frame") is None:
+                continue
+            if show_step_outputs:
+                thumbs[update["step"]] = await asyncio.to_thread(make_thumbnail, update["frame"])
+                paths[update["step"]] = update["path"]
+            if update["step"] >= latest[0]:
+                latest = (update["step"], update["frame"])
+            gallery = [thumbs[i] for i in sorted(thumbs)]
+            yield latest[1], gallery, "\n".join(streamed), None, [paths[i] for i in sorted(paths)]
+    except Exception as exc:
+        if record.get("status") != "failed":
+            raise
+        if session:
+            _remember_failed_run(session, record["run_path"])
+        done = completed_prefix(record)
+        raise gr.Error(
+            f"Step {done + 1} failed: {record.get('error') or exc}. The {done} finished step(s) are saved; "
+            "click \"Resume failed run\" to continue from there."
+        )
+
+    log = header + log
+    final_img = (await asyncio.to_thread(outputs.__getitem__, -1) if outputs else None) or image
+    if record.get("mode") == "preview":
+        info = f"Preview run {record.get('run_id')} ({record.get('elapsed_s', 0):.1f}s)\n\n" + "\n".join(log)
+    else:
+        # Each run writes its own final.png (kontext/run_store.py); nothing is shared between users.
+        out_path = Path(record["run_path"]) / record["final"] if record.get("final") else None
+        info = (f"Saved final image to: {out_path}\n\n" if out_path else "") + "\n".join(log)
+    gallery = [thumbs[i] for i in sorted(thumbs)]
+    yield final_img, gallery, info, record, [paths[i] for i in sorted(paths)]
+
+
+def _session_id(request: Optional[gr.Request]) -> Optional[str]:
+    return getattr(request, "session_hash", None) or None
+
+
+async def on_click_restyle(
+    request: gr.Request, *args
+) -> AsyncIterator[Tuple[Image.Image, List[Image.Image], str, List[str]]]:
+    async for final_img, gallery, info, _, paths in _restyle(*args, session=_session_id(request)):
+        yield final_img, gallery, info, paths
+
+
+async def on_click_preview(
+    request: gr.Request, *args
+) -> AsyncIterator[Tuple[Image.Image, List[Image.Image], str, Dict, List[str]]]:
+    """Low-res run with cheaper inference; remembers inputs + seeds for `on_click_render_final`."""
+    *restyle_args, preview_edge = args
+    async for final_img, gallery, info, record, paths in _restyle(
+        *restyle_args, preview_long_edge=int(preview_edge), session=_session_id(request)
+    ):
+        state = gr.update() if record is None else {"args": restyle_args, "record": record}
+        yield final_img, gallery, info, state, paths
+
+
+async def on_click_render_final(
+    preview_state: Optional[Dict],
+    request: gr.Request,
+) -> AsyncIterator[Tuple[Image.Image, List[Image.Image], str, List[str]]]:
+    """Re-run the approved preview configuration at full resolution with the same seeds."""
+    if not preview_state:
+        raise gr.Error("Run a preview first.")
+    record = preview_state["record"]
+    async for final_img, gallery, info, _, paths in _restyle(
+        *preview_state["args"], step_seeds=record.get("step_seeds"), linked_run=record,
+        session=_session_id(request),
+    ):
+        yield final_img, gallery, info, paths
+
+
+async def on_click_resume(
+    show_step_outputs: bool,
+    request: gr.Request,
+) -> AsyncIterator[Tuple[Image.Image, List[Image.Image], str, List[str]]]:
+    """Continue this session's last failed run from its first unfinished step (finished frames are reused)."""
+    session = _session_id(request)
+    run_path = _FAILED_RUNS.pop(session, None) if session else None
+    if run_path is None:
+        raise gr.Error("No failed run to resume in this session.")
+    manifest = await asyncio.to_thread(load_manifest, Path(run_path))
+    record: Dict = {}
+    updates = iter_resume_restyle_plan_async(
+        Path(run_path),
+        record=record,
+        inflight=None if manifest.get("backend") == FAL else _inflight(),
+        session=session,
+        priority="interactive",
     )
+    async for final_img, gallery, info, _, paths in _stream_run(
+        updates, record, None, show_step_outputs, [f"Resuming run {manifest.get('run_id')}"], session
+    ):
+        yield final_img, gallery, info, paths
+
 
-    final_img = outputs[-1] if outputs else image
-    # Save final image for convenience
-    out_path = save_image(final_img, ROOT / "outputs", "final.png")
+async def on_select_frame(paths: List[str], evt: gr.SelectData):
+    """Load the clicked gallery thumbnail's frame at full resolution from the run folder."""
+    if not paths or evt.index is None or evt.index >= len(paths):
+        return gr.update()
 
-    info = f"Saved final image to: {out_path}\n\n" + "\n".join(log)
-    gallery = outputs if show_step_outputs else []
-    return final_img, gallery, info
+    try:
+        return await asyncio.to_thread(load_frame, Path(paths[evt.index]))
+    except (FileNotFoundError, KeyError):  # not written yet
+        return gr.update()
 
 
 with gr.Blocks(title="Design-System Restyler — FLUX.1 Kontext [dev]") as demo:
@@ -173,10 +390,35 @@ Drop a UI screenshot and apply your brand tokens (colors, corner radii, shadows)
                     value=DEFAULT_STEP_LABELS,
                     label="Select steps",
                 )
+            with gr.Accordion("Region hints (optional)", open=False):
+                region_hints = gr.Code(
+                    label=f"Step key → region ({REGION_HINT_HELP})",
+                    language="json",
+                    value='{\n  "charts_and_dataviz": "charts"\n}',
+                    lines=6,
+                )
+            plan_profile = gr.Radio(
+                choices=PLAN_PROFILES,
+                value=DEFAULT_PROFILE,
+                label="Plan profile (fast/balanced fuse compatible steps into fewer Kontext calls)",
+            )
+            recolor_steps = gr.CheckboxGroup(
+                choices=labels_from_keys(RECOLOR_STEP_KEYS),
+                value=[],
+                label="Pixel recolor steps (no model call; flat UI colors only)",
+            )
+            with gr.Accordion("Quality gates (layout drift, 0 = off)", open=False):
+                with gr.Row():
+                    drift_retry = gr.Slider(0.0, 1.0, value=0.0, step=0.01, label="Retry step above drift")
+                    drift_abort = gr.Slider(0.0, 1.0, value=0.0, step=0.01, label="Abort plan above drift")
+                candidates = gr.Slider(
+                    1, 4, value=1, step=1,
+                    label="Best-of-N candidates per step (scored on token colors + layout)",
+                )
             with gr.Row():
                 backend = gr.Radio(
-                    choices=["FAL (Kontext API)", "local (Kontext)", "dry-run (no model)"],
-                    value="FAL (Kontext API)",
+                    choices=backend_names(),
+                    value=FAL,
                     label="Backend",
                 )
                 seed = gr.Slider(0, 999999, value=12345, step=1, label="Seed")
@@ -184,11 +426,28 @@ Drop a UI screenshot and apply your brand tokens (colors, corner radii, shadows)
                 strength_mult = gr.Slider(0.1, 1.5, value=1.0, step=0.05, label="Global strength multiplier")
                 jitter = gr.Checkbox(value=True, label="Seed jitter (+idx)")
                 show_gallery = gr.Checkbox(value=True, label="Show step outputs")
+                use_cache = gr.Checkbox(value=True, label="Reuse cached step results")
+                remote_chain = gr.Checkbox(value=True, label="Chain FAL steps by URL")
+                hedge = gr.Checkbox(value=False, label="Hedge slow FAL requests")
+            transfer = gr.Dropdown(
+                choices=list(TRANSFER_LABELS.values()),
+                value=TRANSFER_LABELS["webp_lossless"],
+                label="Transfer encoding (intermediate steps; final step is always PNG)",
+            )
             restyle_btn = gr.Button("Restyle Screenshot", variant="primary")
+            with gr.Row():
+                preview_edge = gr.Slider(256, 2048, value=768, step=64, label="Preview long edge (px)")
+                preview_btn = gr.Button("Preview (low-res)")
+                final_btn = gr.Button("Render final (full-res, same seeds)")
+            with gr.Row():
+                resume_btn = gr.Button("Resume failed run")
+                cancel_btn = gr.Button("Cancel run", variant="stop")
+            preview_state = gr.State(None)
+            frame_paths = gr.State([])
 
         with gr.Column(scale=1):
             result = gr.Image(type="pil", label="Final Restyled Image")
-            gallery = gr.Gallery(label="Step Outputs", columns=3, height=300)
+            gallery = gr.Gallery(label="Step Outputs (click for full resolution)", columns=3, height=300)
             info = gr.Textbox(label="Logs & saved paths", lines=16)
 
     # Wiring
@@ -214,21 +473,60 @@ Drop a UI screenshot and apply your brand tokens (colors, corner radii, shadows)
     )
     load_sample.click(lambda: _load_sample_tokens(), outputs=[tokens_json])
 
-    restyle_btn.click(
+    restyle_inputs = [
+        image,
+        brand_logo,
+        tokens_json,
+        steps,
+        seed,
+        strength_mult,
+        backend,
+        jitter,
+        show_gallery,
+        use_cache,
+        remote_chain,
+        transfer,
+        region_hints,
+        plan_profile,
+        recolor_steps,
+        drift_retry,
+        drift_abort,
+        hedge,
+        candidates,
+    ]
+    # Restyle, preview and final renders share one concurrency pool.
+    restyle_event = restyle_btn.click(
         on_click_restyle,
-        inputs=[
-            image,
-            brand_logo,
-            tokens_json,
-            steps,
-            seed,
-            strength_mult,
-            backend,
-            jitter,
-            show_gallery,
-        ],
-        outputs=[result, gallery, info],
+        inputs=restyle_inputs,
+        outputs=[result, gallery, info, frame_paths],
+        concurrency_limit=MAX_CONCURRENT_RUNS,
+        concurrency_id="restyle",
+    )
+    preview_event = preview_btn.click(
+        on_click_preview,
+        inputs=restyle_inputs + [preview_edge],
+        outputs=[result, gallery, info, preview_state, frame_paths],
+        concurrency_limit=MAX_CONCURRENT_RUNS,
+        concurrency_id="restyle",
+    )
+    final_event = final_btn.click(
+        on_click_render_final,
+        inputs=[preview_state],
+        outputs=[result, gallery, info, frame_paths],
+        concurrency_limit=MAX_CONCURRENT_RUNS,
+        concurrency_id="restyle",
+    )
+    resume_event = resume_btn.click(
+        on_click_resume,
+        inputs=[show_gallery],
+        outputs=[result, gallery, info, frame_paths],
+        concurrency_limit=MAX_CONCURRENT_RUNS,
+        concurrency_id="restyle",
     )
+    # Cancelling closes the handler's stream, which cancels the in-flight FAL request
+    # and skips the remaining steps (frames already shown stay on disk).
+    cancel_btn.click(None, cancels=[restyle_event, preview_event, final_event, resume_event])
+    gallery.select(on_select_frame, inputs=[frame_paths], outputs=[result])
 
 if __name__ == "__main__":
-    demo.launch()
+    demo.queue(max_size=int(os.getenv("KONTEXT_QUEUE_SIZE", "256"))).launch()
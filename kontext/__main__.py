@@ -0,0 +1,3 @@
+from kontext.cli import main
+
+raise SystemExit(main())
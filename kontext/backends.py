@@ -0,0 +1,73 @@
+"""
+Backend registry: maps a backend name (as shown in the UI / passed as `backend=`)
+to the module implementing it. Modules are imported on first use, so selecting
+the pixel recolor or dry-run never loads fal_client / requests.
+
+A backend module provides `init()`, `apply_edit(image, prompt, negative_prompt,
+strength, seed, region_hint, **kwargs)` and `apply_edit_async(...)` with the same
+arguments. Register your own with:
+  register_backend(BackendSpec("my backend", "package.module", cacheable=True))
+"""
+import importlib
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Dict, List, Optional
+
+FAL = "FAL (Kontext API)"
+LOCAL = "local (Kontext)"
+RECOLOR = "recolor (pixels)"  # kontext.recolor_backend.BACKEND_NAME
+DRY_RUN = "dry-run (no model)"
+
+
+@dataclass(frozen=True)
+class BackendSpec:
+    name: str
+    module: Optional[str]         # None = dry-run (returns its input)
+    cacheable: bool = False       # outputs go through the step cache
+    remote: bool = False          # takes FAL transport options; accepts and returns RemoteImage
+    deterministic: bool = False   # same input → same output (best-of-N collapses to 1, no in-flight slot)
+    selectable: bool = True       # offered as a whole-plan backend (UI / CLI)
+
+
+_REGISTRY: Dict[str, BackendSpec] = {}
+_MODULES: Dict[str, ModuleType] = {}
+
+
+def register_backend(spec: BackendSpec) -> None:
+    _REGISTRY[spec.name] = spec
+    _MODULES.pop(spec.name, None)
+
+
+def get_spec(name: str) -> BackendSpec:
+    """Spec for `name`; unknown names raise ValueError."""
+    spec = _REGISTRY.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown backend {name!r}; expected one of {backend_names(selectable_only=False)}")
+    return spec
+
+
+def load(name: str, init: bool = True) -> Optional[ModuleType]:
+    """Import (once) and `init()` the backend module; None for dry-run."""
+    spec = get_spec(name)
+    if spec.module is None:
+        return None
+    module = _MODULES.get(spec.name)
+    if module is None:
+        module = importlib.import_module(spec.module)
+        _MODULES[spec.name] = module
+    if init:
+        module.init()
+    return module
+
+
+def backend_names(selectable_only: bool = True) -> List[str]:
+    return [name for name, spec in _REGISTRY.items() if spec.selectable or not selectable_only]
+
+
+for _spec in (
+    BackendSpec(FAL, "kontext.fal_backend", cacheable=True, remote=True),
+    BackendSpec(LOCAL, "kontext.local_backend", cacheable=True),
+    BackendSpec(DRY_RUN, None),
+    BackendSpec(RECOLOR, "kontext.recolor_backend", deterministic=True, selectable=False),
+):
+    register_backend(_spec)
@@ -0,0 +1,291 @@
+"""
+Headless batch restyle: screenshots × token files → one plan per pair, run concurrently
+with `run_restyle_plan_async`. Steps within a plan stay sequential; a shared semaphore
+bounds the number of backend calls in flight. Output layout matches `run_restyle_plan`.
+FAL requests queue in the shared scheduler (kontext/scheduler.py) as "batch" work,
+one session per token file, so brands take turns and interactive users go first.
+A plan that fails mid-way is resumed from its failed step (kontext/checkpoint.py),
+up to --resume-attempts times, without re-running the steps it finished.
+
+Usage:
+  python -m kontext.batch --images shots/ --tokens brand_a.json brand_b.json --concurrency 8
+  python -m kontext.batch --manifest jobs.jsonl   # {"image": ..., "tokens": ..., "logo": ..., "steps": [...]}
+  python -m kontext.batch --images shots/ --tokens brand_a.json --frame-archive   # one frames.kfa per run
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from PIL import Image
+
+from kontext import checkpoint, fal_backend, scheduler
+from kontext.brand_assets import plan_logo_colors
+from kontext.runner import resume_restyle_plan_async, run_restyle_plan_async
+from kontext.transfer import TRANSFER_MODES
+from kontext.transport import format_stats
+from restyle.optimizer import DEFAULT_PROFILE, PLAN_PROFILES, optimize_plan
+from restyle.planner import (
+    DEFAULT_STEP_KEYS,
+    RECOLOR_STEP_KEYS,
+    build_edit_plan,
+    load_tokens_from_json,
+)
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+RESUME_BACKOFF_S = float(os.getenv("KONTEXT_BATCH_RESUME_BACKOFF_S", "2.0"))
+
+
+@dataclass
+class BatchJob:
+    image: Path
+    tokens: Path
+    logo: Optional[Path] = None
+    steps: List[str] = field(default_factory=lambda: list(DEFAULT_STEP_KEYS))
+
+
+@dataclass
+class JobResult:
+    job: BatchJob
+    run_path: Optional[Path]
+    seconds: float
+    error: Optional[str] = None
+    resumes: int = 0
+
+
+def _expand_images(paths: Sequence[str]) -> List[Path]:
+    images: List[Path] = []
+    for raw in paths:
+        p = Path(raw)
+        if p.is_dir():
+            images.extend(sorted(q for q in p.iterdir() if q.suffix.lower() in IMAGE_SUFFIXES))
+        else:
+            images.append(p)
+    return images
+
+
+def load_manifest(path: Path) -> List[BatchJob]:
+    """Read a JSON list or JSON-lines file of {"image", "tokens", "logo"?, "steps"?} entries."""
+    text = path.read_text(encoding="utf-8").strip()
+    if text.startswith("["):
+        entries = json.loads(text)
+    else:
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    base = path.parent
+    jobs: List[BatchJob] = []
+    for entry in entries:
+        jobs.append(BatchJob(
+            image=base / entry["image"],
+            tokens=base / entry["tokens"],
+            logo=base / entry["logo"] if entry.get("logo") else None,
+            steps=list(entry.get("steps") or DEFAULT_STEP_KEYS),
+        ))
+    return jobs
+
+
+def jobs_from_product(images: Sequence[str], tokens: Sequence[str], steps: Optional[List[str]] = None,
+                      logo: Optional[str] = None) -> List[BatchJob]:
+    return [
+        BatchJob(image=img, tokens=Path(tok), logo=Path(logo) if logo else None,
+                 steps=list(steps or DEFAULT_STEP_KEYS))
+        for img in _expand_images(images)
+        for tok in tokens
+    ]
+
+
+async def run_job(job: BatchJob, backend: str, seed: int, strength_multiplier: float, seed_jitter: bool,
+                  save_dir: Path, inflight: asyncio.Semaphore, transfer: str = "png",
+                  profile: str = DEFAULT_PROFILE, recolor_steps: Optional[List[str]] = None,
+                  candidates: int = 1, frame_archive: Optional[bool] = None, resume_attempts: int = 0) -> JobResult:
+    """
+    Run one job. A plan that fails mid-way keeps its finished steps (kontext/checkpoint.py);
+    it is resumed from the failed step up to `resume_attempts` times, with a growing pause.
+    """
+    t0 = time.perf_counter()
+    record: Dict = {}
+    session = f"batch:{job.tokens.stem}"
+    try:
+        tokens = load_tokens_from_json(job.tokens.read_text(encoding="utf-8"))
+        image = await asyncio.to_thread(lambda: Image.open(job.image).convert("RGBA"))
+        logo = await asyncio.to_thread(lambda: Image.open(job.logo).convert("RGBA")) if job.logo else None
+        logo_colors = await asyncio.to_thread(plan_logo_colors, logo)
+        plan = optimize_plan(
+            build_edit_plan(tokens=tokens, steps=job.steps, brand_logo=logo, recolor_steps=recolor_steps,
+                            logo_colors=logo_colors), profile
+        )
+        await run_restyle_plan_async(
+            image=image,
+            plan=plan,
+            seed=seed,
+            backend=backend,
+            strength_multiplier=strength_multiplier,
+            seed_jitter=seed_jitter,
+            save_dir=save_dir,
+            inflight=inflight,
+            brand_logo=logo,
+            remote_chain=True,
+            transfer_encoding=transfer,
+            record=record,
+            candidates=candidates,
+            tokens=tokens,
+            session=session,
+            priority=scheduler.BATCH,
+            frame_archive=frame_archive,
+        )
+        return JobResult(job, Path(record["run_path"]), time.perf_counter() - t0)
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    run_path = Path(record["run_path"]) if record.get("run_path") else None
+    resumes = 0
+    while resumes < resume_attempts and record.get("status") == "failed":
+        resumes += 1
+        await asyncio.sleep(RESUME_BACKOFF_S * resumes)
+        record = {}
+        try:
+            await resume_restyle_plan_async(run_path, inflight=inflight, record=record, session=session,
+                                            priority=scheduler.BATCH)
+            return JobResult(job, Path(record["run_path"]), time.perf_counter() - t0, resumes=resumes)
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+        run_path = Path(record["run_path"]) if record.get("run_path") else run_path
+    return JobResult(job, run_path, time.perf_counter() - t0, error=error, resumes=resumes)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+async def run_batch(jobs: List[BatchJob], backend: str = "FAL (Kontext API)", seed: int = 12345,
+                    strength_multiplier: float = 1.0, seed_jitter: bool = True,
+                    save_dir: Path = Path("outputs"), concurrency: int = 4, transfer: str = "png",
+                    profile: str = DEFAULT_PROFILE, recolor_steps: Optional[List[str]] = None,
+                    candidates: int = 1, frame_archive: Optional[bool] = None, resume_attempts: int = 0) -> Dict:
+    """
+    Run every job; at most `concurrency` backend calls are in flight at once. Failed plans
+    are resumed from their failed step up to `resume_attempts` times (see `run_job`).
+    """
+    save_dir.mkdir(parents=True, exist_ok=True)
+    inflight = asyncio.Semaphore(max(1, concurrency))
+    # Keep a bounded number of plans (and their decoded frames) alive at a time.
+    active = asyncio.Semaphore(max(1, concurrency) * 2)
+
+    async def _guarded(job: BatchJob) -> JobResult:
+        async with active:
+            return await run_job(job, backend, seed, strength_multiplier, seed_jitter, save_dir, inflight, transfer,
+                                 profile, recolor_steps, candidates, frame_archive, resume_attempts)
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(_guarded(job) for job in jobs))
+    wall = time.perf_counter() - t0
+
+    ok = [r.seconds for r in results if r.error is None]
+    return {
+        "results": results,
+        "wall_seconds": wall,
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "resumes": sum(r.resumes for r in results),
+        "images_per_min": (len(ok) / wall * 60.0) if wall > 0 else 0.0,
+        "latency_p50": _percentile(ok, 50),
+        "latency_p90": _percentile(ok, 90),
+        "latency_p99": _percentile(ok, 99),
+        "http": fal_backend.transport_stats(),
+        "scheduler": scheduler.scheduler_stats(),
+    }
+
+
+def format_report(report: Dict) -> str:
+    lines = []
+    for r in report["results"]:
+        status = f"ok {r.seconds:.1f}s → {r.run_path}" if r.error is None else f"FAILED ({r.error})"
+        if r.resumes:
+            status += f" after {r.resumes} resume(s)"
+        if r.error is not None and r.run_path is not None:
+            status += f"; resume with: {checkpoint.resume_hint(r.run_path)}"
+        lines.append(f"[batch] {r.job.image.name} × {r.job.tokens.name}: {status}")
+    lines.append(
+        f"[batch] {report['succeeded']} ok, {report['failed']} failed in {report['wall_seconds']:.1f}s "
+        f"— {report['images_per_min']:.1f} images/min; "
+        f"plan latency p50={report['latency_p50']:.1f}s p90={report['latency_p90']:.1f}s p99={report['latency_p99']:.1f}s"
+    )
+    if report.get("resumes"):
+        lines.append(f"[batch] {report['resumes']} failed plan(s) resumed from their checkpoint")
+    lines.append(format_stats(report["http"]))
+    if report.get("scheduler", {}).get("granted"):
+        lines.append(scheduler.format_scheduler_stats(report["scheduler"]))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Batch-restyle screenshots with brand tokens.")
+    parser.add_argument("--images", nargs="*", default=[], help="Screenshot files or directories")
+    parser.add_argument("--tokens", nargs="*", default=[], help="Token JSON files (crossed with --images)")
+    parser.add_argument("--manifest", type=Path, help="JSON / JSON-lines job list (overrides --images/--tokens)")
+    parser.add_argument("--logo", help="Brand logo applied to every --images job")
+    parser.add_argument("--steps", nargs="*", help="Step keys (default: the UI defaults)")
+    parser.add_argument("--backend", default="FAL (Kontext API)")
+    parser.add_argument("--seed", type=int, default=12345)
+    parser.add_argument("--strength", type=float, default=1.0, help="Global strength multiplier")
+    parser.add_argument("--no-jitter", action="store_true", help="Use the same seed for every step")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max backend calls in flight")
+    parser.add_argument("--out", type=Path, default=Path("outputs"))
+    parser.add_argument("--transfer", choices=TRANSFER_MODES, default="webp_lossless",
+                        help="Wire encoding for intermediate FAL steps (the final step is always PNG)")
+    parser.add_argument("--profile", choices=PLAN_PROFILES, default=DEFAULT_PROFILE,
+                        help="Plan profile: fuse compatible steps into fewer calls (fast/balanced)")
+    parser.add_argument("--recolor-steps", nargs="*", choices=RECOLOR_STEP_KEYS, default=[],
+                        help="Run these pure color steps as a local pixel recolor (no model call)")
+    parser.add_argument("--candidates", type=int, default=1,
+                        help="Best-of-N: candidates per step (FAL num_images, max 4), scored locally")
+    parser.add_argument("--frame-archive", action="store_true", default=None,
+                        help="Store step frames as one delta-encoded frames.kfa per run (kontext/frame_archive.py)")
+    parser.add_argument("--resume-attempts", type=int, default=2,
+                        help="Resume a failed plan from its failed step up to this many times (0 = off)")
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        jobs = load_manifest(args.manifest)
+    else:
+        if not args.images or not args.tokens:
+            parser.error("provide --manifest or both --images and --tokens")
+        jobs = jobs_from_product(args.images, args.tokens, args.steps, args.logo)
+    if not jobs:
+        parser.error("no jobs found")
+
+    try:
+        from dotenv import load_dotenv  # type: ignore
+
+        load_dotenv()
+    except Exception:
+        pass
+
+    report = asyncio.run(run_batch(
+        jobs,
+        backend=args.backend,
+        seed=args.seed,
+        strength_multiplier=args.strength,
+        seed_jitter=not args.no_jitter,
+        save_dir=args.out,
+        concurrency=args.concurrency,
+        transfer=args.transfer,
+        profile=args.profile,
+        recolor_steps=args.recolor_steps,
+        candidates=args.candidates,
+        frame_archive=args.frame_archive,
+        resume_attempts=max(0, args.resume_attempts),
+    ))
+    print(format_report(report))
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
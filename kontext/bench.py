@@ -0,0 +1,212 @@
+"""
+End-to-end pipeline benchmark against the fake FAL service (kontext/fake_fal.py).
+Drives `run_restyle_plan` with the FAL backend across plan sizes and resolutions,
+so upload, queue, download, decode and save all run. It reports per-phase
+timings from the run trace (kontext/tracing.py) and the pipeline's own overhead
+(wall time minus queue wait and inference).
+
+Usage:
+  python -m kontext.bench --steps 1 3 8 --resolutions 1280x720 1920x1080 --repeats 3
+  python -m kontext.bench --save-baseline bench_baseline.json
+  python -m kontext.bench --baseline bench_baseline.json   # exit 1 on regression
+  python -m kontext.bench --replay recordings/run1          # recorded outputs instead of transforms
+  python -m kontext.bench --concurrent 32                   # 32 plans at once on one event loop
+  python -m kontext.bench --concurrent 32 --rate-limit 20   # fake 429s above 20 req/s (kontext/scheduler.py)
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+from kontext import fake_fal
+from kontext.batch import _percentile
+from kontext.hedging import format_hedge_stats, hedge_stats
+from kontext.runner import run_restyle_plan, run_restyle_plan_async
+from kontext.scheduler import format_scheduler_stats, scheduler_stats
+from kontext.transfer import TRANSFER_MODES
+from restyle.planner import DEFAULT_STEP_KEYS, EXAMPLE_TOKENS, build_edit_plan
+
+PHASES = ("encode", "upload", "queue_wait", "inference", "download", "decode", "save", "drift")
+
+
+def synthetic_screenshot(width: int, height: int) -> Image.Image:
+    """Deterministic UI-like frame: sidebar, cards, text rows, a bar chart."""
+    img = Image.new("RGB", (width, height), (245, 246, 248))
+    d = ImageDraw.Draw(img)
+    u = max(1, width // 160)
+    d.rectangle((0, 0, 24 * u, height), fill=(255, 255, 255))
+    for row in range(12):
+        d.rectangle((3 * u, (6 + row * 5) * u, 20 * u, (8 + row * 5) * u), fill=(220, 222, 228))
+    for col in range(3):
+        x0 = (28 + col * 44) * u
+        d.rounded_rectangle((x0, 6 * u, x0 + 40 * u, 40 * u), radius=2 * u, fill=(255, 255, 255),
+                            outline=(225, 227, 232))
+        for line in range(5):
+            d.text((x0 + 3 * u, (9 + line * 5) * u), "Revenue this quarter", fill=(30, 32, 38))
+        d.rectangle((x0 + 3 * u, 34 * u, x0 + 14 * u, 38 * u), fill=(37, 99, 235))
+    for bar in range(12):
+        top = (60 + (bar * 7) % 25) * u
+        d.rectangle(((30 + bar * 10) * u, top, (36 + bar * 10) * u, 90 * u), fill=(99, 102, 241))
+    return img
+
+
+def _plan(steps: int) -> List[Dict]:
+    keys = [DEFAULT_STEP_KEYS[i % len(DEFAULT_STEP_KEYS)] for i in range(steps)]
+    plan = build_edit_plan(EXAMPLE_TOKENS, list(dict.fromkeys(keys)))
+    # Repeat steps beyond the default set so large plans keep their length.
+    while len(plan) < steps:
+        plan.append(dict(plan[len(plan) % len(DEFAULT_STEP_KEYS)]))
+    return plan[:steps]
+
+
+async def _run_concurrent(image: Image.Image, plan: List[Dict], plans: int, options: Dict[str, Any]) -> List[Dict]:
+    records: List[Dict[str, Any]] = [{} for _ in range(plans)]
+    await asyncio.gather(*(
+        run_restyle_plan_async(image=image, plan=plan, seed=12345 + i, record=records[i], **options)
+        for i in range(plans)
+    ))
+    return records
+
+
+def run_case(steps: int, size: Tuple[int, int], repeats: int, save_dir: Path, transfer: str,
+             remote_chain: bool, hedge: bool = False, concurrent: int = 1) -> Dict[str, Any]:
+    """`concurrent` > 1 runs that many plans at once through `run_restyle_plan_async`."""
+    image = synthetic_screenshot(*size)
+    plan = _plan(steps)
+    walls: List[float] = []
+    firsts: List[float] = []
+    overheads: List[float] = []
+    peaks: List[float] = []
+    phases: Dict[str, List[float]] = {p: [] for p in PHASES}
+    options: Dict[str, Any] = dict(
+        backend="FAL (Kontext API)", strength_multiplier=1.0, seed_jitter=True, save_dir=save_dir,
+        use_cache=False, remote_chain=remote_chain, transfer_encoding=transfer, hedge=hedge,
+        on_step=lambda update: None,  # enables first-frame timing
+    )
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        if concurrent > 1:
+            records = asyncio.run(_run_concurrent(image, plan, concurrent, options))
+        else:
+            records = [{}]
+            run_restyle_plan(image=image, plan=plan, seed=12345, record=records[0], **options)
+        for record in records:
+            wall = float(record["trace_summary"]["wall_s"]) if concurrent > 1 else time.perf_counter() - t0
+            spent = record["trace_summary"]["phases"]
+            walls.append(wall)
+            firsts.append(float(record.get("first_frame_s", wall)))
+            peaks.append(float((record.get("memory") or {}).get("peak_mb") or 0.0))
+            overheads.append(max(0.0, wall - spent.get("queue_wait", 0.0) - spent.get("inference", 0.0)))
+            for p in PHASES:
+                phases[p].append(spent.get(p, 0.0))
+    return {
+        "case": f"steps={steps} {size[0]}x{size[1]}" + (f" ×{concurrent}" if concurrent > 1 else ""),
+        "steps": steps,
+        "resolution": list(size),
+        "repeats": repeats,
+        "wall_p50_s": round(_percentile(walls, 50), 4),
+        "wall_p99_s": round(_percentile(walls, 99), 4),
+        "first_frame_p50_s": round(_percentile(firsts, 50), 4),
+        "overhead_p50_s": round(_percentile(overheads, 50), 4),
+        "peak_rss_mb": round(max(peaks, default=0.0), 1),
+        "phases_p50_s": {p: round(_percentile(v, 50), 4) for p, v in phases.items()},
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float,
+            min_delta_s: float = 0.1) -> List[str]:
+    """Cases whose pipeline overhead grew by more than `tolerance` (and `min_delta_s`) vs the baseline."""
+    base = {r["case"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        old = base.get(r["case"])
+        if old is None:
+            continue
+        delta = r["overhead_p50_s"] - old["overhead_p50_s"]
+        if delta > min_delta_s and r["overhead_p50_s"] > old["overhead_p50_s"] * (1.0 + tolerance):
+            regressions.append(
+                f"[bench] REGRESSION {r['case']}: overhead {old['overhead_p50_s']:.3f}s → "
+                f"{r['overhead_p50_s']:.3f}s (+{delta:.3f}s)"
+            )
+    return regressions
+
+
+def format_result(r: Dict[str, Any]) -> str:
+    ph = r["phases_p50_s"]
+    return (
+        f"[bench] {r['case']}: wall p50={r['wall_p50_s']:.3f}s p99={r['wall_p99_s']:.3f}s first_frame={r.get('first_frame_p50_s', 0.0):.3f}s overhead={r['overhead_p50_s']:.3f}s "
+        f"peak_rss={r.get('peak_rss_mb', 0.0):.0f}MB "
+        + " ".join(f"{p}={ph[p]:.3f}s" for p in PHASES)
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the restyle pipeline against a fake FAL service.")
+    parser.add_argument("--steps", nargs="*", type=int, default=[1, 3, 8], help="Plan sizes")
+    parser.add_argument("--resolutions", nargs="*", default=["1280x720", "1920x1080"], help="WxH input sizes")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--queue", default="lognormal:0.5,0.5", help="Queue latency spec (seconds)")
+    parser.add_argument("--inference", default="lognormal:4.0,0.25", help="Inference latency spec (seconds)")
+    parser.add_argument("--time-scale", type=float, default=0.02,
+                        help="Multiplier on simulated latency (0 = pipeline overhead only)")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="503s from the fake CDN (retried)")
+    parser.add_argument("--transform", choices=fake_fal.TRANSFORMS, default="tint")
+    parser.add_argument("--rate-limit", type=float, help="Fake FAL answers 429 above this many requests/s")
+    parser.add_argument("--replay", help="Recording directory to serve instead of transforms")
+    parser.add_argument("--transfer", choices=TRANSFER_MODES, default="png")
+    parser.add_argument("--no-remote-chain", action="store_true")
+    parser.add_argument("--hedge", action="store_true", help="Hedge slow FAL requests (kontext/hedging.py)")
+    parser.add_argument("--concurrent", type=int, default=1, help="Plans run at once via run_restyle_plan_async")
+    parser.add_argument("--out", type=Path, help="Write results JSON here")
+    parser.add_argument("--baseline", type=Path, help="Compare against a previous results JSON")
+    parser.add_argument("--save-baseline", type=Path, help="Write results JSON as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative overhead growth")
+    parser.add_argument("--min-delta", type=float, default=0.1, help="Ignore overhead growth below this (seconds)")
+    args = parser.parse_args(argv)
+
+    sizes = [tuple(int(v) for v in res.lower().split("x")) for res in args.resolutions]
+    fake = fake_fal.install(
+        queue=args.queue, inference=args.inference, time_scale=args.time_scale,
+        failure_rate=args.failure_rate, http_error_rate=args.http_error_rate,
+        transform=args.transform, replay=args.replay, rate_limit=args.rate_limit,
+    )
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="kontext-bench-") as tmp:
+            for steps in args.steps:
+                for size in sizes:
+                    r = run_case(steps, size, max(1, args.repeats), Path(tmp), args.transfer,
+                                 not args.no_remote_chain, args.hedge, max(1, args.concurrent))
+                    results.append(r)
+                    print(format_result(r))
+    finally:
+        service = fake.summary()
+        fake_fal.uninstall()
+    print(f"[bench] fake FAL: {json.dumps(service)}")
+    if args.hedge:
+        print(format_hedge_stats(hedge_stats()))
+    print(format_scheduler_stats(scheduler_stats()))
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": vars(args), "results": results}
+    for path in (args.out, args.save_baseline):
+        if path:
+            path.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")),
+                              args.tolerance, args.min_delta)
+        for line in regressions:
+            print(line)
+        if regressions:
+            return 1
+        print(f"[bench] no regressions vs {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,197 @@
+"""
+Brand-asset analysis: the dominant palette of a logo, clustered in CIELAB.
+Opaque pixels are binned (5 bits per channel), then a weighted k-means groups
+the bins; clusters closer than MERGE_DELTA_E are merged, so anti-aliased edges
+fold into the color they blend from instead of showing up as extra "dominant"
+colors. Each palette entry reports the most common real color in its cluster.
+
+Palettes are memoized by logo content hash in memory, so repeated plans and batch
+runs for the same brand skip the analysis; set a directory to also keep them as
+JSON on disk across processes.
+Env:
+  KONTEXT_PALETTE_CACHE_DIR=outputs/.kontext_palettes   # unset / "off" = memory only
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from kontext.cache import image_digest
+from kontext.recolor_backend import rgb_to_lab
+
+PALETTE_VERSION = "v1"
+PALETTE_SIZE = 5
+ANALYSIS_LONG_EDGE = 256
+ALPHA_FLOOR = 128        # semi-transparent edge pixels are blends with the background
+KMEANS_ITERATIONS = 16
+MERGE_DELTA_E = 12.0     # ΔE76 under which two clusters are one brand color
+MIN_SHARE = 0.01         # clusters covering less of the opaque area are dropped
+MEMORY_ENTRIES = 256
+
+_LOCK = threading.Lock()
+_MEMORY: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+_STATS: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "computed": 0}
+
+
+def _cache_dir() -> Optional[Path]:
+    setting = os.getenv("KONTEXT_PALETTE_CACHE_DIR", "").strip()
+    if not setting or setting.lower() in ("0", "off", "false", "no"):
+        return None
+    return Path(setting).expanduser()
+
+
+def _bins(img: Image.Image) -> tuple:
+    """(mean RGB per occupied bin, pixel count per bin) over the opaque pixels."""
+    w, h = img.size
+    scale = min(1.0, float(ANALYSIS_LONG_EDGE) / max(w, h))
+    small = img.resize((max(1, int(round(w * scale))), max(1, int(round(h * scale)))), Image.NEAREST)
+    px = np.asarray(small, dtype=np.uint8).reshape(-1, 4)
+    rgb = px[px[:, 3] >= ALPHA_FLOOR, :3]
+    if rgb.size == 0:
+        return np.zeros((0, 3), dtype=np.uint8), np.zeros(0)
+    bins = ((rgb[:, 0] >> 3).astype(np.int32) << 10) | ((rgb[:, 1] >> 3).astype(np.int32) << 5) | (rgb[:, 2] >> 3)
+    counts = np.bincount(bins, minlength=1 << 15)
+    occupied = np.flatnonzero(counts)
+    sums = np.stack([np.bincount(bins, weights=rgb[:, c], minlength=1 << 15)[occupied] for c in range(3)], axis=-1)
+    means = np.clip(sums / counts[occupied, None] + 0.5, 0, 255).astype(np.uint8)
+    return means, counts[occupied].astype(np.float64)
+
+
+def _kmeans(labs: np.ndarray, weights: np.ndarray, k: int) -> np.ndarray:
+    """Weighted Lloyd's k-means with deterministic farthest-point seeding; returns labels."""
+    k = min(k, len(labs))
+    centers = [labs[int(np.argmax(weights))]]
+    for _ in range(1, k):
+        d2 = ((labs[:, None, :] - np.asarray(centers)[None, :, :]) ** 2).sum(-1).min(axis=1)
+        centers.append(labs[int(np.argmax(weights * d2))])
+    c = np.asarray(centers, dtype=np.float64)
+    labels = np.zeros(len(labs), dtype=np.int64)
+    for _ in range(KMEANS_ITERATIONS):
+        labels = ((labs[:, None, :] - c[None, :, :]) ** 2).sum(-1).argmin(axis=1)
+        mass = np.bincount(labels, weights=weights, minlength=k)
+        moved = np.stack([np.bincount(labels, weights=weights * labs[:, i], minlength=k) for i in range(3)], -1)
+        updated = np.where(mass[:, None] > 0, moved / np.maximum(mass, 1e-9)[:, None], c)
+        if np.allclose(updated, c, atol=1e-3):
+            break
+        c = updated
+    return labels
+
+
+def analyze_palette(img: Image.Image, size: int = PALETTE_SIZE) -> List[Dict[str, Any]]:
+    """
+    Uncached palette of an image: up to `size` entries {"hex", "share", "lab"}, largest first.
+    `share` is the fraction of opaque pixels; `hex` is the most common color of the cluster.
+    """
+    rgb, weights = _bins(img.convert("RGBA"))
+    if len(rgb) == 0:
+        return []
+    labs = rgb_to_lab(rgb).astype(np.float64)
+    labels = _kmeans(labs, weights, size * 2)  # over-split, then merge near-duplicates
+    total = float(weights.sum())
+    clusters: List[Dict[str, Any]] = []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        w = weights[members]
+        clusters.append({
+            "lab": (labs[members] * w[:, None]).sum(0) / w.sum(),
+            "weight": float(w.sum()),
+            "peak": members[int(np.argmax(w))],
+            "peak_weight": float(w.max()),
+        })
+    clusters.sort(key=lambda cl: -cl["weight"])
+    merged: List[Dict[str, Any]] = []
+    for cl in clusters:
+        for into in merged:
+            if np.linalg.norm(into["lab"] - cl["lab"]) < MERGE_DELTA_E:
+                into["lab"] = (into["lab"] * into["weight"] + cl["lab"] * cl["weight"]) / (into["weight"] + cl["weight"])
+                into["weight"] += cl["weight"]
+                if cl["peak_weight"] > into["peak_weight"]:
+                    into["peak"], into["peak_weight"] = cl["peak"], cl["peak_weight"]
+                break
+        else:
+            merged.append(dict(cl))
+    merged.sort(key=lambda cl: -cl["weight"])
+    palette: List[Dict[str, Any]] = []
+    for cl in merged:
+        share = cl["weight"] / total
+        if share < MIN_SHARE:
+            continue
+        r, g, b = (int(v) for v in rgb[cl["peak"]])
+        palette.append({
+            "hex": f"#{r:02X}{g:02X}{b:02X}",
+            "share": round(share, 4),
+            "lab": [round(float(v), 2) for v in cl["lab"]],
+        })
+    return palette[:size]
+
+
+def _remember(key: str, palette: List[Dict[str, Any]]) -> None:
+    with _LOCK:
+        _MEMORY[key] = palette
+        _MEMORY.move_to_end(key)
+        while len(_MEMORY) > MEMORY_ENTRIES:
+            _MEMORY.popitem(last=False)
+
+
+def logo_palette(logo: Image.Image, size: int = PALETTE_SIZE) -> List[Dict[str, Any]]:
+    """`analyze_palette`, memoized by the logo's pixels (in memory, then on disk)."""
+    img = logo.convert("RGBA")
+    key = hashlib.sha256(f"{PALETTE_VERSION}:{size}:{image_digest(img)}".encode("ascii")).hexdigest()
+    with _LOCK:
+        cached = _MEMORY.get(key)
+        if cached is not None:
+            _MEMORY.move_to_end(key)
+            _STATS["memory_hits"] += 1
+            return [dict(entry) for entry in cached]
+    root = _cache_dir()
+    path = root / f"{key}.json" if root is not None else None
+    if path is not None:
+        try:
+            palette = json.loads(path.read_text(encoding="utf-8"))
+            _remember(key, palette)
+            with _LOCK:
+                _STATS["disk_hits"] += 1
+            return [dict(entry) for entry in palette]
+        except FileNotFoundError:
+            pass
+        except Exception as exc:
+            print(f"[palette] Ignoring unreadable cache entry {path}: {exc}")
+    palette = analyze_palette(img, size)
+    with _LOCK:
+        _STATS["computed"] += 1
+    _remember(key, palette)
+    if path is not None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(palette), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception as exc:
+            print(f"[palette] Failed to cache palette: {exc}")
+    return [dict(entry) for entry in palette]
+
+
+def palette_hex(logo: Image.Image, size: int = PALETTE_SIZE) -> List[str]:
+    return [entry["hex"] for entry in logo_palette(logo, size)]
+
+
+def palette_cache_stats() -> Dict[str, int]:
+    with _LOCK:
+        return dict(_STATS)
+
+
+def plan_logo_colors(logo: Optional[Image.Image], size: int = PALETTE_SIZE) -> Optional[List[str]]:
+    """`palette_hex` for `build_edit_plan(logo_colors=...)`: None without a logo or if analysis fails."""
+    if logo is None:
+        return None
+    try:
+        return palette_hex(logo, size)
+    except Exception as exc:
+        print(f"[palette] Failed to analyze logo colors: {exc}")
+        return None
@@ -0,0 +1,152 @@
+"""
+Content-addressed on-disk cache for Kontext step results.
+Entries are PNG files named by a hash of the input pixels plus the full request
+arguments, so a repeat plan with a deterministic seed becomes a local lookup.
+Eviction is bounded by total size (least recently used first) and entry age.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+CACHE_VERSION = "v1"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB
+DEFAULT_MAX_AGE_S = 7 * 24 * 3600  # one week
+
+_CACHES: Dict[str, "StepCache"] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def image_digest(img: Image.Image) -> str:
+    """Hash of the decoded pixels (mode + size + raw bytes)."""
+    h = hashlib.sha256()
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode("ascii"))
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def step_key(input_digest: str, args: Dict[str, Any]) -> str:
+    """Cache key for one backend call: input pixels + every request argument."""
+    payload = json.dumps(args, sort_keys=True, default=str)
+    h = hashlib.sha256()
+    h.update(CACHE_VERSION.encode("ascii"))
+    h.update(input_digest.encode("ascii"))
+    h.update(payload.encode("utf-8"))
+    return h.hexdigest()
+
+
+class StepCache:
+    """Thread-safe, size- and age-bounded PNG cache keyed by `step_key`."""
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES, max_age_s: float = DEFAULT_MAX_AGE_S):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.max_age_s = float(max_age_s)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.png"
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        path = self._path(key)
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        if time.time() - st.st_mtime > self.max_age_s:
+            self._remove(path, st.st_size)
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            with Image.open(path) as im:
+                img = im.copy()
+            os.utime(path, None)  # bump recency for LRU eviction
+        except Exception:
+            self._remove(path, st.st_size)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return img
+
+    def put(self, key: str, img: Image.Image) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        img.save(tmp, format="PNG")
+        size = tmp.stat().st_size
+        os.replace(tmp, path)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size
+        self.evict()
+
+    def _remove(self, path: Path, size: int) -> None:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes = max(0, self._total_bytes - size)
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until under max_bytes."""
+        with self._lock:
+            if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+                return 0
+        entries = []
+        for p in self.root.glob("*/*.png"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, p in sorted(entries):
+            if now - mtime <= self.max_age_s and total <= self.max_bytes:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        with self._lock:
+            self._total_bytes = total
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def get_cache(root: Path, max_bytes: Optional[int] = None, max_age_s: Optional[float] = None) -> StepCache:
+    """Process-wide cache per directory, so concurrent runs share one instance."""
+    env_bytes = os.getenv("KONTEXT_CACHE_MAX_BYTES")
+    env_age = os.getenv("KONTEXT_CACHE_MAX_AGE_S")
+    key = str(Path(root).resolve())
+    with _CACHES_LOCK:
+        cache = _CACHES.get(key)
+        if cache is None:
+            cache = StepCache(
+                Path(root),
+                max_bytes=max_bytes or int(env_bytes or DEFAULT_MAX_BYTES),
+                max_age_s=max_age_s or float(env_age or DEFAULT_MAX_AGE_S),
+            )
+            _CACHES[key] = cache
+        return cache
@@ -0,0 +1,132 @@
+"""
+Checkpointed runs: every run folder's run.json is rewritten (atomically) before each
+step with the plan, tokens, run settings, seeds and a per-step status, so a run that
+fails at step 6 of 8 keeps its paid-for frames and can be resumed from step 6.
+
+Step status: "done" (frame on disk), "saving" (frame still being written or
+downloaded), "failed", "aborted" (layout drift), "pending". Run status: "running",
+"failed", "cancelled", "aborted", "complete". Failed, cancelled and interrupted runs
+(still "running" after their process died) are resumable; resuming starts a new run
+in the same output folder that reuses the finished frames
+(`runner.resume_restyle_plan`) and marks the old run with `resumed_by`.
+
+Usage:
+  python -m kontext.checkpoint outputs                       # list resumable runs
+  python -m kontext.checkpoint outputs/restyle_ab12cd34 --resume
+  python -m kontext.checkpoint outputs --resume-all          # e.g. after a batch with failures
+"""
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from kontext.frame_archive import frame_exists
+
+MANIFEST_NAME = "run.json"
+INPUT_NAME = "input.png"
+RESUMABLE = ("failed", "cancelled", "running")
+
+
+def write_manifest(run_path: Path, manifest: Dict[str, Any]) -> None:
+    """Replace run.json atomically: readers see the previous checkpoint or this one, never half of either."""
+    path = run_path / MANIFEST_NAME
+    tmp = path.with_name(f".{MANIFEST_NAME}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def load_manifest(run_path: Path) -> Dict[str, Any]:
+    return json.loads((run_path / MANIFEST_NAME).read_text(encoding="utf-8"))
+
+
+def completed_prefix(manifest: Dict[str, Any]) -> int:
+    """Number of leading steps whose frames are on disk and can be carried into a resumed run."""
+    run_path = Path(manifest.get("run_path", ""))
+    frames = manifest.get("frames") or []
+    count = 0
+    for idx, status in enumerate(manifest.get("step_status") or []):
+        if status != "done" or idx >= len(frames) or not frames[idx] or not frame_exists(run_path / frames[idx]):
+            break
+        count += 1
+    return count
+
+
+def is_resumable(manifest: Dict[str, Any]) -> bool:
+    return (manifest.get("status") in RESUMABLE and not manifest.get("resumed_by")
+            and bool(manifest.get("plan")) and manifest.get("input") is not None)
+
+
+def resumable_runs(save_dir: Path) -> List[Dict[str, Any]]:
+    """Manifests of the resumable runs under `save_dir`, oldest first."""
+    runs = []
+    for path in sorted(save_dir.glob(f"restyle_*/{MANIFEST_NAME}"), key=lambda p: p.stat().st_mtime):
+        try:
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if is_resumable(manifest):
+            runs.append(manifest)
+    return runs
+
+
+def mark_resumed(run_path: Path, run_id: str) -> None:
+    manifest = load_manifest(run_path)
+    manifest["resumed_by"] = run_id
+    write_manifest(run_path, manifest)
+
+
+def resume_hint(run_path: Path) -> str:
+    """The command that resumes the run in `run_path`."""
+    return f"python -m kontext.checkpoint {run_path} --resume"
+
+
+def format_status(manifest: Dict[str, Any]) -> str:
+    done = completed_prefix(manifest)
+    total = len(manifest.get("step_status") or [])
+    error = f" — {manifest['error']}" if manifest.get("error") else ""
+    return f"[checkpoint] {manifest.get('run_id')} {manifest.get('status')}: {done}/{total} step(s) done{error}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m kontext.checkpoint", description="List or resume unfinished runs.")
+    parser.add_argument("path", type=Path, help="Output folder (to list / --resume-all) or one run folder")
+    parser.add_argument("--resume", action="store_true", help="Resume the given run folder")
+    parser.add_argument("--resume-all", action="store_true", help="Resume every resumable run in the output folder")
+    args = parser.parse_args(argv)
+
+    if args.resume:
+        targets = [load_manifest(args.path)]
+    else:
+        targets = resumable_runs(args.path)
+    for manifest in targets:
+        print(format_status(manifest))
+    if not (args.resume or args.resume_all):
+        return 0
+
+    try:
+        from dotenv import load_dotenv  # type: ignore
+
+        load_dotenv()
+    except Exception:
+        pass
+
+    from kontext.runner import resume_restyle_plan
+
+    failed = 0
+    for manifest in targets:
+        record: Dict[str, Any] = {}
+        try:
+            _, logs = resume_restyle_plan(Path(manifest["run_path"]), record=record)
+            print("\n".join(logs))
+        except Exception as exc:
+            failed += 1
+            print(f"[checkpoint] resume of {manifest.get('run_id')} failed: {type(exc).__name__}: {exc}")
+            if record.get("run_path"):
+                print(f"[checkpoint] resume it again with: {resume_hint(record['run_path'])}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
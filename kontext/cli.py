@@ -0,0 +1,176 @@
+"""
+Headless restyle of one screenshot, from brand tokens or a saved plan file.
+Never imports Gradio; backend modules (and fal_client / requests) load only when
+a plan step uses them (kontext/backends.py), so recolor and dry-run runs start fast.
+
+Usage:
+  python -m kontext --image shot.png --tokens brand.json --logo logo.png --out outputs
+  python -m kontext --tokens brand.json --write-plan plan.json   # build only
+  python -m kontext --image shot.png --tokens brand.json --recolor-steps surfaces_and_background   # that step as a pixel recolor
+  python -m kontext --image shot.png --tokens brand_v2.json --previous outputs/restyle_ab12cd34   # reuse unchanged steps
+  python -m kontext --image shot.png --tokens brand.json --frame-archive   # step frames in one frames.kfa
+  python -m kontext --list-backends
+  python -m kontext --check-startup --max-startup 0.5   # exit 1 if cold start is slower
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from kontext.backends import FAL, backend_names
+
+# Modules a headless run must not pull in at import time.
+HEAVY_MODULES = ("gradio", "fal_client", "requests", "httpx")
+STARTUP_PROBE = (
+    "import sys, time; t0 = time.perf_counter(); import kontext.cli, kontext.runner; "
+    "t1 = time.perf_counter(); print(t1 - t0); print(','.join(m for m in {mods!r} if m in sys.modules))"
+)
+
+
+def check_startup(runs: int = 5) -> Dict[str, object]:
+    """Import kontext.cli + kontext.runner in fresh interpreters; median seconds and any heavy modules loaded."""
+    interpreter: List[float] = []
+    imports: List[float] = []
+    loaded: List[str] = []
+    for _ in range(max(1, runs)):
+        t0 = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE.format(mods=HEAVY_MODULES)],
+            capture_output=True, text=True, check=True, cwd=str(Path(__file__).resolve().parent.parent),
+        ).stdout.splitlines()
+        interpreter.append(time.perf_counter() - t0)
+        imports.append(float(out[0]))
+        loaded = [m for m in (out[1] if len(out) > 1 else "").split(",") if m]
+    return {
+        "process_s": round(sorted(interpreter)[len(interpreter) // 2], 4),
+        "import_s": round(sorted(imports)[len(imports) // 2], 4),
+        "heavy_modules": loaded,
+    }
+
+
+def _load_plan(args: argparse.Namespace, logo) -> Tuple[List[Dict], Optional[Dict]]:
+    """(plan, tokens); tokens are None for a saved plan."""
+    from restyle.optimizer import optimize_plan
+    from restyle.planner import DEFAULT_STEP_KEYS, build_edit_plan, load_tokens_from_json
+
+    if args.plan:
+        plan = json.loads(args.plan.read_text(encoding="utf-8"))
+        if not isinstance(plan, list):
+            raise ValueError(f"{args.plan}: expected a JSON list of steps")
+        return plan, None
+    tokens = load_tokens_from_json(args.tokens.read_text(encoding="utf-8"))
+    plan = build_edit_plan(tokens=tokens, steps=args.steps or list(DEFAULT_STEP_KEYS), brand_logo=logo,
+                           recolor_steps=args.recolor_steps)
+    return optimize_plan(plan, args.profile), tokens
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from restyle.optimizer import DEFAULT_PROFILE, PLAN_PROFILES
+    from restyle.planner import RECOLOR_STEP_KEYS
+
+    parser = argparse.ArgumentParser(prog="python -m kontext", description="Restyle one screenshot headlessly.")
+    parser.add_argument("--image", type=Path, help="Screenshot to restyle")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--tokens", type=Path, help="Brand token JSON (builds the plan)")
+    source.add_argument("--plan", type=Path, help="Plan JSON (a list of steps, e.g. from --write-plan)")
+    parser.add_argument("--write-plan", type=Path, help="Write the built plan here and exit without running")
+    parser.add_argument("--logo", type=Path, help="Brand logo reference")
+    parser.add_argument("--steps", nargs="*", help="Step keys (default: the UI defaults)")
+    parser.add_argument("--backend", choices=backend_names(), default=FAL,
+                        help="Whole-plan backend (pixel recolor is per step: --recolor-steps)")
+    parser.add_argument("--seed", type=int, default=12345)
+    parser.add_argument("--strength", type=float, default=1.0, help="Global strength multiplier")
+    parser.add_argument("--no-jitter", action="store_true", help="Use the same seed for every step")
+    parser.add_argument("--out", type=Path, default=Path("outputs"))
+    parser.add_argument("--profile", choices=PLAN_PROFILES, default=DEFAULT_PROFILE)
+    parser.add_argument("--recolor-steps", nargs="*", choices=RECOLOR_STEP_KEYS, default=[],
+                        help="Run these pure color steps as a local pixel recolor (no model call)")
+    parser.add_argument("--candidates", type=int, default=1, help="Best-of-N candidates per step")
+    parser.add_argument("--previous", type=Path,
+                        help="Earlier run folder; its frames are reused up to the first step the changes affect")
+    parser.add_argument("--frame-archive", action="store_true", default=None,
+                        help="Store step frames as one delta-encoded frames.kfa (kontext/frame_archive.py)")
+    parser.add_argument("--list-backends", action="store_true")
+    parser.add_argument("--check-startup", action="store_true", help="Measure cold import time and exit")
+    parser.add_argument("--max-startup", type=float, default=0.0, help="With --check-startup: fail above this (s)")
+    args = parser.parse_args(argv)
+
+    if args.list_backends:
+        print("\n".join(backend_names()))
+        return 0
+    if args.check_startup:
+        report = check_startup()
+        print(f"[startup] import {report['import_s']:.3f}s, process {report['process_s']:.3f}s (median of 5)")
+        if report["heavy_modules"]:
+            print(f"[startup] FAIL: loaded at import time: {', '.join(report['heavy_modules'])}")
+            return 1
+        if args.max_startup and report["import_s"] > args.max_startup:
+            print(f"[startup] FAIL: import {report['import_s']:.3f}s > {args.max_startup:.3f}s")
+            return 1
+        return 0
+    if args.plan is None and args.tokens is None:
+        parser.error("provide --tokens or --plan")
+    if args.image is None and args.write_plan is None:
+        parser.error("provide --image")
+
+    from PIL import Image
+
+    logo = Image.open(args.logo).convert("RGBA") if args.logo else None
+    plan, tokens = _load_plan(args, logo)
+    if args.write_plan:
+        args.write_plan.write_text(json.dumps(plan, indent=2), encoding="utf-8")
+        print(f"[plan] {len(plan)} step(s) → {args.write_plan}")
+        return 0
+
+    if args.backend == FAL:
+        try:
+            from dotenv import load_dotenv  # type: ignore
+
+            load_dotenv()
+        except Exception:
+            pass
+
+    from kontext.checkpoint import format_status
+    from kontext.runner import run_restyle_plan
+
+    previous = None
+    if args.previous:
+        previous = json.loads((args.previous / "run.json").read_text(encoding="utf-8"))
+
+    record: Dict = {}
+    image = Image.open(args.image).convert("RGBA")
+    try:
+        outputs, logs = run_restyle_plan(
+            image=image,
+            plan=plan,
+            seed=args.seed,
+            backend=args.backend,
+            strength_multiplier=args.strength,
+            seed_jitter=not args.no_jitter,
+            save_dir=args.out,
+            brand_logo=logo,
+            remote_chain=True,
+            record=record,
+            candidates=args.candidates,
+            tokens=tokens,
+            previous_run=previous,
+            frame_archive=args.frame_archive,
+        )
+    except Exception:
+        if not record.get("resume_hint"):
+            raise
+        print(format_status(record))
+        print(f"[cli] resume with: {record['resume_hint']}")
+        return 1
+    print("\n".join(logs))
+    if not record.get("final"):
+        return 1
+    print(f"[cli] final image → {Path(record['run_path']) / record['final']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
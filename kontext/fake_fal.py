@@ -0,0 +1,571 @@
+"""
+Local stand-in for `fal_client` and the `fal-ai/flux-kontext/dev` endpoint.
+Uploads and outputs are served over real HTTP from 127.0.0.1, so the pooled
+download/decode path in kontext/transport.py runs unchanged. Queue and inference
+latency are drawn from configurable distributions, failures can be injected at
+the API and HTTP layers (plus 429s above `rate_limit` requests/s), and outputs are deterministic transforms of the input
+(same image + prompt + seed → same bytes).
+
+  from kontext import fake_fal
+  fake = fake_fal.install(queue="lognormal:0.3,0.5", inference="lognormal:4,0.2", time_scale=0.05)
+  ...                         # run_restyle_plan(..., backend="FAL (Kontext API)")
+  print(fake.summary()); fake_fal.uninstall()
+
+Record/replay:
+  fake_fal.install_recorder("recordings/run1")   # wraps the real fal_client, saves calls + all output bytes
+  fake_fal.install(replay="recordings/run1")     # serves recorded outputs offline
+
+Latency specs: "fixed:S" | "uniform:LO,HI" | "lognormal:MEDIAN,SIGMA" (seconds).
+"""
+import asyncio
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import types
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+ENDPOINT = "fal-ai/flux-kontext/dev"
+TRANSFORMS = ("tint", "identity", "invert", "posterize")
+_INSTALLED: Dict[str, Any] = {"previous": None, "service": None}
+
+
+def parse_latency(spec: Optional[str]) -> Callable[[random.Random], float]:
+    """Sampler for a latency spec (seconds); None / "" → always 0."""
+    if not spec:
+        return lambda rng: 0.0
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v.strip()]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        mu, sigma = math.log(max(values[0], 1e-6)), values[1]
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"Bad latency spec {spec!r}; expected fixed:S, uniform:LO,HI or lognormal:MEDIAN,SIGMA")
+
+
+def _content_digest(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def request_key(endpoint: str, arguments: Dict[str, Any], input_digest: str) -> str:
+    """Replay key: endpoint + arguments, with `image_url` replaced by the input's content digest."""
+    args = dict(arguments)
+    args["image_url"] = input_digest
+    payload = json.dumps({"endpoint": endpoint, "arguments": args}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class InjectedFailure(RuntimeError):
+    """Raised by the fake API when failure injection fires."""
+
+
+class RateLimited(InjectedFailure):
+    """Raised like an HTTP 429 when requests arrive faster than the fake's `rate_limit`."""
+
+    status_code = 429
+
+
+class Queued:
+    def __init__(self, position: int):
+        self.position = position
+
+
+class InProgress:
+    def __init__(self, logs: Optional[List[Dict[str, Any]]] = None):
+        self.logs = logs or []
+
+
+class Completed:
+    def __init__(self, logs: Optional[List[Dict[str, Any]]] = None, metrics: Optional[Dict[str, Any]] = None):
+        self.logs = logs or []
+        self.metrics = metrics or {}
+
+
+class _BlobHandler(BaseHTTPRequestHandler):
+    service: "FakeFal"
+
+    def do_GET(self) -> None:  # noqa: N802
+        blob = self.service._blob_for_path(self.path)
+        if blob is None:
+            self.send_error(404)
+            return
+        if self.service._roll(self.service.http_error_rate):
+            self.service._count("http_errors")
+            self.send_error(503)
+            return
+        data, content_type = blob
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class FakeFal:
+    """In-process fake of the FAL queue + CDN. Use `install()` to route `fal_client` to it."""
+
+    def __init__(
+        self,
+        queue: Optional[str] = None,
+        inference: Optional[str] = "lognormal:4.0,0.25",
+        upload: Optional[str] = None,
+        failure_rate: float = 0.0,
+        http_error_rate: float = 0.0,
+        transform: str = "tint",
+        time_scale: float = 1.0,
+        seed: int = 0,
+        replay: Optional[str] = None,
+        rate_limit: Optional[float] = None,
+    ):
+        if transform not in TRANSFORMS:
+            raise ValueError(f"Unknown transform {transform!r}; expected one of {TRANSFORMS}")
+        self.queue_latency = parse_latency(queue)
+        self.inference_latency = parse_latency(inference)
+        self.upload_latency = parse_latency(upload)
+        self.failure_rate = float(failure_rate)
+        self.http_error_rate = float(http_error_rate)
+        self.transform = transform
+        self.time_scale = float(time_scale)
+        self.replay = _Recording(Path(replay)) if replay else None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._blobs: Dict[str, Tuple[bytes, str]] = {}
+        self._digests: Dict[str, str] = {}  # url → content digest
+        self.calls: List[Dict[str, Any]] = []
+        self.rate_limit = float(rate_limit) if rate_limit else None  # requests/s (wall clock), burst of 1 s
+        self._allowance = (self.rate_limit or 0.0, time.perf_counter())
+        self._active = 0
+        self.counters: Dict[str, int] = {"uploads": 0, "requests": 0, "failures": 0, "http_errors": 0,
+                                         "rate_limited": 0, "peak_in_flight": 0}
+
+        handler = type("BlobHandler", (_BlobHandler,), {"service": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-fal-cdn", daemon=True)
+        self._thread.start()
+
+    def _roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < rate
+
+    def _sample(self, sampler: Callable[[random.Random], float]) -> float:
+        with self._lock:
+            return max(0.0, sampler(self._rng))
+
+    def _admit(self, endpoint: str) -> None:
+        if self.rate_limit is None:
+            return
+        with self._lock:
+            tokens, last = self._allowance
+            now = time.perf_counter()
+            tokens = min(self.rate_limit, tokens + (now - last) * self.rate_limit)
+            admitted = tokens >= 1.0
+            self._allowance = (tokens - 1.0 if admitted else tokens, now)
+            if not admitted:
+                self.counters["rate_limited"] += 1
+        if not admitted:
+            raise RateLimited(f"429 Too Many Requests for {endpoint}")
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def _blob_for_path(self, path: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            return self._blobs.get(path.split("?", 1)[0].rsplit("/", 1)[-1])
+
+    def put_blob(self, data: bytes, content_type: str, ext: str) -> str:
+        name = f"{uuid.uuid4().hex}.{ext}"
+        url = f"{self.base_url}/blobs/{name}"
+        with self._lock:
+            self._blobs[name] = (data, content_type)
+            self._digests[url] = _content_digest(data)
+        return url
+
+    def _input_bytes(self, url: str) -> Tuple[bytes, str]:
+        blob = self._blob_for_path(url) if url.startswith(self.base_url) else None
+        if blob is None:
+            raise InjectedFailure(f"Fake FAL cannot resolve image_url {url!r}")
+        with self._lock:
+            return blob[0], self._digests[url]
+
+    def render(self, data: bytes, arguments: Dict[str, Any]) -> Tuple[bytes, str, str]:
+        """Deterministic edit of the input bytes → (data, content_type, ext)."""
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        rgb = img.convert("RGB")
+        if self.transform == "tint":
+            token = f"{arguments.get('prompt', '')}|{arguments.get('seed', 0)}".encode("utf-8")
+            r, g, b = hashlib.sha256(token).digest()[:3]
+            rgb = Image.blend(rgb, Image.new("RGB", rgb.size, (r, g, b)), 0.12)
+        elif self.transform == "invert":
+            rgb = ImageOps.invert(rgb)
+        elif self.transform == "posterize":
+            rgb = ImageOps.posterize(rgb, 4)
+        buf = io.BytesIO()
+        if arguments.get("output_format") == "jpeg":
+            rgb.save(buf, format="JPEG", quality=90)
+            return buf.getvalue(), "image/jpeg", "jpg"
+        rgb.save(buf, format="PNG")
+        return buf.getvalue(), "image/png", "png"
+
+    def run(self, endpoint: str, arguments: Dict[str, Any],
+            on_queue_update: Optional[Callable[[Any], None]] = None) -> Dict[str, Any]:
+        """Blocking request: queue wait, inference, output upload. Returns the FAL-shaped result."""
+        self._admit(endpoint)
+        self._count("requests")
+        with self._lock:
+            self._active += 1
+            self.counters["peak_in_flight"] = max(self.counters["peak_in_flight"], self._active)
+        try:
+            return self._run(endpoint, arguments, on_queue_update)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _run(self, endpoint: str, arguments: Dict[str, Any],
+             on_queue_update: Optional[Callable[[Any], None]]) -> Dict[str, Any]:
+        queue_s = self._sample(self.queue_latency)
+        inference_s = self._sample(self.inference_latency)
+        call: Dict[str, Any] = {"endpoint": endpoint, "queue_s": queue_s, "inference_s": inference_s}
+        with self._lock:
+            self.calls.append(call)
+        if on_queue_update is not None:
+            on_queue_update(Queued(position=0))
+        time.sleep(queue_s * self.time_scale)
+        if on_queue_update is not None:
+            on_queue_update(InProgress())
+        time.sleep(inference_s * self.time_scale)
+        if self._roll(self.failure_rate):
+            self._count("failures")
+            call["failed"] = True
+            raise InjectedFailure(f"Injected failure for {endpoint}")
+        return self._result(endpoint, arguments, call)
+
+    def _result(self, endpoint: str, arguments: Dict[str, Any], call: Dict[str, Any]) -> Dict[str, Any]:
+        data, digest = self._input_bytes(arguments["image_url"])
+        recorded = self.replay.lookup(request_key(endpoint, arguments, digest)) if self.replay else None
+        if self.replay is not None and recorded is None:
+            raise InjectedFailure(f"No recording for this request ({endpoint}); re-record or disable replay")
+        if recorded is not None:
+            outputs, result = recorded
+        else:
+            # num_images > 1: one candidate per seed offset, like the real sampler's batch.
+            outputs = [
+                self.render(data, {**arguments, "seed": int(arguments.get("seed", 0)) + i})
+                for i in range(max(1, int(arguments.get("num_images", 1))))
+            ]
+            result = {"seed": arguments.get("seed", 0), "prompt": arguments.get("prompt", "")}
+        result = dict(result)
+        result["images"] = []
+        call["output_bytes"] = 0
+        for out, content_type, ext in outputs:
+            url = self.put_blob(out, content_type, ext)
+            call["output_bytes"] += len(out)
+            img = Image.open(io.BytesIO(out))
+            result["images"].append({"url": url, "width": img.size[0], "height": img.size[1],
+                                     "content_type": content_type})
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self.calls)
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "simulated_queue_s": round(sum(c["queue_s"] for c in calls) * self.time_scale, 4),
+            "simulated_inference_s": round(sum(c["inference_s"] for c in calls) * self.time_scale, 4),
+            "output_bytes": sum(c.get("output_bytes", 0) for c in calls),
+        }
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def module(self) -> types.ModuleType:
+        """A `fal_client`-shaped module bound to this service."""
+        svc = self
+        mod = types.ModuleType("fal_client")
+        mod.Queued, mod.InProgress, mod.Completed = Queued, InProgress, Completed
+        mod.FAKE = svc
+
+        def upload(data: bytes, content_type: str = "application/octet-stream", file_name: str = "file") -> str:
+            time.sleep(svc._sample(svc.upload_latency) * svc.time_scale)
+            svc._count("uploads")
+            return svc.put_blob(bytes(data), content_type, file_name.rsplit(".", 1)[-1])
+
+        async def upload_async(data: bytes, content_type: str = "application/octet-stream",
+                               file_name: str = "file") -> str:
+            return await asyncio.to_thread(upload, data, content_type, file_name)
+
+        def subscribe(application: str, arguments: Dict[str, Any], with_logs: bool = False,
+                      on_queue_update: Optional[Callable[[Any], None]] = None, **_: Any) -> Dict[str, Any]:
+            return svc.run(application, arguments, on_queue_update if with_logs else None)
+
+        def submit(application: str, arguments: Dict[str, Any], **_: Any) -> "_SyncHandle":
+            return _SyncHandle(svc, application, arguments)
+
+        async def submit_async(application: str, arguments: Dict[str, Any], **_: Any) -> "_AsyncHandle":
+            return _AsyncHandle(_SyncHandle(svc, application, arguments))
+
+        mod.upload, mod.upload_async = upload, upload_async
+        mod.subscribe, mod.submit, mod.submit_async = subscribe, submit, submit_async
+        return mod
+
+
+class _SyncHandle:
+    """Mirrors fal_client's SyncRequestHandle: the request runs on a background thread."""
+
+    def __init__(self, service: FakeFal, application: str, arguments: Dict[str, Any]):
+        self.request_id = uuid.uuid4().hex
+        self._done = threading.Event()
+        self._result: Optional[Dict[str, Any]] = None
+        self._error: Optional[BaseException] = None
+        self._started = False
+        self._cancelled = False
+
+        def _run() -> None:
+            try:
+                def _mark(update: Any) -> None:
+                    if isinstance(update, InProgress):
+                        self._started = True
+                self._result = service.run(application, arguments, _mark)
+            except BaseException as exc:
+                self._error = exc
+            finally:
+                self._done.set()
+
+        threading.Thread(target=_run, name=f"fake-fal-{self.request_id[:8]}", daemon=True).start()
+
+    def status(self, with_logs: bool = False) -> Any:
+        if self._done.is_set():
+            return Completed()
+        return InProgress() if self._started else Queued(position=0)
+
+    def get(self) -> Dict[str, Any]:
+        self._done.wait()
+        if self._cancelled:
+            raise InjectedFailure("Request was cancelled")
+        if self._error is not None:
+            raise self._error
+        return self._result  # type: ignore[return-value]
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+
+class _AsyncHandle:
+    def __init__(self, handle: _SyncHandle):
+        self._handle = handle
+        self.request_id = handle.request_id
+
+    async def status(self, with_logs: bool = False) -> Any:
+        return self._handle.status(with_logs)
+
+    async def iter_events(self, with_logs: bool = False, interval: float = 0.1) -> Any:
+        """Status updates until Completed, like fal_client's; polls as often as `get` does."""
+        while True:
+            status = self._handle.status(with_logs)
+            yield status
+            if isinstance(status, Completed):
+                return
+            await asyncio.sleep(min(interval, 0.005))
+
+    async def get(self) -> Dict[str, Any]:
+        # Poll instead of parking a worker thread per request, so hundreds can be awaited at once.
+        while not self._handle._done.is_set():
+            await asyncio.sleep(0.005)
+        return self._handle.get()
+
+    async def cancel(self) -> None:
+        self._handle.cancel()
+
+
+class _Recording:
+    """On-disk recording: calls.jsonl (key → result, output blobs) + blobs/<sha256>.<ext>."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        path = root / "calls.jsonl"
+        if path.exists():
+            for line in path.read_text(encoding="utf-8").splitlines():
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]] = entry
+
+    def lookup(self, key: str) -> Optional[Tuple[List[Tuple[bytes, str, str]], Dict[str, Any]]]:
+        """(outputs as [(data, content_type, ext)], result without "images"), or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        # Recordings made before multi-image support hold one "blob" + "content_type".
+        blobs = entry.get("blobs") or [{"blob": entry["blob"], "content_type": entry["content_type"]}]
+        outputs = [((self.root / "blobs" / b["blob"]).read_bytes(), b["content_type"], b["blob"].rsplit(".", 1)[-1])
+                   for b in blobs]
+        return outputs, entry["result"]
+
+    def add(self, key: str, result: Dict[str, Any], outputs: List[Tuple[bytes, str, str]], elapsed_s: float) -> None:
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        blobs = []
+        for data, content_type, ext in outputs:
+            blob = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+            (self.root / "blobs" / blob).write_bytes(data)
+            blobs.append({"blob": blob, "content_type": content_type})
+        entry = {"key": key, "blobs": blobs, "result": result, "elapsed_s": round(elapsed_s, 3)}
+        with self._lock:
+            self._entries[key] = entry
+            with (self.root / "calls.jsonl").open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+class _RecordingHandle:
+    """Wraps a real request handle; the result is recorded when `get()` returns it."""
+
+    def __init__(self, handle: Any, record: Callable[[Dict[str, Any]], None]):
+        self._handle = handle
+        self._record = record
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._handle, name)
+
+    def get(self) -> Dict[str, Any]:
+        result = self._handle.get()
+        self._record(result)
+        return result
+
+
+class _AsyncRecordingHandle(_RecordingHandle):
+    async def get(self) -> Dict[str, Any]:  # type: ignore[override]
+        result = await self._handle.get()
+        await asyncio.to_thread(self._record, result)
+        return result
+
+
+def _recorder_module(real: types.ModuleType, root: Path) -> types.ModuleType:
+    """
+    Wrap the real client: remember upload digests, save every result (subscribe, or `get()`
+    on a submitted handle, sync or async) with the bytes of all of its output images.
+    """
+    import requests
+
+    recording = _Recording(root)
+    digests: Dict[str, str] = {}
+    lock = threading.Lock()
+    mod = types.ModuleType("fal_client")
+    for name in dir(real):
+        if not name.startswith("__"):
+            setattr(mod, name, getattr(real, name))
+
+    def _remember(url: str, data: bytes) -> str:
+        with lock:
+            digests[url] = _content_digest(bytes(data))
+        return url
+
+    def _record(application: str, arguments: Dict[str, Any], result: Any, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        images = result.get("images") if isinstance(result, dict) else None
+        if not images:
+            return
+        outputs = []
+        for image in images:
+            resp = requests.get(image["url"], timeout=60)
+            resp.raise_for_status()
+            content_type = resp.headers.get("Content-Type", "image/png").split(";")[0]
+            _remember(image["url"], resp.content)
+            outputs.append((resp.content, content_type, "jpg" if "jpeg" in content_type else "png"))
+        with lock:
+            input_digest = digests.get(arguments.get("image_url", ""), "unknown")
+        stored = {k: v for k, v in result.items() if k != "images"}
+        recording.add(request_key(application, arguments, input_digest), stored, outputs, elapsed)
+
+    def upload(data: bytes, content_type: str = "application/octet-stream", file_name: str = "file") -> str:
+        return _remember(real.upload(data, content_type=content_type, file_name=file_name), data)
+
+    async def upload_async(data: bytes, content_type: str = "application/octet-stream",
+                           file_name: str = "file") -> str:
+        return _remember(await real.upload_async(data, content_type=content_type, file_name=file_name), data)
+
+    def subscribe(application: str, arguments: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = real.subscribe(application, arguments=arguments, **kwargs)
+        _record(application, arguments, result, started)
+        return result
+
+    def submit(application: str, arguments: Dict[str, Any], **kwargs: Any) -> _RecordingHandle:
+        started = time.perf_counter()
+        handle = real.submit(application, arguments=arguments, **kwargs)
+        return _RecordingHandle(handle, lambda result: _record(application, arguments, result, started))
+
+    async def submit_async(application: str, arguments: Dict[str, Any], **kwargs: Any) -> _AsyncRecordingHandle:
+        started = time.perf_counter()
+        handle = await real.submit_async(application, arguments=arguments, **kwargs)
+        return _AsyncRecordingHandle(handle, lambda result: _record(application, arguments, result, started))
+
+    mod.upload, mod.upload_async = upload, upload_async
+    mod.subscribe, mod.submit, mod.submit_async = subscribe, submit, submit_async
+    return mod
+
+
+def _swap_module(mod: types.ModuleType, service: Optional[FakeFal]) -> None:
+    if _INSTALLED["previous"] is None:
+        _INSTALLED["previous"] = (sys.modules.get("fal_client"), os.environ.get("FAL_KEY"))
+    sys.modules["fal_client"] = mod
+    _INSTALLED["service"] = service
+
+
+def install(**config: Any) -> FakeFal:
+    """Route `import fal_client` to a fresh FakeFal (see FakeFal for options)."""
+    uninstall()
+    service = FakeFal(**config)
+    _swap_module(service.module(), service)
+    os.environ.setdefault("FAL_KEY", "fake-fal-key")
+    return service
+
+
+def install_recorder(root: str, client: Optional[types.ModuleType] = None) -> None:
+    """
+    Wrap `client` (default: the installed `fal_client`) so its calls are saved under `root`
+    for offline replay.
+    """
+    uninstall()
+    if client is None:
+        import fal_client as client
+
+    _swap_module(_recorder_module(client, Path(root)), None)
+
+
+def uninstall() -> None:
+    previous = _INSTALLED["previous"]
+    if previous is None:
+        return
+    module, key = previous
+    if module is None:
+        sys.modules.pop("fal_client", None)
+    else:
+        sys.modules["fal_client"] = module
+    if key is None:
+        os.environ.pop("FAL_KEY", None)
+    if _INSTALLED["service"] is not None:
+        _INSTALLED["service"].close()
+    _INSTALLED.update(previous=None, service=None)
@@ -2,19 +2,36 @@
 FAL backend for FLUX.1 Kontext [dev] editing.
 Requires:
   pip install fal-client requests pillow
+HTTP pooling / timeouts / retries: see kontext/transport.py
+Model requests are rate-limited and shared fairly between sessions: see kontext/scheduler.py
 Env:
   export FAL_KEY=YOUR_FAL_API_KEY   # or FAL_API_KEY (mapped automatically)
 """
+import asyncio
 import io
 import os
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Dict, List, Optional, Union
 
-import requests
 from PIL import Image
 
+from kontext import hedging, scheduler, tracing
+from kontext.remote import RemoteImage
+from kontext.transfer import encode_for_transfer, output_format_for
+from kontext.transport import get_transport
+
 _STATE = {"ready": False}
 
 
+def _upload_retry_errors() -> tuple:
+    """fal_client uploads go over httpx; retry its transport-level errors too."""
+    try:
+        import httpx
+    except Exception:
+        return ()
+    return (httpx.TransportError,)
+
+
 def init() -> None:
     """Verify SDK + API key (idempotent)."""
     if _STATE["ready"]:
@@ -32,24 +49,23 @@ def init() -> None:
     _STATE["ready"] = True
 
 
-def _image_to_bytes(img: Image.Image, fmt: str = "PNG") -> bytes:
-    buf = io.BytesIO()
-    img.save(buf, format=fmt)
-    buf.seek(0)
-    return buf.read()
+def _upload_image_to_fal(img: Image.Image, transfer: str = "png", final: bool = True,
+                         stats: Optional[Dict[str, Any]] = None) -> str:
+    """Encode per the transfer policy and upload (jittered retry on transient errors) → image_url."""
+    with tracing.span("encode", transfer=transfer):
+        data, content_type, ext = encode_for_transfer(img, transfer, final)
+    if stats is not None:
+        stats["upload_bytes"] = len(data)
+        stats["upload_format"] = ext
+    with tracing.span("upload", bytes=len(data)):
+        return get_transport().call_with_retry(
+            _upload_bytes_once, data, content_type, ext, retry_on=_upload_retry_errors()
+        )
 
 
-def _upload_image_to_fal(img: Image.Image) -> str:
-    """Upload input image → get URL for image_url."""
+def _upload_bytes_once(data: bytes, content_type: str, ext: str) -> str:
     import fal_client
-    try:
-        return fal_client.upload_image(img, format="png")
-    except Exception:
-        data = _image_to_bytes(img, "PNG")
-        try:
-            return fal_client.upload(data, content_type="image/png", file_name="input.png")
-        except Exception as e:
-            raise RuntimeError("FAL upload failed. Try: pip install -U fal-client") from e
+    return fal_client.upload(data, content_type=content_type, file_name=f"input.{ext}")
 
 
 def _first_image_url(result: Dict[str, Any]) -> Optional[str]:
@@ -76,73 +92,260 @@ def _first_image_url(result: Dict[str, Any]) -> Optional[str]:
     return None
 
 
-def _download(url: str) -> Image.Image:
-    resp = requests.get(url, timeout=60)
-    resp.raise_for_status()
-    return Image.open(io.BytesIO(resp.content)).convert("RGBA")
+def _image_urls(result: Dict[str, Any]) -> List[str]:
+    """Every output URL of a multi-image (`num_images` > 1) response, in order."""
+    images = result.get("images") if isinstance(result, dict) else None
+    urls = [item.get("url") for item in images or [] if isinstance(item, dict)]
+    return [u for u in urls if isinstance(u, str)]
 
 
-def apply_edit(
-    image: Image.Image,
-    prompt: str,
-    negative_prompt: str = "",
-    strength: float = 0.3,  # kept for API compat
-    seed: int = 0,          # forwarded to API when available
-    region_hint: str = "global",
-) -> Image.Image:
-    """
-    Call: fal-ai/flux-kontext/dev via fal_client.subscribe, then return edited PIL image.
-    We append the negative prompt as 'Constraints:' to match the available arguments.
-    """
-    init()
-    import fal_client
+def _download(url: str, stats: Optional[Dict[str, Any]] = None) -> Image.Image:
+    img, received = get_transport().fetch_image(url)
+    if stats is not None:
+        stats["download_bytes"] = received
+    with tracing.span("decode", convert="RGBA"):
+        return img.convert("RGBA")
+
+
+def transport_stats() -> Dict[str, int]:
+    """Connection pool counters for the shared download/upload transport."""
+    return get_transport().stats()
+
+
+ENDPOINT = "fal-ai/flux-kontext/dev"
+# Upper bound of the endpoint's `num_images` argument (candidates per call).
+MAX_NUM_IMAGES = 4
+# Cheaper settings for low-resolution previews (fewer denoising steps, faster kernels).
+PREVIEW_INFERENCE: Dict[str, Any] = {"num_inference_steps": 14, "acceleration": "regular"}
 
+
+def _build_arguments(prompt: str, negative_prompt: str, image_url: str, seed: int,
+                     output_format: str = "png", inference: Optional[Dict[str, Any]] = None,
+                     num_images: int = 1) -> Dict[str, Any]:
     combined_prompt = prompt.strip()
     if negative_prompt:
         combined_prompt += "\n\nConstraints: " + negative_prompt.strip()
 
-    image_url = _upload_image_to_fal(image)
-
     args: Dict[str, Any] = {
         "prompt": combined_prompt,
         "image_url": image_url,
         "num_inference_steps": 28,
         "guidance_scale": 2.5,
-        "num_images": 1,
+        "num_images": max(1, min(int(num_images), MAX_NUM_IMAGES)),
         "enable_safety_checker": True,
-        "output_format": "png",
+        "output_format": output_format,
         "acceleration": "none",
         "resolution_mode": "match_input",
     }
+    if inference:
+        args.update(inference)
     if isinstance(seed, int) and seed > 0:
         args["seed"] = seed
+    return args
+
+
+def _result_url_or_image(result: Dict[str, Any]) -> Union[str, Image.Image]:
+    out_url = _first_image_url(result)
+    if out_url:
+        return out_url
+    # Fallback if SDK returns base64 fields (rare)
+    if isinstance(result, dict):
+        b64 = result.get("image_base64") or result.get("output_base64")
+        if b64:
+            import base64
+            data = base64.b64decode(b64)
+            return Image.open(io.BytesIO(data)).convert("RGBA")
+    raise RuntimeError(f"FAL response had no output URL: {result}")
 
-    def _on_queue_update(update):
+
+def _record_queue_spans(submitted: float, started: Optional[float], done: float) -> None:
+    """queue_wait = submit → first InProgress update; inference = the rest (all of it if no update was seen)."""
+    if started is None:
+        tracing.record_span("inference", submitted, done - submitted, queue_split=False)
+        return
+    hedging.observe_queue_wait(started - submitted)
+    tracing.record_span("queue_wait", submitted, started - submitted)
+    tracing.record_span("inference", started, done - started)
+
+
+def apply_edit(
+    image: Union[Image.Image, RemoteImage],
+    prompt: str,
+    negative_prompt: str = "",
+    strength: float = 0.3,  # kept for API compat
+    seed: int = 0,          # forwarded to API when available
+    region_hint: str = "global",
+    remote: bool = False,
+    transfer: str = "png",
+    final_step: bool = True,
+    stats: Optional[Dict[str, Any]] = None,
+    inference: Optional[Dict[str, Any]] = None,
+    hedge: Optional[bool] = None,
+    num_images: int = 1,
+) -> Union[Image.Image, RemoteImage, List[Union[Image.Image, RemoteImage]]]:
+    """
+    Call: fal-ai/flux-kontext/dev via fal_client.subscribe, then return edited PIL image.
+    We append the negative prompt as 'Constraints:' to match the available arguments.
+    A `RemoteImage` input is sent by URL; with `remote=True` the output is returned
+    as a `RemoteImage` instead of being downloaded inline.
+    `transfer` picks the wire encoding for non-final steps (see kontext/transfer.py);
+    `stats`, if given, receives upload/download byte counts and formats.
+    `inference` overrides request arguments (e.g. PREVIEW_INFERENCE).
+    `hedge` (default: KONTEXT_HEDGE) submits via the queue API and sends one duplicate
+    if the request is still queued past the hedge threshold (see kontext/hedging.py).
+    `num_images` > 1 asks for that many candidates in the one call (up to MAX_NUM_IMAGES)
+    and returns them as a list.
+    """
+    init()
+    import fal_client
+
+    stats = stats if stats is not None else {}
+    if isinstance(image, RemoteImage):
+        image_url = image.url
+        stats["upload_bytes"] = 0
+    else:
+        image_url = _upload_image_to_fal(image, transfer, final_step, stats)
+
+    stats["output_format"] = output_format_for(transfer, final_step)
+    args = _build_arguments(prompt, negative_prompt, image_url, seed, stats["output_format"], inference, num_images)
+
+    if hedge is None:
+        hedge = hedging.enabled_by_default()
+    if hedge and hasattr(fal_client, "submit"):
+        result = scheduler.call(hedging.run_hedged, fal_client, ENDPOINT, args)
+        return _finish_result(result, remote, stats, num_images)
+
+    def _subscribe() -> Dict[str, Any]:
+        submitted = time.perf_counter()
+        progress: Dict[str, float] = {}
+
+        def _on_queue_update(update):
+            try:
+                if isinstance(update, fal_client.InProgress):
+                    progress.setdefault("started", time.perf_counter())
+                    for log in getattr(update, "logs", []) or []:
+                        msg = log.get("message")
+                        if msg:
+                            print(msg)
+            except Exception:
+                pass
+
+        result = fal_client.subscribe(
+            ENDPOINT,
+            arguments=args,
+            with_logs=True,
+            on_queue_update=_on_queue_update,
+        )
+        _record_queue_spans(submitted, progress.get("started"), time.perf_counter())
+        return result
+
+    result = scheduler.call(_subscribe)
+    return _finish_result(result, remote, stats, num_images)
+
+
+def _finish_result(result: Dict[str, Any], remote: bool, stats: Dict[str, Any],
+                   num_images: int = 1) -> Union[Image.Image, RemoteImage, List[Union[Image.Image, RemoteImage]]]:
+    if num_images > 1:
+        # Candidates share the wire stats; only the first one's download is counted.
+        urls = _image_urls(result)
+        if urls:
+            return [RemoteImage(url, stats=stats if i == 0 else {}) if remote else _download(url, stats if i == 0 else None)
+                    for i, url in enumerate(urls)]
+        return [_finish_result(result, remote, stats)]
+    out = _result_url_or_image(result)
+    if isinstance(out, Image.Image):
+        return out
+    if remote:
+        return RemoteImage(out, stats=stats)
+    return _download(out, stats)
+
+
+async def _upload_image_to_fal_async(img: Image.Image, transfer: str = "png", final: bool = True,
+                                     stats: Optional[Dict[str, Any]] = None) -> str:
+    import fal_client
+    upload_async = getattr(fal_client, "upload_async", None)
+    if upload_async is None:
+        return await asyncio.to_thread(_upload_image_to_fal, img, transfer, final, stats)
+    with tracing.span("encode", transfer=transfer):
+        data, content_type, ext = await asyncio.to_thread(encode_for_transfer, img, transfer, final)
+    if stats is not None:
+        stats["upload_bytes"] = len(data)
+        stats["upload_format"] = ext
+    with tracing.span("upload", bytes=len(data)):
         try:
-            if isinstance(update, fal_client.InProgress):
-                for log in getattr(update, "logs", []) or []:
-                    msg = log.get("message")
-                    if msg:
-                        print(msg)
+            return await upload_async(data, content_type=content_type, file_name=f"input.{ext}")
         except Exception:
-            pass
+            # Retry on the pooled sync path (jittered backoff) rather than failing the plan.
+            return await asyncio.to_thread(
+                get_transport().call_with_retry, _upload_bytes_once, data, content_type, ext,
+                retry_on=_upload_retry_errors(),
+            )
 
-    result = fal_client.subscribe(
-        "fal-ai/flux-kontext/dev",
-        arguments=args,
-        with_logs=True,
-        on_queue_update=_on_queue_update,
-    )
 
-    out_url = _first_image_url(result)
-    if not out_url:
-        # Fallback if SDK returns base64 fields (rare)
-        if isinstance(result, dict):
-            b64 = result.get("image_base64") or result.get("output_base64")
-            if b64:
-                import base64
-                data = base64.b64decode(b64)
-                return Image.open(io.BytesIO(data)).convert("RGBA")
-        raise RuntimeError(f"FAL response had no output URL: {result}")
-
-    return _download(out_url)
+async def apply_edit_async(
+    image: Union[Image.Image, RemoteImage],
+    prompt: str,
+    negative_prompt: str = "",
+    strength: float = 0.3,  # kept for API compat
+    seed: int = 0,
+    region_hint: str = "global",
+    remote: bool = False,
+    transfer: str = "png",
+    final_step: bool = True,
+    stats: Optional[Dict[str, Any]] = None,
+    inference: Optional[Dict[str, Any]] = None,
+    hedge: Optional[bool] = None,
+    num_images: int = 1,
+) -> Union[Image.Image, RemoteImage, List[Union[Image.Image, RemoteImage]]]:
+    """
+    Async variant of `apply_edit` built on fal_client.submit_async / handle.get(),
+    so many requests can be in flight from one event loop.
+    """
+    init()
+    import fal_client
+
+    stats = stats if stats is not None else {}
+    if isinstance(image, RemoteImage):
+        image_url = image.url
+        stats["upload_bytes"] = 0
+    else:
+        image_url = await _upload_image_to_fal_async(image, transfer, final_step, stats)
+
+    stats["output_format"] = output_format_for(transfer, final_step)
+    args = _build_arguments(prompt, negative_prompt, image_url, seed, stats["output_format"], inference, num_images)
+    if hedge is None:
+        hedge = hedging.enabled_by_default()
+    if hedge:
+        result = await scheduler.call_async(hedging.run_hedged_async, fal_client, ENDPOINT, args)
+    else:
+        result = await scheduler.call_async(_submit_and_get, fal_client, args)
+
+    if remote:
+        return _finish_result(result, remote, stats, num_images)
+    return await asyncio.to_thread(_finish_result, result, remote, stats, num_images)
+
+
+async def _submit_and_get(fal_client: Any, args: Dict[str, Any]) -> Dict[str, Any]:
+    submitted = time.perf_counter()
+    handle = await fal_client.submit_async(ENDPOINT, arguments=args)
+    started: Optional[float] = None
+    try:
+        # Status events split queue_wait from inference like the sync path's on_queue_update.
+        if hasattr(handle, "iter_events"):
+            async for event in handle.iter_events(with_logs=False):
+                if started is None and isinstance(event, fal_client.InProgress):
+                    started = time.perf_counter()
+        result = await handle.get()
+    except asyncio.CancelledError:
+        # The caller gave up (e.g. the user pressed Cancel): stop paying for the request.
+        await _cancel_quietly(handle)
+        raise
+    _record_queue_spans(submitted, started, time.perf_counter())
+    return result
+
+
+async def _cancel_quietly(handle: Any) -> None:
+    try:
+        await handle.cancel()
+    except Exception as exc:
+        print(f"[fal] Failed to cancel request: {exc}")
@@ -0,0 +1,377 @@
+"""
+Delta-encoded frame archive: a run's step frames in one append-only file.
+Consecutive steps mostly recolor small areas, so instead of one full PNG per step
+the archive stores a keyframe (PNG) and then, per frame, only the tiles that
+changed against an earlier step, as zlib-compressed byte deltas. A keyframe is
+written every KONTEXT_ARCHIVE_KEYFRAME_EVERY frames (so any step reconstructs from
+at most that many records), and for frames that changed almost everywhere when
+the PNG is the smaller encoding.
+
+Frames inside an archive are referenced as `<run>/frames.kfa#<step>`; `load_frame`
+and `frame_exists` accept those and plain PNG paths alike.
+
+File: b"KFA1", then records of (b"REC0", header length, payload length) + JSON header
++ payload. Headers: {"step", "kind": "key"|"delta", "base", "size", "mode", "tile", "tiles"}.
+
+Usage:
+  python -m kontext.frame_archive outputs/restyle_ab12cd34 --info
+  python -m kontext.frame_archive outputs/restyle_ab12cd34 --export pngs/
+  python -m kontext.frame_archive outputs/restyle_ab12cd34 --pack --remove-png   # archive an existing run
+Env:
+  KONTEXT_FRAME_ARCHIVE=0   KONTEXT_ARCHIVE_TILE=32   KONTEXT_ARCHIVE_KEYFRAME_EVERY=8
+"""
+import argparse
+import io
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from kontext import tracing
+from kontext.transfer import format_bytes
+
+ARCHIVE_NAME = "frames.kfa"
+MAGIC = b"KFA1"
+RECORD = struct.Struct("<4sII")
+RECORD_TAG = b"REC0"
+DELTA_MODES = ("RGB", "RGBA", "L", "LA")
+KEYFRAME_PNG_LEVEL = 6
+DELTA_ZLIB_LEVEL = 6
+LAST_FRAME_ZLIB_LEVEL = 1
+READER_CACHE = 8
+
+_READERS: "OrderedDict[str, FrameArchive]" = OrderedDict()
+_READERS_LOCK = threading.Lock()
+
+
+def enabled_by_default() -> bool:
+    return os.getenv("KONTEXT_FRAME_ARCHIVE", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def frame_ref(archive: Path, step: int) -> Path:
+    """Path-like reference to one frame inside an archive (`frames.kfa#03`)."""
+    return archive.with_name(f"{archive.name}#{step:02d}")
+
+
+def split_ref(path: Path) -> Tuple[Path, Optional[int]]:
+    """(archive path, step) for a frame reference; (path, None) for a plain image file."""
+    name, sep, step = Path(path).name.rpartition("#")
+    if sep and step.isdigit():
+        return Path(path).with_name(name), int(step)
+    return Path(path), None
+
+
+def _tiles(src: np.ndarray, tile: int) -> np.ndarray:
+    """(n_tiles, tile, tile, channels) copy of an (H, W[, C]) array, zero-padded to whole tiles."""
+    arr = src[:, :, None] if src.ndim == 2 else src
+    h, w, c = arr.shape
+    pad_h, pad_w = -h % tile, -w % tile
+    if pad_h or pad_w:
+        arr = np.pad(arr, ((0, pad_h), (0, pad_w), (0, 0)))
+    ty, tx = arr.shape[0] // tile, arr.shape[1] // tile
+    tiles = arr.reshape(ty, tile, tx, tile, c).swapaxes(1, 2).reshape(ty * tx, tile, tile, c)
+    return tiles.copy() if np.shares_memory(tiles, src) else tiles
+
+
+def _untile(tiles: np.ndarray, h: int, w: int, tile: int, squeeze: bool) -> np.ndarray:
+    c = tiles.shape[-1]
+    ty, tx = -(-h // tile), -(-w // tile)
+    arr = tiles.reshape(ty, tx, tile, tile, c).swapaxes(1, 2).reshape(ty * tile, tx * tile, c)[:h, :w]
+    return np.ascontiguousarray(arr[:, :, 0] if squeeze else arr)
+
+
+def _png_bytes(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=KEYFRAME_PNG_LEVEL)
+    return buf.getvalue()
+
+
+def _encode_delta(base: np.ndarray, arr: np.ndarray, tile: int) -> Tuple[bytes, int]:
+    """zlib(uint32 ids of changed tiles + their byte deltas); wrap-around uint8 arithmetic."""
+    diff = _tiles(arr - base, tile)
+    ids = np.flatnonzero(diff.reshape(len(diff), -1).any(axis=1)).astype("<u4")
+    return zlib.compress(ids.tobytes() + diff[ids].tobytes(), DELTA_ZLIB_LEVEL), len(ids)
+
+
+def _apply_delta(base: np.ndarray, payload: bytes, count: int, tile: int) -> np.ndarray:
+    raw = zlib.decompress(payload)
+    ids = np.frombuffer(raw, dtype="<u4", count=count)
+    tiles = _tiles(base, tile)
+    deltas = np.frombuffer(raw, dtype=np.uint8, offset=4 * count).reshape(count, tile, tile, tiles.shape[-1])
+    tiles[ids] += deltas
+    return _untile(tiles, base.shape[0], base.shape[1], tile, base.ndim == 2)
+
+
+class FrameArchive:
+    """Random-access reader; rescans the file when asked for a step it has not seen (the writer appends)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._records: Dict[int, Dict[str, Any]] = {}
+        self._scanned = 0
+        self._decoded: "OrderedDict[int, np.ndarray]" = OrderedDict()
+
+    def _scan(self) -> None:
+        with self.path.open("rb") as fh:
+            if self._scanned == 0:
+                if fh.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"{self.path} is not a frame archive")
+                self._scanned = len(MAGIC)
+            fh.seek(self._scanned)
+            while True:
+                head = fh.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                tag, header_len, payload_len = RECORD.unpack(head)
+                if tag != RECORD_TAG:
+                    raise ValueError(f"{self.path}: corrupt record at byte {self._scanned}")
+                header_bytes = fh.read(header_len)
+                if len(header_bytes) < header_len:
+                    return  # still being written
+                offset = self._scanned + RECORD.size + header_len
+                if offset + payload_len > os.fstat(fh.fileno()).st_size:
+                    return
+                header = json.loads(header_bytes)
+                header.update(offset=offset, length=payload_len)
+                self._records[header["step"]] = header
+                self._decoded.pop(header["step"], None)
+                self._scanned = offset + payload_len
+                fh.seek(self._scanned)
+
+    def steps(self) -> List[int]:
+        with self._lock:
+            self._scan()
+            return sorted(self._records)
+
+    def records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._scan()
+            return [dict(self._records[s]) for s in sorted(self._records)]
+
+    def _payload(self, record: Dict[str, Any]) -> bytes:
+        with self.path.open("rb") as fh:
+            fh.seek(record["offset"])
+            return fh.read(record["length"])
+
+    def _array(self, step: int) -> np.ndarray:
+        if step not in self._records:
+            self._scan()
+            if step not in self._records:
+                raise KeyError(f"{self.path} has no frame for step {step}")
+        if step in self._decoded:
+            return self._decoded[step]
+        chain = [self._records[step]]
+        while chain[-1]["kind"] == "delta" and chain[-1]["base"] not in self._decoded:
+            chain.append(self._records[chain[-1]["base"]])
+        arr = self._decoded.get(chain[-1]["base"]) if chain[-1]["kind"] == "delta" else None
+        for record in reversed(chain):
+            if record["kind"] == "key":
+                with Image.open(io.BytesIO(self._payload(record))) as im:
+                    arr = np.asarray(im.convert(record["mode"]))
+            else:
+                arr = _apply_delta(arr, self._payload(record), record["tiles"], record["tile"])
+            self._decoded[record["step"]] = arr
+            self._decoded.move_to_end(record["step"])
+            while len(self._decoded) > 2:
+                self._decoded.popitem(last=False)
+        return arr
+
+    def frame(self, step: int) -> Image.Image:
+        with self._lock:
+            arr = self._array(step)
+        return Image.fromarray(arr.copy())
+
+    def export(self, out_dir: Path, names: Optional[Dict[int, str]] = None) -> List[Path]:
+        """Write every frame as a standalone PNG (`NN_<name>.png`, or `NN.png` without names)."""
+        out_dir.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for step in self.steps():
+            name = (names or {}).get(step)
+            path = out_dir / (f"{step:02d}_{name}.png" if name else f"{step:02d}.png")
+            self.frame(step).save(path)
+            paths.append(path)
+        return paths
+
+    def stats(self) -> Dict[str, Any]:
+        records = self.records()
+        return {
+            "frames": len(records),
+            "keyframes": sum(r["kind"] == "key" for r in records),
+            "deltas": sum(r["kind"] == "delta" for r in records),
+            "bytes": self.path.stat().st_size,
+        }
+
+
+class FrameArchiveWriter:
+    """
+    Appends frames to an archive; thread-safe. Each frame is a delta against the nearest
+    earlier step already written (frames may arrive out of order), or a keyframe when
+    there is none, the size/mode differ, or the delta chain reached `keyframe_every`.
+    The newest frame is kept zlib-packed (not decoded) as the next delta's likely base.
+    """
+
+    def __init__(self, path: Path, tile: Optional[int] = None, keyframe_every: Optional[int] = None):
+        self.path = Path(path)
+        self.tile = max(8, int(tile or os.getenv("KONTEXT_ARCHIVE_TILE", "32")))
+        self.keyframe_every = max(1, int(keyframe_every or os.getenv("KONTEXT_ARCHIVE_KEYFRAME_EVERY", "8")))
+        self._lock = threading.Lock()
+        self._depth: Dict[int, int] = {}
+        self._meta: Dict[int, Tuple[Tuple[int, int], str]] = {}
+        self._last: Optional[Tuple[int, bytes, Tuple[int, ...]]] = None
+        self._counts = {"keyframes": 0, "deltas": 0, "raw_bytes": 0}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("wb") as fh:
+            fh.write(MAGIC)
+
+    def _base_array(self, step: int) -> np.ndarray:
+        if self._last is not None and self._last[0] == step:
+            _, packed, shape = self._last
+            return np.frombuffer(zlib.decompress(packed), dtype=np.uint8).reshape(shape)
+        return np.asarray(load_frame(frame_ref(self.path, step)))
+
+    def add(self, step: int, img: Image.Image) -> Path:
+        """Append `img` as `step`'s frame; returns its reference path."""
+        with tracing.span("save", file=f"{self.path.name}#{step:02d}"):
+            with self._lock:
+                mode = img.mode if img.mode in DELTA_MODES else "RGBA"
+                frame = img if img.mode == mode else img.convert(mode)
+                arr = np.asarray(frame)
+                earlier = [s for s in self._depth if s < step]
+                base = max(earlier) if earlier else None
+                header: Dict[str, Any] = {"step": step, "size": list(frame.size), "mode": mode, "tile": self.tile}
+                if (base is None or self._meta[base] != (frame.size, mode)
+                        or self._depth[base] + 1 >= self.keyframe_every):
+                    payload = _png_bytes(frame)
+                    header.update(kind="key", base=None)
+                    self._depth[step] = 0
+                    self._counts["keyframes"] += 1
+                else:
+                    payload, tiles = _encode_delta(self._base_array(base), arr, self.tile)
+                    header.update(kind="delta", base=base, tiles=tiles)
+                    if tiles * 2 > -(-frame.size[0] // self.tile) * -(-frame.size[1] // self.tile):
+                        # Most of the frame changed (a global tint, say): keep whichever encodes smaller.
+                        key = _png_bytes(frame)
+                        if len(key) < len(payload):
+                            payload = key
+                            header.update(kind="key", base=None)
+                            header.pop("tiles")
+                    if header["kind"] == "key":
+                        self._depth[step] = 0
+                        self._counts["keyframes"] += 1
+                    else:
+                        self._depth[step] = self._depth[base] + 1
+                        self._counts["deltas"] += 1
+                header_bytes = json.dumps(header).encode("utf-8")
+                with self.path.open("ab") as fh:
+                    fh.write(RECORD.pack(RECORD_TAG, len(header_bytes), len(payload)) + header_bytes + payload)
+                self._meta[step] = (frame.size, mode)
+                self._counts["raw_bytes"] += arr.nbytes
+                if self._last is None or step >= self._last[0]:
+                    self._last = (step, zlib.compress(arr.tobytes(), LAST_FRAME_ZLIB_LEVEL), arr.shape)
+        return frame_ref(self.path, step)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counts, "frames": len(self._depth), "bytes": self.path.stat().st_size}
+
+
+def _reader(path: Path) -> FrameArchive:
+    key = str(Path(path).resolve())
+    with _READERS_LOCK:
+        reader = _READERS.get(key)
+        if reader is None:
+            reader = _READERS[key] = FrameArchive(path)
+        _READERS.move_to_end(key)
+        while len(_READERS) > READER_CACHE:
+            _READERS.popitem(last=False)
+        return reader
+
+
+def load_frame(path: Path) -> Image.Image:
+    """Decode a frame: a plain image file, or `frames.kfa#NN` inside an archive."""
+    archive, step = split_ref(path)
+    with tracing.span("decode", file=Path(path).name):
+        if step is None:
+            with Image.open(archive) as im:
+                return im.copy()
+        return _reader(archive).frame(step)
+
+
+def frame_exists(path: Path) -> bool:
+    archive, step = split_ref(path)
+    if step is None:
+        return archive.exists()
+    try:
+        return archive.exists() and step in _reader(archive).steps()
+    except ValueError:
+        return False
+
+
+def pack_run(run_path: Path, remove_png: bool = False) -> Dict[str, Any]:
+    """Archive an existing run's `NN_<name>.png` step frames; with `remove_png`, delete them once verified."""
+    pattern = re.compile(r"^(\d{2})_(?!.*_drifted\.png$).+\.png$")
+    frames = sorted((int(m.group(1)), p) for p in run_path.iterdir() if (m := pattern.match(p.name)))
+    writer = FrameArchiveWriter(run_path / ARCHIVE_NAME)
+    png_bytes = 0
+    for step, path in frames:
+        with Image.open(path) as im:
+            writer.add(step, im.copy())
+        png_bytes += path.stat().st_size
+    reader = FrameArchive(writer.path)
+    for step, path in frames:
+        with Image.open(path) as im:
+            frame = reader.frame(step)
+            if not np.array_equal(np.asarray(frame), np.asarray(im.convert(frame.mode))):
+                raise ValueError(f"{path.name} did not round-trip through the archive; kept the PNGs")
+    if remove_png:
+        for _, path in frames:
+            path.unlink()
+    return {**reader.stats(), "png_bytes": png_bytes}
+
+
+def format_archive_stats(stats: Dict[str, Any]) -> str:
+    return (f"[archive] {stats['frames']} frame(s) → {ARCHIVE_NAME} {format_bytes(stats['bytes'])} "
+            f"({stats['keyframes']} keyframe(s), {stats['deltas']} delta(s))")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m kontext.frame_archive", description="Inspect or export a frame archive.")
+    parser.add_argument("run", type=Path, help="Run folder (or the .kfa file)")
+    parser.add_argument("--info", action="store_true")
+    parser.add_argument("--export", type=Path, help="Write standalone PNGs here")
+    parser.add_argument("--pack", action="store_true", help="Archive the run's step PNGs")
+    parser.add_argument("--remove-png", action="store_true", help="With --pack: delete the PNGs after verifying")
+    args = parser.parse_args(argv)
+
+    path = args.run if args.run.suffix == ".kfa" else args.run / ARCHIVE_NAME
+    if args.pack:
+        stats = pack_run(path.parent, remove_png=args.remove_png)
+        print(format_archive_stats(stats) + f" from {stats['frames']} PNG(s) of {stats['png_bytes']} bytes")
+    if args.info or not (args.pack or args.export):
+        reader = FrameArchive(path)
+        print(format_archive_stats(reader.stats()))
+        for r in reader.records():
+            base = f" base={r['base']:02d} tiles={r['tiles']}" if r["kind"] == "delta" else ""
+            print(f"  {r['step']:02d} {r['kind']:5s} {r['length']:>10d} B{base}")
+    if args.export:
+        names = {}
+        manifest = path.parent / "run.json"
+        if manifest.exists():
+            for i, name in enumerate(json.loads(manifest.read_text(encoding="utf-8")).get("steps", [])):
+                names[i] = name
+        paths = FrameArchive(path).export(args.export, names)
+        print(f"[archive] exported {len(paths)} PNG(s) → {args.export}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
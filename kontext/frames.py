@@ -0,0 +1,171 @@
+"""
+Memory-bounded frame retention for restyle runs.
+`FrameList` holds a run's step outputs but keeps only the newest frames decoded
+(KONTEXT_FRAMES_IN_MEMORY, default 1; 0 = keep all). Older frames are dropped
+once their PNG is on disk and decoded again on access, so a long plan at 4K
+holds one ~33 MB RGBA frame instead of one per step.
+
+`RssWatch` samples the process RSS while a run is active, so every run can report
+the peak it saw (process-wide: concurrent runs in one worker share the number).
+Env:
+  KONTEXT_FRAMES_IN_MEMORY=1   KONTEXT_THUMBNAIL_EDGE=512   KONTEXT_RSS_SAMPLE_S=0.05
+"""
+import os
+import threading
+import time
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from PIL import Image
+
+from kontext.frame_archive import load_frame
+
+THUMBNAIL_EDGE = int(os.getenv("KONTEXT_THUMBNAIL_EDGE", "512"))
+
+
+def frames_in_memory() -> int:
+    return max(0, int(os.getenv("KONTEXT_FRAMES_IN_MEMORY", "1")))
+
+
+class FrameList(Sequence):
+    """
+    Step frames of one run (None for steps without a frame yet). Indexing returns a
+    decoded image: the kept one, or a fresh load of the spilled PNG (or archived frame).
+    """
+
+    def __init__(self, keep: Optional[int] = None):
+        self.keep = frames_in_memory() if keep is None else max(0, int(keep))
+        self._images: List[Optional[Image.Image]] = []
+        self._paths: List[Optional[Path]] = []
+        self._saved: List[threading.Event] = []
+
+    def append(self, img: Optional[Image.Image], path: Optional[Path] = None) -> threading.Event:
+        """Add a frame; returns the event to set once `path` is written (frames spill only after that)."""
+        self._images.append(None)
+        self._paths.append(None)
+        self._saved.append(threading.Event())
+        return self.set(len(self._images) - 1, img, path)
+
+    def set(self, index: int, img: Optional[Image.Image], path: Optional[Path] = None) -> threading.Event:
+        saved = threading.Event()
+        self._images[index], self._paths[index], self._saved[index] = img, path, saved
+        self._spill()
+        return saved
+
+    def _spill(self) -> None:
+        if not self.keep:
+            return
+        kept = 0
+        for i in range(len(self._images) - 1, -1, -1):
+            if self._images[i] is None:
+                continue
+            if kept < self.keep or self._paths[i] is None:
+                kept += 1
+                continue
+            self._images[i] = None  # the writer holds its own reference until the PNG is on disk
+
+    def path(self, index: int) -> Optional[Path]:
+        return self._paths[index]
+
+    def paths(self) -> List[Optional[Path]]:
+        return list(self._paths)
+
+    def saved(self, index: int) -> bool:
+        """True once the frame at `index` is on disk."""
+        return self._paths[index] is not None and self._saved[index].is_set()
+
+    def decoded(self) -> int:
+        return sum(img is not None for img in self._images)
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        img = self._images[index]
+        if img is not None:
+            return img
+        path = self._paths[index]
+        if path is None:
+            return None
+        self._saved[index].wait()
+        return load_frame(path)
+
+    def thumbnails(self, long_edge: int = THUMBNAIL_EDGE) -> List[Image.Image]:
+        """Downscaled copies for galleries; frames are decoded one at a time."""
+        return [make_thumbnail(frame, long_edge) for frame in self if frame is not None]
+
+
+def make_thumbnail(img: Image.Image, long_edge: int = THUMBNAIL_EDGE) -> Image.Image:
+    thumb = img.copy()
+    thumb.thumbnail((long_edge, long_edge), Image.LANCZOS)
+    return thumb
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size in bytes (Linux /proc; elsewhere the lifetime peak, or None)."""
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    try:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(peak if sys.platform == "darwin" else peak * 1024)
+    except Exception:
+        return None
+
+
+_WATCHES: Set["RssWatch"] = set()
+_WATCH_LOCK = threading.Lock()
+_SAMPLER: Dict[str, Optional[threading.Thread]] = {"thread": None}
+
+
+def _sample() -> None:
+    interval = float(os.getenv("KONTEXT_RSS_SAMPLE_S", "0.05"))
+    while True:
+        rss = current_rss()
+        with _WATCH_LOCK:
+            if not _WATCHES:
+                _SAMPLER["thread"] = None
+                return
+            for watch in _WATCHES:
+                watch.observe(rss)
+        time.sleep(interval)
+
+
+class RssWatch:
+    """Peak process RSS between `start()` and `stop()`; one shared sampler thread serves every watch."""
+
+    def __init__(self) -> None:
+        self.start_bytes: Optional[int] = None
+        self.peak_bytes: Optional[int] = None
+
+    def observe(self, rss: Optional[int]) -> None:
+        if rss is not None and (self.peak_bytes is None or rss > self.peak_bytes):
+            self.peak_bytes = rss
+
+    def start(self) -> "RssWatch":
+        self.start_bytes = current_rss()
+        self.observe(self.start_bytes)
+        with _WATCH_LOCK:
+            _WATCHES.add(self)
+            if _SAMPLER["thread"] is None:
+                _SAMPLER["thread"] = threading.Thread(target=_sample, name="rss-sampler", daemon=True)
+                _SAMPLER["thread"].start()
+        return self
+
+    def stop(self) -> Dict[str, Optional[float]]:
+        self.observe(current_rss())
+        with _WATCH_LOCK:
+            _WATCHES.discard(self)
+        mb = 1024.0 * 1024.0
+        return {
+            "start_mb": None if self.start_bytes is None else round(self.start_bytes / mb, 1),
+            "peak_mb": None if self.peak_bytes is None else round(self.peak_bytes / mb, 1),
+        }
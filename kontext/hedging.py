@@ -0,0 +1,237 @@
+"""
+Hedged FAL requests: when a request has not left the queue within a threshold,
+submit a duplicate and take whichever finishes first; the loser is cancelled.
+Requests carry the same seed, so both copies produce the same image.
+`run_hedged` drives sync request handles, `run_hedged_async` async ones.
+
+The threshold is fixed (KONTEXT_HEDGE_AFTER_S=<seconds>) or learned as the p90
+of recent queue waits (default "auto"; falls back to KONTEXT_HEDGE_DEFAULT_S until
+enough waits have been seen). Hedges are capped process-wide at
+max(1, KONTEXT_HEDGE_MAX_RATIO × requests). A duplicate counts against the FAL
+in-flight cap (kontext/scheduler.py): it takes its own slot, and is skipped when no
+slot is free right away, so hedging never adds load beyond KONTEXT_FAL_MAX_INFLIGHT.
+Env:
+  KONTEXT_HEDGE=0                 # opt-in default for fal_backend.apply_edit
+  KONTEXT_HEDGE_AFTER_S=auto      KONTEXT_HEDGE_DEFAULT_S=8   KONTEXT_HEDGE_MIN_S=1
+  KONTEXT_HEDGE_MAX_RATIO=0.1     KONTEXT_HEDGE_POLL_S=0.25
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from kontext import scheduler, tracing
+
+MIN_SAMPLES = 20
+
+_LOCK = threading.Lock()
+_QUEUE_WAITS: Deque[float] = deque(maxlen=200)
+_COUNTERS: Dict[str, int] = {
+    "requests": 0,      # requests that went through the hedged path
+    "hedges": 0,        # duplicates submitted
+    "hedge_wins": 0,    # duplicate finished first
+    "primary_wins": 0,  # hedged, but the original finished first
+    "capped": 0,        # threshold passed but the ratio cap said no
+    "no_slot": 0,       # threshold passed but the scheduler had no free slot
+    "cancelled": 0,
+}
+
+
+def enabled_by_default() -> bool:
+    return os.getenv("KONTEXT_HEDGE", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def observe_queue_wait(seconds: float) -> None:
+    """Feed the learned threshold; called for every FAL request whose queue wait is known."""
+    with _LOCK:
+        _QUEUE_WAITS.append(max(0.0, float(seconds)))
+
+
+def hedge_threshold() -> float:
+    """Seconds in the queue before a duplicate is sent."""
+    floor = float(os.getenv("KONTEXT_HEDGE_MIN_S", "1"))
+    setting = os.getenv("KONTEXT_HEDGE_AFTER_S", "auto").strip().lower()
+    if setting != "auto":
+        return max(floor, float(setting))
+    with _LOCK:
+        waits = sorted(_QUEUE_WAITS)
+    if len(waits) < MIN_SAMPLES:
+        return max(floor, float(os.getenv("KONTEXT_HEDGE_DEFAULT_S", "8")))
+    return max(floor, waits[min(len(waits) - 1, int(0.9 * len(waits)))])
+
+
+def _take_hedge_budget() -> bool:
+    ratio = float(os.getenv("KONTEXT_HEDGE_MAX_RATIO", "0.1"))
+    with _LOCK:
+        if _COUNTERS["hedges"] + 1 <= max(1.0, ratio * _COUNTERS["requests"]):
+            _COUNTERS["hedges"] += 1
+            return True
+        _COUNTERS["capped"] += 1
+        return False
+
+
+def _take_duplicate_slot() -> bool:
+    """A scheduler slot plus hedge budget for one duplicate; the caller releases the slot when done."""
+    if not scheduler.try_acquire():
+        _count("no_slot")
+        return False
+    if _take_hedge_budget():
+        return True
+    scheduler.release()
+    return False
+
+
+def _count(key: str) -> None:
+    with _LOCK:
+        _COUNTERS[key] += 1
+
+
+def hedge_stats() -> Dict[str, int]:
+    with _LOCK:
+        return dict(_COUNTERS)
+
+
+def format_hedge_stats(stats: Dict[str, int]) -> str:
+    return (
+        f"[hedge] requests={stats['requests']} hedges={stats['hedges']} hedge_wins={stats['hedge_wins']} "
+        f"primary_wins={stats['primary_wins']} capped={stats['capped']} no_slot={stats.get('no_slot', 0)}"
+    )
+
+
+class _Hedge:
+    """
+    State and decisions of one hedged request, shared by `run_hedged` and `run_hedged_async`,
+    which only submit, poll, fetch and cancel. Live copies are [handle, submitted_at, started_at].
+    """
+
+    def __init__(self) -> None:
+        _count("requests")
+        self.poll = float(os.getenv("KONTEXT_HEDGE_POLL_S", "0.25"))
+        self.threshold = hedge_threshold()
+        self.live: List[List[Any]] = []
+        self.primary: Optional[List[Any]] = None
+        self.hedged = self.duplicated = False
+
+    def submitted(self, handle: Any) -> None:
+        entry = [handle, time.perf_counter(), None]
+        self.live.append(entry)
+        self.primary = self.primary or entry
+
+    def completed(self, fal_client: Any, entry: List[Any], status: Any) -> bool:
+        """Note when `entry` left the queue; True once it has a result to fetch."""
+        if entry[2] is None and isinstance(status, (fal_client.InProgress, fal_client.Completed)):
+            entry[2] = time.perf_counter()
+            observe_queue_wait(entry[2] - entry[1])
+        return isinstance(status, fal_client.Completed)
+
+    def failed(self, entry: List[Any]) -> bool:
+        """Drop a copy whose result raised; True if another copy may still succeed."""
+        self.live.remove(entry)
+        return bool(self.live)
+
+    def won(self, winner: List[Any]) -> List[Any]:
+        """Count the win and record the winner's spans; returns the handles to cancel."""
+        _, submitted, started = winner
+        done = time.perf_counter()
+        if self.duplicated:
+            _count("primary_wins" if winner is self.primary else "hedge_wins")
+        tracing.record_span("queue_wait", submitted, (started or done) - submitted, hedged=self.duplicated)
+        tracing.record_span("inference", started or done, done - (started or done))
+        losers = [entry[0] for entry in self.live if entry is not winner]
+        self.live = [winner]
+        return losers
+
+    def should_duplicate(self) -> bool:
+        """True (once) when nothing has started within the threshold and a slot and budget are free."""
+        waited = time.perf_counter() - self.live[0][1]
+        if self.hedged or any(e[2] is not None for e in self.live) or waited < self.threshold:
+            return False
+        self.hedged = True
+        if not _take_duplicate_slot():
+            return False
+        self.duplicated = True
+        print(f"[hedge] queue wait {waited:.1f}s ≥ {self.threshold:.1f}s; submitting a duplicate request")
+        return True
+
+    def close(self, result: Optional[Dict[str, Any]]) -> List[Any]:
+        """Release the duplicate's slot; without a result, returns every live handle to cancel."""
+        if self.duplicated:
+            scheduler.release()
+        return [] if result is not None else [entry[0] for entry in self.live]
+
+
+def run_hedged(fal_client: Any, endpoint: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Submit `arguments`, polling status; hedge once if nothing has started within
+    `hedge_threshold()`. Returns the first completed result.
+    """
+    hedge = _Hedge()
+    result: Optional[Dict[str, Any]] = None
+    try:
+        hedge.submitted(fal_client.submit(endpoint, arguments=arguments))
+        while True:
+            for entry in list(hedge.live):
+                if not hedge.completed(fal_client, entry, entry[0].status()):
+                    continue
+                try:
+                    result = entry[0].get()
+                except Exception:
+                    if hedge.failed(entry):
+                        continue  # the other copy may still succeed
+                    raise
+                for handle in hedge.won(entry):
+                    _cancel(handle)
+                return result
+            if hedge.should_duplicate():
+                hedge.submitted(fal_client.submit(endpoint, arguments=arguments))
+            time.sleep(hedge.poll)
+    finally:
+        # Without a result (an error escaped): stop paying for the copies still queued.
+        for handle in hedge.close(result):
+            _cancel(handle)
+
+
+async def run_hedged_async(fal_client: Any, endpoint: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """`run_hedged` on fal_client's async handles (submit_async / await status() / get())."""
+    hedge = _Hedge()
+    result: Optional[Dict[str, Any]] = None
+    try:
+        hedge.submitted(await fal_client.submit_async(endpoint, arguments=arguments))
+        while True:
+            for entry in list(hedge.live):
+                if not hedge.completed(fal_client, entry, await entry[0].status()):
+                    continue
+                try:
+                    result = await entry[0].get()
+                except Exception:
+                    if hedge.failed(entry):
+                        continue
+                    raise
+                for handle in hedge.won(entry):
+                    await _cancel_async(handle)
+                return result
+            if hedge.should_duplicate():
+                hedge.submitted(await fal_client.submit_async(endpoint, arguments=arguments))
+            await asyncio.sleep(hedge.poll)
+    finally:
+        # Also runs on CancelledError (e.g. the user pressed Cancel).
+        for handle in hedge.close(result):
+            await _cancel_async(handle)
+
+
+def _cancel(handle: Any) -> None:
+    try:
+        handle.cancel()
+        _count("cancelled")
+    except Exception as exc:
+        print(f"[hedge] Failed to cancel request: {exc}")
+
+
+async def _cancel_async(handle: Any) -> None:
+    try:
+        await handle.cancel()
+        _count("cancelled")
+    except Exception as exc:
+        print(f"[hedge] Failed to cancel request: {exc}")
@@ -0,0 +1,118 @@
+"""
+Incremental re-runs: reuse the unchanged prefix of a previous run's frames.
+While tuning, a designer edits one token group and re-runs; every step before the
+first affected one would produce the same frame again. Each run records a run key
+(input pixels + render settings) and one fingerprint per step (prompt, strength,
+seed, backend, ...); the next run in the same session with the same run key reuses
+frames while the fingerprints match and no token field in the step's `depends_on`
+(restyle/planner.py) changed, then runs the rest as usual.
+
+Runs with a `session` are remembered in memory (last run per session and run key);
+pass `previous_run=` (a run's record or run.json) to compare against any run.
+Env:
+  KONTEXT_REUSE_PREFIX=1   KONTEXT_REUSE_SESSIONS=256
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from kontext.frame_archive import frame_exists
+
+_LOCK = threading.Lock()
+_RUNS: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+
+
+def enabled_by_default() -> bool:
+    return os.getenv("KONTEXT_REUSE_PREFIX", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _digest(payload: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+def run_key(input_digest: str, **settings: Any) -> str:
+    """Everything besides the steps that decides the frames: input pixels, render size, inference, ..."""
+    return _digest({"input": input_digest, **settings})
+
+
+def step_fingerprint(step: Dict[str, Any], backend: str, strength: float, seed: Optional[int], candidates: int,
+                     output_format: str) -> str:
+    """What one step's output depends on, given the same input frame. `seed` None = random per run."""
+    return _digest({
+        "prompt": step.get("prompt"),
+        "negative_prompt": step.get("negative_prompt"),
+        "region_hint": step.get("region_hint", "global"),
+        "recolor": step.get("recolor"),
+        "goal_colors": step.get("goal_colors") if candidates > 1 else None,
+        "backend": backend,
+        "strength": round(float(strength), 6),
+        "seed": seed,
+        "candidates": candidates,
+        "output_format": output_format,
+    })
+
+
+def changed_fields(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> List[str]:
+    """Dotted paths of token fields that differ ("colors.link", "radius.button", "brand", ...)."""
+    old, new = old or {}, new or {}
+    changed: List[str] = []
+    for name in sorted(set(old) | set(new)):
+        a, b = old.get(name), new.get(name)
+        if isinstance(a, dict) or isinstance(b, dict):
+            a, b = a if isinstance(a, dict) else {}, b if isinstance(b, dict) else {}
+            changed += [f"{name}.{key}" for key in sorted(set(a) | set(b)) if a.get(key) != b.get(key)]
+        elif a != b:
+            changed.append(name)
+    return changed
+
+
+def remember(session: str, manifest: Dict[str, Any]) -> None:
+    limit = max(1, int(os.getenv("KONTEXT_REUSE_SESSIONS", "256")))
+    key = (session, manifest.get("run_key", ""))
+    with _LOCK:
+        _RUNS[key] = manifest
+        _RUNS.move_to_end(key)
+        while len(_RUNS) > limit:
+            _RUNS.popitem(last=False)
+
+
+def last_run(session: str, key: str) -> Optional[Dict[str, Any]]:
+    with _LOCK:
+        return _RUNS.get((session, key))
+
+
+def forget(session: str) -> None:
+    with _LOCK:
+        for key in [k for k in _RUNS if k[0] == session]:
+            del _RUNS[key]
+
+
+def reusable_prefix(previous: Optional[Dict[str, Any]], key: str, fingerprints: List[str],
+                    depends_on: List[List[str]], changed: List[str]) -> Tuple[int, str]:
+    """
+    (number of leading steps whose frames can be reused, why the next one cannot).
+    `changed` are the token fields that differ from the previous run's tokens.
+    """
+    if not previous:
+        return 0, "no previous run"
+    if previous.get("run_key") != key:
+        return 0, "input image or run settings changed"
+    old = previous.get("step_fingerprints") or []
+    frames = previous.get("frames") or []
+    run_path = Path(previous.get("run_path", ""))
+    changed_set = set(changed)
+    for idx, fingerprint in enumerate(fingerprints):
+        if idx >= len(old) or idx >= len(frames) or not frames[idx]:
+            return idx, "previous run stopped here"
+        hit = sorted(changed_set.intersection(depends_on[idx]))
+        if hit:
+            return idx, f"{', '.join(hit[:3])}{' …' if len(hit) > 3 else ''} changed"
+        if old[idx] != fingerprint:
+            return idx, "step settings changed"
+        if not frame_exists(run_path / frames[idx]):
+            return idx, "previous frame no longer on disk"
+    return len(fingerprints), "nothing changed"
@@ -2,6 +2,8 @@
 Local backend stub for Kontext [dev]. Returns input unchanged.
 You can wire Diffusers/ComfyUI here later if you want an offline path.
 """
+import asyncio
+
 from PIL import Image
 
 
@@ -18,3 +20,15 @@ def apply_edit(
     region_hint: str = "global",
 ) -> Image.Image:
     return image
+
+
+async def apply_edit_async(
+    image: Image.Image,
+    prompt: str,
+    negative_prompt: str = "",
+    strength: float = 0.3,
+    seed: int = 0,
+    region_hint: str = "global",
+) -> Image.Image:
+    # A real local model is GPU/CPU bound: keep it off the event loop.
+    return await asyncio.to_thread(apply_edit, image, prompt, negative_prompt, strength, seed, region_hint)
@@ -0,0 +1,105 @@
+"""
+Layout-drift scoring between a step output and the plan input.
+Both frames are reduced to grayscale gradient maps (long edge 768 px) and compared
+with windowed SSIM, weighted by edge strength. Recoloring (even light → dark
+inversion) keeps edges in place and scores near 0; moved elements, rewritten text
+and blur add, remove or soften edges and push the score towards 1.
+
+Best-of-N candidates are ranked by `score_candidate`: layout preservation (1 − drift)
+blended with token-color adherence, i.e. how closely the candidate's palette hits
+the step's goal colors in CIELAB.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from kontext.recolor_backend import hex_to_lab, rgb_to_lab
+
+DRIFT_LONG_EDGE = 768
+EDGE_FLOOR = 32.0  # minimum normalizer, so near-flat frames do not amplify noise
+SSIM_WINDOW = 7
+PALETTE_LONG_EDGE = 256
+PALETTE_MIN_SHARE = 0.002  # colors covering less of the frame are noise (anti-aliasing, JPEG)
+ADHERENCE_DELTA_E = 25.0   # ΔE76 at which a goal color counts as missing
+COLOR_WEIGHT = 0.5
+
+
+def _gray(img: Image.Image, size: tuple) -> np.ndarray:
+    return np.asarray(img.convert("L").resize(size, Image.BILINEAR), dtype=np.float32)
+
+
+def gradient_map(gray: np.ndarray) -> np.ndarray:
+    """Sobel magnitude normalized by its 99th percentile, clipped to [0, 1]."""
+    p = np.pad(gray, 1, mode="edge")
+    gx = (p[:-2, 2:] + 2 * p[1:-1, 2:] + p[2:, 2:]) - (p[:-2, :-2] + 2 * p[1:-1, :-2] + p[2:, :-2])
+    gy = (p[2:, :-2] + 2 * p[2:, 1:-1] + p[2:, 2:]) - (p[:-2, :-2] + 2 * p[:-2, 1:-1] + p[:-2, 2:])
+    mag = np.hypot(gx, gy)
+    scale = max(float(np.percentile(mag, 99)), EDGE_FLOOR)
+    return np.clip(mag / scale, 0.0, 1.0)
+
+
+def _box(a: np.ndarray, window: int = SSIM_WINDOW) -> np.ndarray:
+    pad = window // 2
+    sat = np.pad(np.pad(a, pad, mode="edge").cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    h, w = a.shape
+    return (sat[window:window + h, window:window + w] - sat[:h, window:window + w]
+            - sat[window:window + h, :w] + sat[:h, :w]) / float(window * window)
+
+
+def drift_score(reference: Image.Image, candidate: Image.Image, long_edge: int = DRIFT_LONG_EDGE) -> float:
+    """1 − SSIM (contrast-structure) of the two gradient maps (0 = same structure, 1 = nothing in common)."""
+    w, h = reference.size
+    scale = min(1.0, float(long_edge) / max(w, h))
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    x = gradient_map(_gray(reference, size))
+    y = gradient_map(_gray(candidate, size))
+    mx, my = _box(x), _box(y)
+    vx = _box(x * x) - mx * mx
+    vy = _box(y * y) - my * my
+    cov = _box(x * y) - mx * my
+    # SSIM without the luminance term: only where the edges are (and how sharp) matters.
+    c2 = 0.03 ** 2
+    ssim = (2 * cov + c2) / (vx + vy + c2)
+    # Weight by edge strength: flat areas would dilute the score, and faint borders
+    # legitimately change shape when a theme is recolored.
+    weight = _box(np.maximum(x, y))
+    total = float(weight.sum())
+    if total <= 0.0:
+        return 0.0
+    return float(np.clip(1.0 - (ssim * weight).sum() / total, 0.0, 1.0))
+
+
+def color_adherence(img: Image.Image, hex_colors: List[str], long_edge: int = PALETTE_LONG_EDGE) -> Optional[float]:
+    """
+    Mean over `hex_colors` of how closely the image's palette reaches each one
+    (1 = present exactly, 0 = nothing within ADHERENCE_DELTA_E). None without goal colors.
+    """
+    if not hex_colors:
+        return None
+    w, h = img.size
+    scale = min(1.0, float(long_edge) / max(w, h))
+    small = img.convert("RGB").resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.NEAREST)
+    rgb = np.asarray(small, dtype=np.uint8).reshape(-1, 3)
+    # 5 bits per channel; each bin is represented by the mean of its pixels.
+    bins = ((rgb[:, 0] >> 3).astype(np.int32) << 10) | ((rgb[:, 1] >> 3).astype(np.int32) << 5) | (rgb[:, 2] >> 3)
+    counts = np.bincount(bins, minlength=1 << 15)
+    keep = np.flatnonzero(counts >= max(1.0, PALETTE_MIN_SHARE * len(bins)))
+    means = np.stack([np.bincount(bins, weights=rgb[:, c], minlength=1 << 15)[keep] for c in range(3)], axis=-1)
+    palette = rgb_to_lab(np.clip(means / counts[keep, None] + 0.5, 0, 255).astype(np.uint8))
+    targets = np.stack([hex_to_lab(code) for code in hex_colors])
+    nearest = np.linalg.norm(palette[None, :, :] - targets[:, None, :], axis=-1).min(axis=1)
+    return float(np.clip(1.0 - nearest / ADHERENCE_DELTA_E, 0.0, 1.0).mean())
+
+
+def score_candidate(reference: Image.Image, candidate: Image.Image, goal_colors: Optional[List[str]] = None,
+                    color_weight: float = COLOR_WEIGHT) -> Dict[str, Optional[float]]:
+    """{"score", "drift", "adherence"}; higher score is better. Layout only when there are no goal colors."""
+    drift = drift_score(reference, candidate)
+    adherence = color_adherence(candidate, goal_colors or [])
+    if adherence is None:
+        score = 1.0 - drift
+    else:
+        score = color_weight * adherence + (1.0 - color_weight) * (1.0 - drift)
+    return {"score": round(score, 4), "drift": round(drift, 4),
+            "adherence": None if adherence is None else round(adherence, 4)}
@@ -0,0 +1,275 @@
+"""
+Local pixel-space recolor backend for pure color steps (no model, no network).
+Flat UI colors are clustered in CIELAB, matched to token roles, and moved onto
+the token colors by the cluster→token offset (`_remap`), blended by each color's
+closeness to the cluster, so anti-aliased text keeps its contrast. Textured areas
+such as photos and illustrations are masked out. Work is done per distinct color
+(`np.unique`), never through a 24-bit table.
+
+Recolor specs come from the plan step (see restyle/planner.py):
+  {"mode": "surfaces", "colors": {"background": "#0B0B0B", "surface": "#121212"}}
+  {"mode": "outlines", "colors": {"surface": "#121212"}}
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+BACKEND_NAME = "recolor (pixels)"
+
+_SRGB = np.arange(256, dtype=np.float32) / 255.0
+_SRGB_TO_LINEAR = np.where(_SRGB <= 0.04045, _SRGB / 12.92, ((_SRGB + 0.055) / 1.055) ** 2.4).astype(np.float32)
+_RGB_TO_XYZ = np.array(
+    [[0.4124564, 0.3575761, 0.1804375],
+     [0.2126729, 0.7151522, 0.0721750],
+     [0.0193339, 0.1191920, 0.9503041]],
+    dtype=np.float32,
+)
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ).astype(np.float32)
+_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+FLAT_DELTA = 3           # max RGB channel delta to a neighbour for a pixel to count as flat
+MERGE_DISTANCE = 2.5     # ΔE for merging colors into one cluster
+REMAP_RADIUS = 12.0      # ΔE over which the shift fades out around a cluster
+TEXTURE_WINDOW = 31      # px window for the photo/illustration mask
+MIN_FLAT_FRACTION = 0.35  # windows with fewer flat pixels are treated as texture
+MAX_MERGE_COLORS = 4096  # most frequent flat colors considered for clustering
+LINE_REACH = 16          # a hairline pixel repeats this far along its line
+
+
+def init() -> None:
+    pass
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """uint8 (..., 3) sRGB → float32 (..., 3) CIELAB (D65)."""
+    lin = _SRGB_TO_LINEAR[rgb]
+    xyz = lin @ _RGB_TO_XYZ.T / _WHITE
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    lab = np.empty_like(f)
+    lab[..., 0] = 116.0 * f[..., 1] - 16.0
+    lab[..., 1] = 500.0 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200.0 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def lab_to_rgb(lab: np.ndarray) -> np.ndarray:
+    """float32 (..., 3) CIELAB → uint8 (..., 3) sRGB, clipped to gamut."""
+    fy = (lab[..., 0] + 16.0) / 116.0
+    f = np.stack([fy + lab[..., 1] / 500.0, fy, fy - lab[..., 2] / 200.0], axis=-1)
+    xyz = np.where(f > 0.206893, f ** 3, (f - 16.0 / 116.0) / 7.787) * _WHITE
+    lin = np.clip(xyz @ _XYZ_TO_RGB.T, 0.0, 1.0)
+    srgb = np.where(lin <= 0.0031308, lin * 12.92, 1.055 * np.power(lin, 1.0 / 2.4) - 0.055)
+    return np.clip(srgb * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+
+def hex_to_lab(hex_code: str) -> np.ndarray:
+    h = hex_code.strip().lstrip("#")
+    rgb = np.array([int(h[i:i + 2], 16) for i in (0, 2, 4)], dtype=np.uint8)
+    return rgb_to_lab(rgb)
+
+
+def _box_mean(mask: np.ndarray, window: int) -> np.ndarray:
+    """Mean of a 2D array over a square window (summed-area table)."""
+    pad = window // 2
+    h, w = mask.shape
+    sat = np.zeros((h + 2 * pad + 1, w + 2 * pad + 1), dtype=np.float32)
+    sat[1:, 1:] = np.pad(mask, pad, mode="edge")
+    sat.cumsum(0, out=sat)
+    sat.cumsum(1, out=sat)
+    total = sat[window:window + h, window:window + w] - sat[:h, window:window + w] - sat[window:window + h, :w] + sat[:h, :w]
+    return total / float(window * window)
+
+
+def _flat_mask(rgb: np.ndarray) -> np.ndarray:
+    """Pixels equal (within FLAT_DELTA) to a horizontal or vertical neighbour; keeps 1px hairlines."""
+    h, w = rgb.shape[:2]
+    same_x = np.ones((h, max(w - 1, 0)), dtype=bool)
+    same_y = np.ones((max(h - 1, 0), w), dtype=bool)
+    for ch in range(3):  # uint8 per channel: |a - b| as max - min, no widened copies of the frame
+        px = rgb[..., ch]
+        same_x &= np.maximum(px[:, 1:], px[:, :-1]) - np.minimum(px[:, 1:], px[:, :-1]) <= FLAT_DELTA
+        same_y &= np.maximum(px[1:, :], px[:-1, :]) - np.minimum(px[1:, :], px[:-1, :]) <= FLAT_DELTA
+    flat = np.zeros((h, w), dtype=bool)
+    flat[:, :-1] |= same_x
+    flat[:, 1:] |= same_x
+    flat[:-1, :] |= same_y
+    flat[1:, :] |= same_y
+    return flat
+
+
+def _pack(rgb: np.ndarray) -> np.ndarray:
+    packed = rgb[..., 0].astype(np.uint32)
+    packed <<= 8
+    packed |= rgb[..., 1]
+    packed <<= 8
+    packed |= rgb[..., 2]
+    return packed
+
+
+def _unpack(packed: np.ndarray) -> np.ndarray:
+    rgb = np.empty(packed.shape + (3,), dtype=np.uint8)
+    for ch, shift in enumerate((16, 8, 0)):
+        np.right_shift(packed, shift, out=rgb[..., ch], casting="unsafe")  # keeps the low byte
+    return rgb
+
+
+def _line_mask(packed: np.ndarray) -> np.ndarray:
+    """Pixels on thin straight runs: same color ±LINE_REACH px along one axis, different across it."""
+    h, w = packed.shape
+    r = LINE_REACH
+    line = np.zeros((h, w), dtype=bool)
+    if w > 2 * r and h > 2:
+        core = packed[1:-1, r:-r]
+        along = (core == packed[1:-1, :-2 * r]) & (core == packed[1:-1, 2 * r:])
+        across = (core != packed[:-2, r:-r]) & (core != packed[2:, r:-r])
+        line[1:-1, r:-r] |= along & across
+    if h > 2 * r and w > 2:
+        core = packed[r:-r, 1:-1]
+        along = (core == packed[:-2 * r, 1:-1]) & (core == packed[2 * r:, 1:-1])
+        across = (core != packed[r:-r, :-2]) & (core != packed[r:-r, 2:])
+        line[r:-r, 1:-1] |= along & across
+    return line
+
+
+def analyze(rgb: np.ndarray, max_clusters: int = 8) -> Tuple[List[Tuple[np.ndarray, float, float]], np.ndarray]:
+    """
+    Cluster the flat colors of an RGB array. Returns ([(lab_center, area_fraction, line_fraction)],
+    texture_mask), clusters sorted by area; the mask flags photo/illustration pixels to leave alone.
+    """
+    packed = _pack(rgb)
+    flat = _flat_mask(rgb)
+    texture = _box_mean(flat, TEXTURE_WINDOW) < MIN_FLAT_FRACTION
+    usable = flat & ~texture
+    candidates = packed[usable]
+    total = float(rgb.shape[0] * rgb.shape[1])
+    if candidates.size == 0:
+        return [], texture
+    colors, counts = np.unique(candidates, return_counts=True)
+    line_pixels = packed[usable & _line_mask(packed)]
+    line_counts = np.bincount(np.searchsorted(colors, line_pixels), minlength=len(colors))
+    order = np.argsort(-counts, kind="stable")[:MAX_MERGE_COLORS]
+    labs = rgb_to_lab(_unpack(colors[order]))
+
+    clusters: List[List] = []  # [weighted lab sum, pixel count, line pixel count]
+    for lab, count, lines in zip(labs, counts[order], line_counts[order]):
+        for cl in clusters:
+            if np.linalg.norm(cl[0] / cl[1] - lab) < MERGE_DISTANCE:
+                cl[0] = cl[0] + lab * count
+                cl[1] += int(count)
+                cl[2] += int(lines)
+                break
+        else:
+            if len(clusters) < max_clusters * 4:
+                clusters.append([lab * count, int(count), int(lines)])
+    result = sorted(((cl[0] / cl[1], cl[1] / total, cl[2] / cl[1]) for cl in clusters), key=lambda c: -c[1])
+    return result[:max_clusters], texture
+
+
+def match_roles(clusters: List[Tuple[np.ndarray, float]], spec: Dict) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Pair source cluster colors with token colors: [(source_lab, target_lab)]."""
+    mode = spec.get("mode")
+    colors = spec.get("colors", {})
+    if not clusters:
+        return []
+    if mode == "surfaces":
+        pairs = []
+        big = [c for c in clusters if c[1] >= 0.01]
+        if big and colors.get("background"):
+            pairs.append((big[0][0], hex_to_lab(colors["background"])))
+        if len(big) > 1 and colors.get("surface"):
+            pairs.append((big[1][0], hex_to_lab(colors["surface"])))
+        return pairs
+    if mode == "outlines":
+        if not colors.get("surface"):
+            return []
+        surface = hex_to_lab(colors["surface"])
+        # Hairlines sit one step off the surface: lighter on dark themes, darker on light ones.
+        target = surface.copy()
+        target[0] = np.clip(surface[0] + (10.0 if surface[0] < 50.0 else -10.0), 0.0, 100.0)
+        pairs = []
+        for center, area, line_fraction in clusters[1:]:
+            chroma = float(np.hypot(center[1], center[2]))
+            if area <= 0.05 and line_fraction >= 0.5 and chroma < 12.0:
+                pairs.append((center, target))
+        return pairs
+    raise ValueError(f"Unknown recolor mode {mode!r}")
+
+
+def _remap(lab: np.ndarray, source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """
+    Move colors around `source` onto `target` by the source→target offset, L clipped
+    to [0, 100]. Colors keep their distance to the cluster center, so a near-white
+    surface lands on a dark token together with its background instead of staying light.
+    """
+    out = lab + (target - source)
+    np.clip(out[:, 0], 0.0, 100.0, out=out[:, 0])
+    return out
+
+
+def recolor(img: Image.Image, spec: Dict) -> Tuple[Image.Image, int]:
+    """Apply a recolor spec; returns (image, number of color roles remapped)."""
+    rgb = np.asarray(img.convert("RGB"))
+    clusters, texture = analyze(rgb)
+    pairs = match_roles(clusters, spec)
+    if not pairs:
+        return img, 0
+
+    # Screenshots have few distinct colors: do the Lab math once per color, then map back per pixel.
+    packed = _pack(rgb)
+    colors = np.unique(packed)
+    inverse = np.searchsorted(colors, packed)  # = np.unique(..., return_inverse=True), without its stable argsort
+    lab = rgb_to_lab(_unpack(colors))
+    centers = np.stack([c[0] for c in clusters])
+    distances = np.linalg.norm(lab[:, None, :] - centers[None, :, :], axis=-1)
+    # A color follows only its nearest cluster, so hairlines close to the background stay distinct.
+    nearest = distances.argmin(axis=1)
+    weight = np.zeros(len(colors), dtype=np.float32)
+    remapped = lab.copy()
+    for source, target in pairs:
+        idx = int(np.linalg.norm(centers - source, axis=-1).argmin())
+        take = nearest == idx
+        weight[take] = np.clip(1.0 - distances[take, idx] / REMAP_RADIUS, 0.0, 1.0)
+        remapped[take] = _remap(lab[take], source, target)
+    moved = weight > 0
+    new_colors = colors.copy()
+    new_colors[moved] = _pack(lab_to_rgb(lab[moved] + (remapped[moved] - lab[moved]) * weight[moved][:, None]))
+
+    out = _unpack(new_colors[inverse])
+    # Keep textured areas, plus non-flat pixels on their fringe where the window mixes in flat UI.
+    keep = texture | ((_box_mean(texture, TEXTURE_WINDOW) > 0) & ~_flat_mask(rgb))
+    out[keep] = rgb[keep]
+    result = Image.fromarray(out, mode="RGB")
+    if img.mode in ("RGBA", "LA"):
+        result.putalpha(img.getchannel("A"))
+    return result, len(pairs)
+
+
+def apply_edit(
+    image: Image.Image,
+    prompt: str,
+    negative_prompt: str = "",
+    strength: float = 0.3,
+    seed: int = 0,
+    region_hint: str = "global",
+    recolor_spec: Optional[Dict] = None,
+) -> Image.Image:
+    """Backend entry point; steps without a recolor spec pass through unchanged."""
+    if not recolor_spec:
+        return image
+    out, _ = recolor(image, recolor_spec)
+    return out
+
+
+async def apply_edit_async(
+    image: Image.Image,
+    prompt: str,
+    negative_prompt: str = "",
+    strength: float = 0.3,
+    seed: int = 0,
+    region_hint: str = "global",
+    recolor_spec: Optional[Dict] = None,
+) -> Image.Image:
+    # NumPy work on a full-resolution frame: run it on a worker thread.
+    return await asyncio.to_thread(apply_edit, image, prompt, negative_prompt, strength, seed, region_hint, recolor_spec)
@@ -0,0 +1,138 @@
+"""
+Region-scoped execution for localized edit steps.
+A step's `region_hint` selects the area sent to Kontext:
+  "global"                 whole frame (default)
+  "box:x0,y0,x1,y1"        user box in pixels, or fractions of the frame when all values are ≤ 1
+  "charts"                 heuristic detector for saturated, dense chart/dataviz areas
+  "changed"                bounding box of what the previous step changed
+Only the padded crop is edited; the result is feathered back inside the padding,
+so pixels outside the crop are never touched.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+Box = Tuple[int, int, int, int]
+
+REGION_HINT_HELP = 'global | box:x0,y0,x1,y1 | charts | changed'
+# A region covering more of the frame than this is not worth cropping.
+MAX_REGION_FRACTION = 0.8
+
+
+def parse_box(spec: str, size: Tuple[int, int]) -> Box:
+    parts = [float(p) for p in spec.replace(" ", "").split(",")]
+    if len(parts) != 4:
+        raise ValueError(f"Region box needs 4 values, got {spec!r}")
+    w, h = size
+    if all(0.0 <= p <= 1.0 for p in parts):
+        parts = [parts[0] * w, parts[1] * h, parts[2] * w, parts[3] * h]
+    x0, y0, x1, y1 = (int(round(p)) for p in parts)
+    x0, x1 = sorted((max(0, min(w, x0)), max(0, min(w, x1))))
+    y0, y1 = sorted((max(0, min(h, y0)), max(0, min(h, y1))))
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        raise ValueError(f"Region box {spec!r} is empty for a {w}x{h} image")
+    return x0, y0, x1, y1
+
+
+def detect_chart_region(img: Image.Image, cell: int = 8, min_density: float = 0.08) -> Optional[Box]:
+    """
+    Bounding box of grid cells dense in saturated color — bars, lines and swatches
+    in otherwise neutral UI chrome. Returns None when nothing stands out.
+    """
+    w, h = img.size
+    scale = min(1.0, 256.0 / max(w, h))
+    small = img.convert("RGB").resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.BILINEAR)
+    hsv = np.asarray(small.convert("HSV"), dtype=np.float32) / 255.0
+    colorful = (hsv[..., 1] > 0.35) & (hsv[..., 2] > 0.25)
+
+    sh, sw = colorful.shape
+    gh, gw = max(1, sh // cell), max(1, sw // cell)
+    grid = colorful[: gh * cell, : gw * cell].reshape(gh, cell, gw, cell).mean(axis=(1, 3))
+    dense = grid > min_density
+    if not dense.any():
+        return None
+    rows, cols = np.nonzero(dense)
+    inv = 1.0 / scale
+    box = (
+        int(cols.min() * cell * inv),
+        int(rows.min() * cell * inv),
+        min(w, int((cols.max() + 1) * cell * inv)),
+        min(h, int((rows.max() + 1) * cell * inv)),
+    )
+    return box
+
+
+def diff_region(before: Image.Image, after: Image.Image, threshold: int = 12) -> Optional[Box]:
+    """Bounding box of pixels whose max channel delta exceeds `threshold`."""
+    if before.size != after.size:
+        return None
+    a = np.asarray(before.convert("RGB"), dtype=np.int16)
+    b = np.asarray(after.convert("RGB"), dtype=np.int16)
+    changed = np.abs(a - b).max(axis=2) > threshold
+    if not changed.any():
+        return None
+    rows = np.flatnonzero(changed.any(axis=1))
+    cols = np.flatnonzero(changed.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def resolve_region(hint: Optional[str], image: Image.Image, previous_change: Optional[Box] = None) -> Optional[Box]:
+    """Region for a step, or None to edit the full frame."""
+    hint = (hint or "global").strip().lower()
+    if hint in ("", "global"):
+        return None
+    if hint.startswith("box:"):
+        box: Optional[Box] = parse_box(hint[4:], image.size)
+    elif hint == "charts":
+        box = detect_chart_region(image)
+    elif hint == "changed":
+        box = previous_change
+    else:
+        raise ValueError(f"Unknown region hint {hint!r}; expected {REGION_HINT_HELP}")
+    if box is None:
+        return None
+    w, h = image.size
+    if (box[2] - box[0]) * (box[3] - box[1]) > MAX_REGION_FRACTION * w * h:
+        return None
+    return box
+
+
+def padded_box(box: Box, size: Tuple[int, int], padding: Optional[int] = None) -> Box:
+    """Grow `box` by `padding` px (default: 6% of its long side, ≥ 24 px), clamped to the frame."""
+    x0, y0, x1, y1 = box
+    if padding is None:
+        padding = max(24, int(0.06 * max(x1 - x0, y1 - y0)))
+    w, h = size
+    return max(0, x0 - padding), max(0, y0 - padding), min(w, x1 + padding), min(h, y1 + padding)
+
+
+def feather_mask(crop_box: Box, region: Box) -> Image.Image:
+    """L mask over the crop: 255 inside `region`, ramping to 0 at the crop edge."""
+    cx0, cy0, cx1, cy1 = crop_box
+    rx0, ry0, rx1, ry1 = region
+    xs = np.arange(cx0, cx1, dtype=np.float32)
+    ys = np.arange(cy0, cy1, dtype=np.float32)
+    dx = np.maximum(np.maximum(rx0 - xs, xs - (rx1 - 1)), 0.0)
+    dy = np.maximum(np.maximum(ry0 - ys, ys - (ry1 - 1)), 0.0)
+    # Ramp length per side = distance from the region to the crop edge on that side.
+    ramp_x = np.where(xs < rx0, max(1, rx0 - cx0), max(1, cx1 - rx1)).astype(np.float32)
+    ramp_y = np.where(ys < ry0, max(1, ry0 - cy0), max(1, cy1 - ry1)).astype(np.float32)
+    ax = np.clip(1.0 - dx / ramp_x, 0.0, 1.0)
+    ay = np.clip(1.0 - dy / ramp_y, 0.0, 1.0)
+    alpha = np.outer(ay, ax)
+    return Image.fromarray((alpha * 255.0 + 0.5).astype(np.uint8), mode="L")
+
+
+def composite_region(full: Image.Image, edited_crop: Image.Image, crop_box: Box, region: Box) -> Image.Image:
+    """Feather `edited_crop` back into a copy of `full`; pixels outside `crop_box` are unchanged."""
+    cw, ch = crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
+    if edited_crop.size != (cw, ch):
+        edited_crop = edited_crop.resize((cw, ch), Image.LANCZOS)
+    base = full.copy()
+    if edited_crop.mode != base.mode:
+        edited_crop = edited_crop.convert(base.mode)
+    original_crop = base.crop(crop_box)
+    blended = Image.composite(edited_crop, original_crop, feather_mask(crop_box, region))
+    base.paste(blended, crop_box[:2])
+    return base
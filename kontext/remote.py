@@ -0,0 +1,74 @@
+"""
+Lightweight handle for backend outputs that live at a URL (FAL CDN).
+Kept apart from kontext/fal_backend.py so the runner can chain and resolve
+remote frames without importing the FAL SDK or the HTTP stack until a remote
+backend is actually used.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Union
+
+from PIL import Image
+
+_FETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fal-fetch")
+
+Fetch = Callable[[str, Optional[Dict[str, Any]]], Image.Image]
+
+
+def _default_fetch(url: str, stats: Optional[Dict[str, Any]] = None) -> Image.Image:
+    from kontext.fal_backend import _download
+    return _download(url, stats)
+
+
+class RemoteImage:
+    """
+    Handle to an image hosted by FAL. Passing it back into `apply_edit` reuses the
+    URL as `image_url` (no download/re-upload); pixels are prefetched in the
+    background and only waited on when `.image()` is called.
+    """
+
+    def __init__(self, url: str, prefetch: bool = True, stats: Optional[Dict[str, Any]] = None,
+                 fetch: Optional[Fetch] = None):
+        self.url = url
+        self.digest: Optional[str] = None  # set by callers that track lineage
+        self.stats: Dict[str, Any] = stats if stats is not None else {}  # download_bytes once fetched
+        self._fetch = fetch or _default_fetch
+        self._future = self._submit() if prefetch else None
+
+    def _submit(self):
+        # Carry the caller's context so the fetch is traced under the step that produced it.
+        return _FETCH_POOL.submit(contextvars.copy_context().run, self._fetch, self.url, self.stats)
+
+    def image(self) -> Image.Image:
+        if self._future is None:
+            self._future = self._submit()
+        return self._future.result()
+
+    def ready(self) -> bool:
+        """True once the pixels are fetched (`.image()` will not block)."""
+        return self._future is not None and self._future.done()
+
+    def release(self) -> None:
+        """Drop fetched pixels; a later `.image()` downloads them again."""
+        self._future = None
+
+    def when_ready(self, fn: Callable[[Image.Image], None]) -> None:
+        """Call `fn(pixels)` once the fetch completes (on the fetch thread; failures surface via `.image()`)."""
+        if self._future is None:
+            self._future = self._submit()
+
+        def _done(future) -> None:
+            if future.exception() is None:
+                fn(future.result())
+
+        self._future.add_done_callback(_done)
+
+    def __repr__(self) -> str:
+        return f"RemoteImage({self.url!r})"
+
+
+def resolve_image(image: Union[Image.Image, RemoteImage]) -> Image.Image:
+    """Return local pixels for a PIL image or a remote handle."""
+    if isinstance(image, RemoteImage):
+        return image.image()
+    return image
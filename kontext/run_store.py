@@ -0,0 +1,353 @@
+"""
+Indexed run store: an SQLite index of runs (brand, backend, seeds, tokens, timings)
+plus content-addressed PNG blobs, so identical frames and logos are stored once.
+Run folders keep their layout (`restyle_<id>/00_<step>.png`, `final.png`, ...); image
+files there are hard links to the blobs (copies where the filesystem has no links).
+
+Retention evicts least recently used runs (folder, index rows, unreferenced blobs)
+once the store is over its size, count or age limit. Folders the index does not
+know about (older runs) are never touched.
+
+Env:
+  KONTEXT_RUN_STORE=1                    # 0 = plain files, no index
+  KONTEXT_RUN_STORE_MAX_BYTES=21474836480  KONTEXT_RUN_STORE_MAX_RUNS=0  KONTEXT_RUN_STORE_MAX_AGE_S=2592000
+
+Usage:
+  python -m kontext.run_store --root outputs --brand Algominds
+  python -m kontext.run_store --root outputs --usage --evict
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from PIL import Image
+
+from kontext import tracing
+from kontext.cache import image_digest
+
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3  # 20 GiB
+DEFAULT_MAX_AGE_S = 30 * 24 * 3600  # 30 days
+INDEX_NAME = "runs.sqlite"
+BLOB_DIR = ".kontext_blobs"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    brand TEXT,
+    backend TEXT,
+    mode TEXT,
+    status TEXT,
+    seed INTEGER,
+    tokens TEXT,
+    run_path TEXT NOT NULL,
+    elapsed_s REAL,
+    final TEXT,
+    file_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_brand ON runs (brand, created_at);
+CREATE INDEX IF NOT EXISTS runs_access ON runs (last_access);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT,
+    backend TEXT,
+    seed INTEGER,
+    drift REAL,
+    step_s REAL,
+    blob TEXT,
+    PRIMARY KEY (run_id, idx)
+);
+CREATE TABLE IF NOT EXISTS refs (
+    run_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+_STORES: Dict[str, "RunStore"] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def enabled_by_default() -> bool:
+    return os.getenv("KONTEXT_RUN_STORE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class RunStore:
+    """Thread-safe run index + blob store rooted at a save dir (e.g. `outputs/`)."""
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES, max_runs: int = 0,
+                 max_age_s: float = DEFAULT_MAX_AGE_S):
+        self.root = Path(root)
+        self.blob_root = self.root / BLOB_DIR
+        self.max_bytes = int(max_bytes)
+        self.max_runs = int(max_runs)
+        self.max_age_s = float(max_age_s)
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.root / INDEX_NAME), timeout=30.0, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+
+    # -- blobs -------------------------------------------------------------
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blob_root / digest[:2] / f"{digest}.png"
+
+    def save_image(self, img: Image.Image, path: Path) -> str:
+        """Store `img` as a blob (once per distinct pixels) and link it at `path`. Returns the digest."""
+        with tracing.span("save", file=path.name):
+            digest = image_digest(img)
+            blob = self.blob_path(digest)
+            if not blob.exists():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                tmp = blob.with_suffix(f".{threading.get_ident()}.tmp")
+                img.save(tmp, format="PNG")
+                os.replace(tmp, blob)
+            _link(blob, path)
+        return digest
+
+    # -- index -------------------------------------------------------------
+
+    def record_run(self, manifest: Dict[str, Any], refs: Dict[str, str], tokens: Optional[Dict] = None,
+                   step_times: Optional[Dict[int, float]] = None) -> None:
+        """
+        Index a finished or failed run under its run.json status. `refs` maps file names in
+        the run folder to blob digests; step frames are matched to plan steps by their
+        `NN_<name>.png` file name.
+        """
+        run_path = Path(manifest["run_path"])
+        now = time.time()
+        blob_rows = []
+        for name, digest in refs.items():
+            blob = self.blob_path(digest)
+            if not blob.exists():
+                # Evicted as an orphan while this run was writing: the run's link still has the bytes.
+                try:
+                    blob.parent.mkdir(parents=True, exist_ok=True)
+                    _link(run_path / name, blob)
+                except OSError:
+                    continue
+            blob_rows.append((digest, blob.stat().st_size, now))
+        status = manifest.get("status")
+        if status is None:  # run.json written before runs carried a status
+            status = "ok"
+            if manifest.get("aborted"):
+                status = "aborted"
+            elif manifest.get("cancelled_before_step") is not None:
+                status = "cancelled"
+        step_rows = []
+        for idx, name in enumerate(manifest.get("steps", [])):
+            seeds = manifest.get("step_seeds", [])
+            drift = manifest.get("drift", [])
+            backends = manifest.get("step_backends", [])
+            step_rows.append((
+                manifest["run_id"], idx, name, backends[idx] if idx < len(backends) else None,
+                seeds[idx] if idx < len(seeds) else None, drift[idx] if idx < len(drift) else None,
+                (step_times or {}).get(idx), refs.get(f"{idx:02d}_{name}.png"),
+            ))
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)", blob_rows)
+            self._db.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (manifest["run_id"], now, now, (tokens or {}).get("brand"), manifest.get("backend"),
+                 manifest.get("mode"), status, manifest.get("seed"),
+                 json.dumps(tokens, sort_keys=True) if tokens else None, str(run_path),
+                 manifest.get("elapsed_s"), manifest.get("final"), _loose_bytes(run_path)),
+            )
+            self._db.executemany("INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?)", step_rows)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO refs VALUES (?, ?, ?)",
+                [(manifest["run_id"], name, digest) for name, digest in refs.items()],
+            )
+
+    def touch(self, run_id: str) -> None:
+        """Mark a run as used (LRU retention), e.g. when a preview is rendered final."""
+        with self._lock, self._db:
+            self._db.execute("UPDATE runs SET last_access = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            steps = self._db.execute("SELECT * FROM steps WHERE run_id = ? ORDER BY idx", (run_id,)).fetchall()
+        run = _run_dict(row)
+        run["steps"] = [dict(s) for s in steps]
+        return run
+
+    def runs_for_brand(self, brand: str, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM runs WHERE brand = ? ORDER BY created_at DESC LIMIT ?", (brand, int(limit))
+            ).fetchall()
+        return [_run_dict(row) for row in rows]
+
+    def recent_runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM runs ORDER BY created_at DESC LIMIT ?", (int(limit),)).fetchall()
+        return [_run_dict(row) for row in rows]
+
+    def usage(self) -> Dict[str, int]:
+        """Indexed runs, distinct blobs, and bytes on disk (blobs once + each run's other files)."""
+        with self._lock:
+            runs, loose = self._db.execute("SELECT COUNT(*), COALESCE(SUM(file_bytes), 0) FROM runs").fetchone()
+            blobs, blob_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM blobs").fetchone()
+            linked = self._db.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {"runs": runs, "blobs": blobs, "images": linked, "bytes": int(blob_bytes) + int(loose)}
+
+    # -- retention ---------------------------------------------------------
+
+    def enforce(self, protect: Iterable[str] = ()) -> Dict[str, int]:
+        """Evict least recently used runs until within the limits; never evicts `protect`."""
+        keep = set(protect)
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute("SELECT run_id, last_access, run_path FROM runs ORDER BY last_access").fetchall()
+        usage = self.usage()
+        total, count = usage["bytes"], usage["runs"]
+        evicted = {"runs": 0, "blobs": 0, "bytes": 0}
+        for row in rows:
+            expired = self.max_age_s > 0 and now - row["last_access"] > self.max_age_s
+            over = total > self.max_bytes or (self.max_runs > 0 and count > self.max_runs)
+            if not (expired or over):
+                break
+            if row["run_id"] in keep:
+                continue
+            freed = self._evict(row["run_id"], Path(row["run_path"]))
+            evicted["runs"] += 1
+            evicted["blobs"] += freed[0]
+            evicted["bytes"] += freed[1]
+            total -= freed[1]
+            count -= 1
+        return evicted
+
+    def _evict(self, run_id: str, run_path: Path) -> tuple:
+        with self._lock, self._db:
+            loose = self._db.execute("SELECT file_bytes FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            digests = [r[0] for r in self._db.execute("SELECT digest FROM refs WHERE run_id = ?", (run_id,))]
+            self._db.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self._db.execute("DELETE FROM steps WHERE run_id = ?", (run_id,))
+            self._db.execute("DELETE FROM refs WHERE run_id = ?", (run_id,))
+            orphans = [
+                (d, n) for d, n in self._db.execute(
+                    f"SELECT digest, bytes FROM blobs WHERE digest IN ({','.join('?' * len(digests))}) "
+                    "AND digest NOT IN (SELECT digest FROM refs)", digests,
+                )
+            ] if digests else []
+            self._db.executemany("DELETE FROM blobs WHERE digest = ?", [(d,) for d, _ in orphans])
+        if run_path.resolve().parent == self.root.resolve():
+            shutil.rmtree(run_path, ignore_errors=True)
+        for digest, _ in orphans:
+            try:
+                self.blob_path(digest).unlink()
+            except FileNotFoundError:
+                pass
+        return len(orphans), int(loose[0] if loose else 0) + sum(n for _, n in orphans)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _link(src: Path, dst: Path) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        dst.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _loose_bytes(run_path: Path) -> int:
+    """Bytes of a run folder's files that are not blob links (prompts, run.json, trace.json)."""
+    total = 0
+    for p in run_path.iterdir() if run_path.is_dir() else ():
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        if st.st_nlink <= 1:
+            total += st.st_size
+    return total
+
+
+def _run_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    run = dict(row)
+    run["tokens"] = json.loads(run["tokens"]) if run.get("tokens") else None
+    return run
+
+
+def get_run_store(root: Path) -> RunStore:
+    """Process-wide store per directory; limits come from the env (see module docstring)."""
+    key = str(Path(root).resolve())
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = RunStore(
+                Path(root),
+                max_bytes=int(os.getenv("KONTEXT_RUN_STORE_MAX_BYTES", str(DEFAULT_MAX_BYTES))),
+                max_runs=int(os.getenv("KONTEXT_RUN_STORE_MAX_RUNS", "0")),
+                max_age_s=float(os.getenv("KONTEXT_RUN_STORE_MAX_AGE_S", str(DEFAULT_MAX_AGE_S))),
+            )
+            _STORES[key] = store
+        return store
+
+
+def format_usage(usage: Dict[str, int]) -> str:
+    from kontext.transfer import format_bytes
+
+    return (f"[store] {usage['runs']} run(s), {usage['images']} image(s) in {usage['blobs']} blob(s), "
+            f"{format_bytes(usage['bytes'])} on disk")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Query and trim the indexed run store.")
+    parser.add_argument("--root", type=Path, default=Path("outputs"))
+    parser.add_argument("--brand", help="List runs for this brand")
+    parser.add_argument("--run", help="Show one run with its steps")
+    parser.add_argument("--recent", type=int, default=0, help="List the N most recent runs")
+    parser.add_argument("--usage", action="store_true")
+    parser.add_argument("--evict", action="store_true", help="Apply the retention limits now")
+    args = parser.parse_args(argv)
+
+    store = get_run_store(args.root)
+    rows: List[Dict[str, Any]] = []
+    if args.brand:
+        rows = store.runs_for_brand(args.brand)
+    elif args.recent:
+        rows = store.recent_runs(args.recent)
+    for run in rows:
+        print(f"{run['run_id']}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(run['created_at']))}  "
+              f"{run['brand'] or '-'}  {run['mode']}  {run['status']}  {run['elapsed_s']}s  {run['run_path']}")
+    if args.run:
+        run = store.get_run(args.run)
+        print(json.dumps(run, indent=2) if run else f"[store] no run {args.run}")
+    if args.evict:
+        print(f"[store] evicted {json.dumps(store.enforce())}")
+    if args.usage or args.evict:
+        print(format_usage(store.usage()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,47 +1,270 @@
+import asyncio
 import io
 import json
 import secrets
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Callable, Dict, Generator, List, NamedTuple, Optional, Tuple, Union
 
 from PIL import Image
 
-from kontext import fal_backend, local_backend
+from kontext import backends, checkpoint, hedging, incremental, scheduler, tracing
+from kontext.cache import StepCache, get_cache, image_digest, step_key
+from kontext.frame_archive import ARCHIVE_NAME, FrameArchiveWriter, format_archive_stats, frame_ref, load_frame
+from kontext.frame_archive import enabled_by_default as archive_enabled
+from kontext.frames import FrameList, RssWatch
+from kontext.quality import drift_score, score_candidate
+from kontext.regions import composite_region, diff_region, padded_box, resolve_region
+from kontext.remote import RemoteImage, resolve_image
+from kontext.run_store import RunStore, get_run_store
+from kontext.run_store import enabled_by_default as run_store_enabled
+from kontext.transfer import format_bytes, output_format_for
+from kontext.writer import ArtifactWriter, WriteGroup
+
+
+# FAL options that do not change the output pixels (excluded from cache keys).
+_NON_KEY_OPTIONS = ("remote", "stats", "hedge")
+# Seed offset for a step retried because of layout drift (and between best-of-N candidates).
+_RETRY_SEED_STRIDE = 7919
 
 
 def _apply_edit(
     backend: str,
-    image: Image.Image,
+    image: Union[Image.Image, RemoteImage],
     prompt: str,
     negative_prompt: str,
     strength: float,
     seed: int,
     region_hint: str,
-) -> Image.Image:
-    if backend == "FAL (Kontext API)":
-        fal_backend.init()
-        return fal_backend.apply_edit(
+    recolor_spec: Optional[Dict] = None,
+    candidates: int = 1,
+    **fal_options: Any,
+) -> Union[Image.Image, RemoteImage, List[Union[Image.Image, RemoteImage]]]:
+    """
+    Dispatch one edit through the backend registry (kontext/backends.py); `fal_options`
+    (remote, transfer, final_step, stats) only reach remote backends, `recolor_spec`
+    only steps that carry one.
+    `candidates` > 1 returns a list: one FAL call with `num_images`, or parallel calls
+    with offset seeds on backends without batching (see `_candidate_count`).
+    """
+    spec = backends.get_spec(backend)
+    if spec.remote:
+        module = backends.load(backend)
+        if candidates > 1:
+            fal_options["num_images"] = candidates
+        return module.apply_edit(
             image=image,
             prompt=prompt,
             negative_prompt=negative_prompt,
             strength=strength,  # kept for API compat
             seed=seed,
             region_hint=region_hint,
+            **fal_options,
         )
-    elif backend == "local (Kontext)":
-        local_backend.init()
-        return local_backend.apply_edit(
+    if candidates > 1:
+        seeds = _candidate_seeds(seed, candidates)
+        with ThreadPoolExecutor(max_workers=candidates, thread_name_prefix="candidate") as pool:
+            futures = [
+                pool.submit(copy_context().run, _apply_edit, backend, image, prompt, negative_prompt, strength,
+                            s, region_hint, recolor_spec)
+                for s in seeds
+            ]
+            return [f.result() for f in futures]
+    image = resolve_image(image)
+    module = backends.load(backend)
+    if module is None:
+        # dry-run: return input unchanged
+        return image
+    extra = {"recolor_spec": recolor_spec} if recolor_spec is not None else {}
+    with tracing.span("inference", backend=backend):
+        return module.apply_edit(
             image=image,
             prompt=prompt,
             negative_prompt=negative_prompt,
             strength=strength,
             seed=seed,
             region_hint=region_hint,
+            **extra,
         )
-    else:
-        # dry-run: return input unchanged
+
+
+def _candidate_seeds(seed: int, candidates: int) -> List[int]:
+    return [(seed + i * _RETRY_SEED_STRIDE) % 1_000_000_000 for i in range(candidates)]
+
+
+def _candidate_count(backend: str, requested: int) -> int:
+    """Best-of-N size for a backend: deterministic ones get 1, batching ones cap at `MAX_NUM_IMAGES`."""
+    spec = backends.get_spec(backend)
+    if spec.deterministic or int(requested) <= 1:
+        return 1
+    limit = getattr(backends.load(backend, init=False), "MAX_NUM_IMAGES", None) if spec.remote else None
+    return max(1, min(int(requested), limit or int(requested)))
+
+
+def _cached_apply_edit(
+    cache: Optional[StepCache],
+    counters: Dict[str, int],
+    input_digest: Optional[str],
+    backend: str,
+    image: Union[Image.Image, RemoteImage],
+    prompt: str,
+    negative_prompt: str,
+    strength: float,
+    seed: int,
+    region_hint: str,
+    recolor_spec: Optional[Dict] = None,
+    candidates: int = 1,
+    **fal_options: Any,
+) -> Tuple[Union[Image.Image, RemoteImage, List], Optional[str], bool]:
+    """
+    `_apply_edit` behind the step cache; `cache=None` bypasses it.
+    Returns (output, cache key, fresh). The key doubles as the digest of the
+    output, so the next step can be keyed without hashing (or downloading) pixels.
+    Fresh outputs are stored by the caller (off the critical path). A fresh
+    best-of-N output is the candidate list; the caller caches the winner.
+    """
+    if cache is None or input_digest is None:
+        out = _apply_edit(backend, image, prompt, negative_prompt, strength, seed, region_hint, recolor_spec,
+                          candidates, **fal_options)
+        return out, None, True
+    key = _edit_key(input_digest, backend, prompt, negative_prompt, strength, seed, region_hint, recolor_spec,
+                    fal_options, candidates)
+    cached = cache.get(key)
+    if cached is not None:
+        counters["hits"] += 1
+        return cached, key, False
+    counters["misses"] += 1
+    out = _apply_edit(backend, image, prompt, negative_prompt, strength, seed, region_hint, recolor_spec,
+                      candidates, **fal_options)
+    return out, key, True
+
+
+def _edit_key(
+    input_digest: str,
+    backend: str,
+    prompt: str,
+    negative_prompt: str,
+    strength: float,
+    seed: int,
+    region_hint: str,
+    recolor_spec: Optional[Dict],
+    fal_options: Dict[str, Any],
+    candidates: int = 1,
+) -> str:
+    key_args: Dict[str, Any] = {
+        "backend": backend,
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "strength": round(float(strength), 6),
+        "seed": seed,
+        "region_hint": region_hint,
+    }
+    if recolor_spec:
+        key_args["recolor_spec"] = recolor_spec
+    if candidates > 1:
+        key_args["candidates"] = candidates
+    key_args.update({k: v for k, v in fal_options.items() if k not in _NON_KEY_OPTIONS})
+    return step_key(input_digest, key_args)
+
+
+async def _apply_edit_async(
+    backend: str,
+    image: Union[Image.Image, RemoteImage],
+    prompt: str,
+    negative_prompt: str,
+    strength: float,
+    seed: int,
+    region_hint: str,
+    recolor_spec: Optional[Dict] = None,
+    candidates: int = 1,
+    **fal_options: Any,
+) -> Union[Image.Image, RemoteImage, List[Union[Image.Image, RemoteImage]]]:
+    """`_apply_edit` on the backends' async entry points; nothing here blocks the event loop."""
+    spec = backends.get_spec(backend)
+    if spec.remote:
+        module = await asyncio.to_thread(backends.load, backend)
+        if candidates > 1:
+            fal_options["num_images"] = candidates
+        return await module.apply_edit_async(
+            image=image,
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            strength=strength,  # kept for API compat
+            seed=seed,
+            region_hint=region_hint,
+            **fal_options,
+        )
+    if candidates > 1:
+        return list(await asyncio.gather(*(
+            _apply_edit_async(backend, image, prompt, negative_prompt, strength, s, region_hint, recolor_spec)
+            for s in _candidate_seeds(seed, candidates)
+        )))
+    image = await asyncio.to_thread(resolve_image, image)
+    module = await asyncio.to_thread(backends.load, backend)
+    if module is None:
         return image
+    extra = {"recolor_spec": recolor_spec} if recolor_spec is not None else {}
+    with tracing.span("inference", backend=backend):
+        return await module.apply_edit_async(
+            image=image,
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            strength=strength,
+            seed=seed,
+            region_hint=region_hint,
+            **extra,
+        )
+
+
+async def _cached_apply_edit_async(
+    cache: Optional[StepCache],
+    counters: Dict[str, int],
+    input_digest: Optional[str],
+    backend: str,
+    image: Union[Image.Image, RemoteImage],
+    prompt: str,
+    negative_prompt: str,
+    strength: float,
+    seed: int,
+    region_hint: str,
+    recolor_spec: Optional[Dict] = None,
+    candidates: int = 1,
+    inflight: Optional[asyncio.Semaphore] = None,
+    **fal_options: Any,
+) -> Tuple[Union[Image.Image, RemoteImage, List], Optional[str], bool]:
+    """
+    `_cached_apply_edit` for the event loop. `inflight` bounds concurrent model calls
+    (cache hits and local pixel recolors do not take a slot).
+    """
+    key: Optional[str] = None
+    if cache is not None and input_digest is not None:
+        key = _edit_key(input_digest, backend, prompt, negative_prompt, strength, seed, region_hint, recolor_spec,
+                        fal_options, candidates)
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            counters["hits"] += 1
+            return cached, key, False
+        counters["misses"] += 1
+    call = _apply_edit_async(backend, image, prompt, negative_prompt, strength, seed, region_hint, recolor_spec,
+                             candidates, **fal_options)
+    if inflight is None or backends.get_spec(backend).deterministic:
+        return await call, key, True
+    async with inflight:
+        return await call, key, True
+
+
+def _cache_put(cache: StepCache, counters: Dict[str, int], key: str, img: Image.Image) -> None:
+    try:
+        with tracing.span("cache_put"):
+            cache.put(key, img)
+    except Exception as exc:
+        counters["errors"] += 1
+        print(f"[cache] Failed to store step result: {exc}")
 
 
 def _resolve_seed(base_seed: int, step_index: int, jitter: bool) -> int:
@@ -52,6 +275,176 @@ def _resolve_seed(base_seed: int, step_index: int, jitter: bool) -> int:
     return base_seed
 
 
+# The plan loop is a generator that yields every blocking call as (fn, args, kwargs)
+# and receives its result, so one implementation serves both entry points:
+# `run_restyle_plan` runs the calls inline, `run_restyle_plan_async` awaits them.
+_Blocking = Tuple[Callable[..., Any], Tuple[Any, ...], Dict[str, Any]]
+
+
+def _blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> _Blocking:
+    return fn, args, kwargs
+
+
+def _drive(gen: Generator[_Blocking, Any, Any]) -> Any:
+    result: Any = None
+    error: Optional[BaseException] = None
+    while True:
+        try:
+            fn, args, kwargs = gen.throw(error) if error is not None else gen.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            error = exc
+
+
+async def _drive_async(gen: Generator[_Blocking, Any, Any], inflight: Optional[asyncio.Semaphore] = None) -> Any:
+    """Backend calls go through the async backends; everything else runs on a worker thread."""
+    result: Any = None
+    error: Optional[BaseException] = None
+    try:
+        while True:
+            try:
+                fn, args, kwargs = gen.throw(error) if error is not None else gen.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                if fn is _cached_apply_edit:
+                    result = await _cached_apply_edit_async(*args, inflight=inflight, **kwargs)
+                else:
+                    result = await asyncio.to_thread(fn, *args, **kwargs)
+            except Exception as exc:
+                error = exc
+    finally:
+        gen.close()  # cancelled mid-plan: unwind the plan loop
+
+
+def _emit(on_step: Callable[[Dict[str, Any]], None], update: Dict[str, Any], started: float,
+          stream: Dict[str, Any]) -> None:
+    """Hand a step update to the caller; a failing callback is reported, never fatal."""
+    update["elapsed_s"] = round(time.perf_counter() - started, 3)
+    if update.get("frame") is not None:
+        stream.setdefault("first_frame_s", update["elapsed_s"])
+    try:
+        on_step(update)
+    except Exception as exc:
+        print(f"[stream] on_step failed for step {update.get('step')}: {exc}")
+
+
+def _pick_best(reference: Image.Image, candidates: List[Union[Image.Image, RemoteImage]],
+               goal_colors: Optional[List[str]]) -> Tuple[Union[Image.Image, RemoteImage], List[Dict[str, Any]]]:
+    """Score every candidate against the step input; returns (winner, scores in candidate order)."""
+    with tracing.span("score", candidates=len(candidates)):
+        scores = [score_candidate(reference, resolve_image(c), goal_colors) for c in candidates]
+    best = max(range(len(candidates)), key=lambda i: scores[i]["score"])
+    for i, entry in enumerate(scores):
+        entry["winner"] = i == best
+    return candidates[best], scores
+
+
+def _format_candidates(name: str, scores: List[Dict[str, Any]]) -> str:
+    parts = []
+    for i, entry in enumerate(scores, start=1):
+        color = f", color {entry['adherence']:.2f}" if entry["adherence"] is not None else ""
+        parts.append(f"#{i} {entry['score']:.3f} (drift {entry['drift']:.3f}{color})" + (" ✓" if entry["winner"] else ""))
+    return f"[best-of] {name}: " + "; ".join(parts)
+
+
+def _save_frame(writer: WriteGroup, store: Optional[RunStore], refs: Dict[str, str], img: Image.Image,
+                folder: Path, filename: str, saved: Optional[threading.Event] = None) -> Path:
+    """
+    Queue a frame save: a blob in the run store (linked into the run folder) or a plain PNG.
+    `saved` is set once the write is done (or failed), so spilled frames can be reloaded.
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / filename
+    writer.submit(str(path), _write_frame, store, refs, img, path, saved)
+    return path
+
+
+def _archive_frame(archive: FrameArchiveWriter, idx: int, img: Image.Image, saved: threading.Event) -> None:
+    try:
+        archive.add(idx, img)
+    finally:
+        saved.set()
+
+
+def _write_frame(store: Optional[RunStore], refs: Dict[str, str], img: Image.Image, path: Path,
+                 saved: Optional[threading.Event]) -> None:
+    try:
+        if store is not None:
+            refs[path.name] = store.save_image(img, path)
+        else:
+            with tracing.span("save", file=path.name):
+                img.save(path)
+    finally:
+        if saved is not None:
+            saved.set()
+
+
+def _index_run(store: RunStore, manifest: Dict[str, Any], refs: Dict[str, str], tokens: Optional[Dict],
+               trace_summary: Dict[str, Any], linked_run: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Index the run, apply retention; returns a log line when runs were evicted."""
+    step_times = {s["step"]: s["phases"].get("step") for s in trace_summary.get("steps", [])}
+    store.record_run(manifest, refs, tokens, step_times)
+    if linked_run and linked_run.get("run_id"):
+        store.touch(linked_run["run_id"])
+    evicted = store.enforce(protect=[manifest["run_id"]])
+    if not evicted["runs"]:
+        return None
+    return (f"[store] Evicted {evicted['runs']} least recently used run(s), "
+            f"{evicted['blobs']} blob(s), {format_bytes(evicted['bytes'])}")
+
+
+def _drift(reference: Image.Image, out: Union[Image.Image, RemoteImage]) -> float:
+    with tracing.span("drift"):
+        return drift_score(reference, resolve_image(out))
+
+
+@dataclass
+class RunOptions:
+    """
+    Optional settings of one plan run. Pass one as `options=`, or the same names as
+    keyword arguments (they override `options`).
+    """
+    brand_logo: Optional[Image.Image] = None
+    use_cache: bool = True                  # step cache for seeded model steps (default `<save_dir>/.kontext_cache`)
+    cache: Optional[StepCache] = None
+    remote_chain: bool = False              # chain FAL outputs by URL; pixels download in the background
+    transfer_encoding: str = "png"          # "png" | "webp_lossless" | "jpeg" for every step but the last
+    preview_long_edge: Optional[int] = None  # downscale the input and use cheaper inference (preview run)
+    inference: Optional[Dict[str, Any]] = None
+    step_seeds: Optional[List[int]] = None  # pinned per-step seeds, so a final render replays a preview
+    linked_run: Optional[Dict[str, Any]] = None  # the preview's record, when this is its final render
+    record: Optional[Dict[str, Any]] = None  # filled with the run's manifest (run.json)
+    drift_retry: Optional[float] = None     # re-run a step scoring above this with a new seed
+    drift_abort: Optional[float] = None     # stop the plan when a step still scores above this
+    drift_retries: int = 1
+    hedge: Optional[bool] = None            # FAL request hedging (default KONTEXT_HEDGE; kontext/hedging.py)
+    on_step: Optional[Callable[[Dict[str, Any]], None]] = None  # called as each step's frame is available
+    cancel: Optional[threading.Event] = None  # set to stop before the next step; finished frames are kept
+    candidates: int = 1                     # best-of-N per step, scored locally (kontext/quality.py)
+    tokens: Optional[Dict] = None           # indexed with the run in the run store
+    run_store: Optional[RunStore] = None    # default get_run_store(save_dir) unless KONTEXT_RUN_STORE=0
+    previous_run: Optional[Dict[str, Any]] = None  # run whose unchanged leading steps are reused
+    reuse_prefix: Optional[bool] = None     # default KONTEXT_REUSE_PREFIX (kontext/incremental.py)
+    frame_archive: Optional[bool] = None    # default KONTEXT_FRAME_ARCHIVE (kontext/frame_archive.py)
+    resume_from: Optional[Dict[str, Any]] = None
+
+
+# Settings recorded in run.json "run_args", so `resume_restyle_plan` runs the rest of a plan the same way.
+_RESUME_ARGS = ("use_cache", "remote_chain", "transfer_encoding", "preview_long_edge", "step_seeds", "drift_retry",
+                "drift_abort", "drift_retries", "hedge", "candidates")
+
+
+def _options(options: Optional[RunOptions], overrides: Dict[str, Any]) -> RunOptions:
+    """`options` with keyword overrides applied; unknown names raise TypeError."""
+    return replace(options or RunOptions(), **overrides)
+
+
 def run_restyle_plan(
     image: Image.Image,
     plan: List[Dict],
@@ -60,56 +453,865 @@ def run_restyle_plan(
     strength_multiplier: float,
     seed_jitter: bool,
     save_dir: Path,
-    brand_logo: Optional[Image.Image] = None,
-) -> Tuple[List[Image.Image], List[str]]:
+    options: Optional[RunOptions] = None,
+    *,
+    writer: Optional[ArtifactWriter] = None,
+    trace: Optional[tracing.Trace] = None,
+    session: Optional[str] = None,
+    priority: Optional[str] = None,
+    **overrides: Any,
+) -> Tuple[FrameList, List[str]]:
+    """
+    Iterate through plan steps, call backend, collect outputs. Optional settings come
+    from `options` / keyword arguments (see `RunOptions`). Frames and prompts are written
+    to a new run folder under `save_dir` by `writer` (pass one to share it), with run.json
+    checkpointed before every step. If a step raises, the run is marked "failed" and
+    `resume_restyle_plan(run_path)` continues it. FAL requests wait in the shared scheduler
+    as `session` / `priority` (kontext/scheduler.py). See README for the run folder layout.
+    """
+    opts = _options(options, overrides)
+    own_writer = writer is None
+    writer = writer or ArtifactWriter()
+    trace = trace or tracing.Trace()
+    token = tracing.activate(trace)
+    sched_token = scheduler.activate(session, priority)
+    rss = RssWatch().start()
+    try:
+        return _drive(_run_plan(_PlanRun(
+            image, plan, seed, backend, strength_multiplier, seed_jitter, save_dir, opts,
+            writer=writer.group(), trace=trace, rss=rss, session=session,
+        )))
+    finally:
+        rss.stop()
+        scheduler.deactivate(sched_token)
+        tracing.deactivate(token)
+        if own_writer:
+            writer.close()
+
+
+async def run_restyle_plan_async(
+    image: Image.Image,
+    plan: List[Dict],
+    seed: int,
+    backend: str,
+    strength_multiplier: float,
+    seed_jitter: bool,
+    save_dir: Path,
+    options: Optional[RunOptions] = None,
+    *,
+    writer: Optional[ArtifactWriter] = None,
+    trace: Optional[tracing.Trace] = None,
+    inflight: Optional[asyncio.Semaphore] = None,
+    session: Optional[str] = None,
+    priority: Optional[str] = None,
+    **overrides: Any,
+) -> Tuple[FrameList, List[str]]:
     """
-    Iterate through plan steps, call backend, collect outputs.
+    `run_restyle_plan` for an event loop: FAL calls go through fal_client's async API,
+    and pixel work, downloads and disk I/O run on worker threads, so one process can
+    drive many plans at once. `inflight`, if given, caps model calls in flight across
+    every plan sharing it. Other arguments are those of `run_restyle_plan`.
     """
-    out_frames: List[Image.Image] = []
-    logs: List[str] = []
-    current = image.copy()
-    save_dir.mkdir(parents=True, exist_ok=True)
-    run_id = uuid.uuid4().hex[:8]
-    run_path = save_dir / f"restyle_{run_id}"
-    run_path.mkdir(parents=True, exist_ok=True)
+    opts = _options(options, overrides)
+    own_writer = writer is None
+    writer = writer or ArtifactWriter()
+    trace = trace or tracing.Trace()
+    token = tracing.activate(trace)
+    sched_token = scheduler.activate(session, priority)
+    rss = RssWatch().start()
+    try:
+        return await _drive_async(
+            _run_plan(_PlanRun(
+                image, plan, seed, backend, strength_multiplier, seed_jitter, save_dir, opts,
+                writer=writer.group(), trace=trace, rss=rss, session=session,
+            )),
+            inflight,
+        )
+    finally:
+        rss.stop()
+        scheduler.deactivate(sched_token)
+        tracing.deactivate(token)
+        if own_writer:
+            await asyncio.to_thread(writer.close)
+
+
+def _resume_options(run_path: Path) -> Dict[str, Any]:
+    """`run_restyle_plan` arguments that continue the run checkpointed in `run_path`."""
+    manifest = checkpoint.load_manifest(run_path)
+    if not checkpoint.is_resumable(manifest):
+        by = f" and was resumed by run {manifest['resumed_by']}" if manifest.get("resumed_by") else ""
+        raise ValueError(f"{run_path}: run is {manifest.get('status')}{by}; nothing to resume")
+    logo_path = run_path / manifest["brand_logo"] if manifest.get("brand_logo") else None
+    return {
+        **manifest["run_args"],
+        "image": load_frame(run_path / manifest["input"]),
+        "plan": manifest["plan"],
+        "save_dir": run_path.parent,
+        "brand_logo": load_frame(logo_path) if logo_path is not None and logo_path.exists() else None,
+        "tokens": manifest.get("tokens"),
+        "resume_from": manifest,
+    }
+
+
+def resume_restyle_plan(run_path: Path, **options: Any) -> Tuple[FrameList, List[str]]:
+    """
+    Continue a failed, cancelled or interrupted run (kontext/checkpoint.py): a new run in
+    the same output folder reuses the frames of the steps the old one finished and runs
+    the rest with the recorded plan, tokens, seeds and settings. The old run's run.json
+    gets `resumed_by`. `options` override `run_restyle_plan` arguments (session, backend, ...).
+    """
+    kwargs = {**_resume_options(run_path), **options}
+    record = kwargs["record"] = kwargs.get("record") if kwargs.get("record") is not None else {}
+    try:
+        return run_restyle_plan(**kwargs)
+    finally:
+        if record.get("run_id"):
+            checkpoint.mark_resumed(run_path, record["run_id"])
+
+
+async def resume_restyle_plan_async(run_path: Path, **options: Any) -> Tuple[FrameList, List[str]]:
+    """`resume_restyle_plan` on an event loop (see `run_restyle_plan_async`)."""
+    kwargs = {**(await asyncio.to_thread(_resume_options, run_path)), **options}
+    record = kwargs["record"] = kwargs.get("record") if kwargs.get("record") is not None else {}
+    try:
+        return await run_restyle_plan_async(**kwargs)
+    finally:
+        if record.get("run_id"):
+            await asyncio.to_thread(checkpoint.mark_resumed, run_path, record["run_id"])
+
+
+async def iter_restyle_plan_async(
+    image: Image.Image,
+    plan: List[Dict],
+    seed: int,
+    backend: str,
+    strength_multiplier: float,
+    seed_jitter: bool,
+    save_dir: Path,
+    **options: Any,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream a plan: yields each `on_step` update (see `run_restyle_plan`) as soon as the
+    step's frame is available, then {"done": True, "frames", "logs"}. Closing the
+    iterator early (e.g. a cancelled UI event) cancels the plan and its FAL request.
+    """
+    async for update in _stream(lambda on_step: run_restyle_plan_async(
+        image, plan, seed, backend, strength_multiplier, seed_jitter, save_dir, on_step=on_step, **options
+    )):
+        yield update
+
+
+async def iter_resume_restyle_plan_async(run_path: Path, **options: Any) -> AsyncIterator[Dict[str, Any]]:
+    """`resume_restyle_plan` streamed like `iter_restyle_plan_async` (reused steps are streamed too)."""
+    async for update in _stream(lambda on_step: resume_restyle_plan_async(run_path, on_step=on_step, **options)):
+        yield update
+
+
+async def _stream(start: Callable[[Callable[[Dict[str, Any]], None]], Any]) -> AsyncIterator[Dict[str, Any]]:
+    loop = asyncio.get_running_loop()
+    updates: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+    def _push(update: Dict[str, Any]) -> None:
+        loop.call_soon_threadsafe(updates.put_nowait, update)
+
+    task = asyncio.ensure_future(start(_push))
+    try:
+        while not task.done():
+            getter = asyncio.ensure_future(updates.get())
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+        frames, logs = task.result()
+        await asyncio.sleep(0)  # let callbacks scheduled by fetch threads land
+        while not updates.empty():
+            yield updates.get_nowait()
+        yield {"done": True, "frames": frames, "logs": logs}
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+
+
+class _StepResult(NamedTuple):
+    """The attempt a step keeps (see `_PlanRun.execute_step`)."""
+    out: Any
+    cache_payload: Any
+    digest: Optional[str]
+    fresh: bool
+    seed: int
+    drift: Optional[float]
+    label: str
+
+
+class _PlanRun:
+    """
+    One run of a plan. Its generator methods yield blocking calls like the plan loop
+    (`_run_plan`) does: `start`, then per step `write_checkpoint` and `reuse_step` or
+    `execute_step` → `persist_step`, then `finish` (or `fail` if a step raised).
+    """
+
+    def __init__(self, image: Image.Image, plan: List[Dict], seed: int, backend: str, strength_multiplier: float,
+                 seed_jitter: bool, save_dir: Path, options: RunOptions, *, writer: WriteGroup,
+                 trace: tracing.Trace, rss: Optional[RssWatch] = None, session: Optional[str] = None) -> None:
+        self.image, self.plan, self.seed, self.backend = image, plan, seed, backend
+        self.strength_multiplier, self.seed_jitter, self.save_dir = strength_multiplier, seed_jitter, save_dir
+        self.opts, self.writer, self.trace, self.rss, self.session = options, writer, trace, rss, session
+        self.started = time.perf_counter()
+        self.frames = FrameList()
+        self.pending: List[Tuple[int, RemoteImage, str, Optional[str]]] = []
+        self.logs: List[str] = []
+        self.current: Union[Image.Image, RemoteImage] = image.copy()
+        self.previous_input: Optional[Union[Image.Image, RemoteImage]] = None
+        self.mode = "full"
+        self.inference = options.inference
+        self.check_drift = options.drift_retry is not None or options.drift_abort is not None
+        self.drift_scores: List[Optional[float]] = []
+        self.drift_retried = 0
+        self.aborted: Optional[Dict[str, Any]] = None
+        self.cancelled: Optional[int] = None
+        self.candidate_scores: Dict[str, List[Dict[str, Any]]] = {}
+        self.stream: Dict[str, Any] = {}
+        self.seeds_used: List[Optional[int]] = []
+        self.wire: List[Tuple[str, Dict[str, Any]]] = []
+        self.chained = 0
+        self.step_at: Optional[int] = None
+        self.run_id = uuid.uuid4().hex[:8]
+        self.run_path = save_dir / f"restyle_{self.run_id}"
+        self.refs: Dict[str, str] = {}
+        self.cache_counters = {"hits": 0, "misses": 0, "errors": 0}
+        self.is_fal = any(backends.get_spec(step.get("backend") or backend).remote for step in plan)
+
+    def step_name(self, idx: int) -> str:
+        return self.plan[idx].get("name", f"step_{idx+1}")
+
+    def start(self) -> Generator[_Blocking, Any, None]:
+        """Preview downscale, run folder, step cache and how many leading steps are reused (or resumed)."""
+        opts, plan, backend = self.opts, self.plan, self.backend
+        if opts.preview_long_edge:
+            self.mode = "preview"
+            self.current = yield _blocking(downscale_long_edge, self.current, int(opts.preview_long_edge))
+            if self.inference is None and self.is_fal:
+                self.inference = dict(backends.load(backends.FAL, init=False).PREVIEW_INFERENCE)
+            self.logs.append(f"[preview] {self.image.size[0]}x{self.image.size[1]} → "
+                             f"{self.current.size[0]}x{self.current.size[1]}")
+        self.render_size = list(self.current.size)
+        self.reference = self.current
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        self.run_path.mkdir(parents=True, exist_ok=True)
+        self.store = opts.run_store or (get_run_store(self.save_dir) if run_store_enabled() else None)
+        frame_archive = archive_enabled() if opts.frame_archive is None else opts.frame_archive
+        self.archive = FrameArchiveWriter(self.run_path / ARCHIVE_NAME) if frame_archive else None
+        self.run_args = {
+            "seed": self.seed, "backend": backend, "strength_multiplier": self.strength_multiplier,
+            "seed_jitter": self.seed_jitter, **{name: getattr(opts, name) for name in _RESUME_ARGS},
+            "inference": self.inference, "frame_archive": bool(frame_archive),
+        }
+        _save_frame(self.writer, self.store, self.refs, self.image, self.run_path, checkpoint.INPUT_NAME)
+
+        seed = self.seed
+        cacheable = opts.use_cache and seed is not None and seed > 0 and backends.get_spec(backend).cacheable
+        self.step_cache = (opts.cache or get_cache(self.save_dir / ".kontext_cache")) if cacheable else None
+        reuse_prefix = incremental.enabled_by_default() if opts.reuse_prefix is None else opts.reuse_prefix
+        # Random-seed runs (seed <= 0) ask for fresh samples, so they never reuse frames.
+        self.track = reuse_prefix and (opts.step_seeds is not None or (seed is not None and seed > 0))
+        digest = (yield _blocking(image_digest, self.current)) if self.step_cache is not None or self.track else None
+        self.fingerprints = _step_fingerprints(plan, backend, self.strength_multiplier, seed, self.seed_jitter,
+                                               opts.step_seeds, opts.candidates, opts.transfer_encoding)
+        self.reuse_key = incremental.run_key(digest or "", render_size=self.render_size, inference=self.inference or {},
+                                             drift=[opts.drift_retry, opts.drift_abort, opts.drift_retries])
+        self.reused, self.reuse = 0, None
+        self.previous = opts.resume_from
+        if opts.resume_from is not None:
+            resume_from = opts.resume_from
+            self.reused = checkpoint.completed_prefix(resume_from)
+            saved_calls = self._model_calls(self.reused)
+            self.reuse = {"from_run": resume_from.get("run_id"), "steps": self.reused, "calls_saved": saved_calls,
+                          "changed": [], "reason": "resumed"}
+            self.logs.append(f"[resume] {self.reused} of {len(plan)} step(s) already done in run "
+                             f"{resume_from.get('run_id')} ({saved_calls} model call(s) not repeated); "
+                             f"continuing from step {self.reused + 1}")
+        elif self.track:
+            self._find_reusable_prefix()
+        # The step cache chains digests; without it only the run key needs one.
+        self.digest = digest if self.step_cache is not None else None
+        self.http_before = backends.load(backends.FAL, init=False).transport_stats() if self.is_fal else None
+        self.hedge_before = hedging.hedge_stats() if self.is_fal else None
+
+        if opts.brand_logo is not None:
+            try:
+                logo_path = _save_frame(self.writer, self.store, self.refs, opts.brand_logo.convert("RGBA"),
+                                        self.run_path, "brand_logo.png")
+                self.logs.append(f"[logo] Saved brand logo reference to: {logo_path}")
+            except Exception as exc:
+                self.logs.append(f"[logo] Failed to save brand logo reference: {exc}")
+
+    def _model_calls(self, steps: int) -> int:
+        return sum(_is_model_call(step.get("backend") or self.backend) for step in self.plan[:steps])
 
-    if brand_logo is not None:
+    def _find_reusable_prefix(self) -> None:
+        """Compare against `previous_run` (or the session's last run on this input); kontext/incremental.py."""
+        opts, plan = self.opts, self.plan
+        previous = opts.previous_run
+        if previous is None and self.session is not None:
+            previous = incremental.last_run(self.session, self.reuse_key)
+        self.previous = previous
+        changed = incremental.changed_fields(previous.get("tokens"), opts.tokens) if previous and opts.tokens else []
+        self.reused, reason = incremental.reusable_prefix(
+            previous, self.reuse_key, self.fingerprints, [step.get("depends_on", []) for step in plan], changed
+        )
+        if not previous:
+            return
+        saved_calls = self._model_calls(self.reused)
+        self.reuse = {"from_run": previous.get("run_id"), "steps": self.reused, "calls_saved": saved_calls,
+                      "changed": changed, "reason": reason}
+        if self.reused:
+            rerun = (f"re-running from step {self.reused + 1} ({plan[self.reused].get('name')}: {reason})"
+                     if self.reused < len(plan) else "nothing to re-run")
+            self.logs.append(f"[reuse] {self.reused} of {len(plan)} step(s) from run {previous.get('run_id')} "
+                             f"({saved_calls} model call(s) saved); {rerun}")
+        else:
+            self.logs.append(f"[reuse] Running every step ({reason})")
+
+    # -- checkpoint ------------------------------------------------------------------
+
+    def progress(self, status: str, error: Optional[str] = None, failed: Optional[int] = None) -> Dict[str, Any]:
+        """The run's checkpoint: enough to resume it (kontext/checkpoint.py)."""
+        resume_from = self.opts.resume_from
+        return {
+            "run_id": self.run_id,
+            "run_path": str(self.run_path),
+            "status": status,
+            "error": error,
+            "mode": self.mode,
+            "backend": self.backend,
+            "input": checkpoint.INPUT_NAME,
+            "brand_logo": "brand_logo.png" if self.opts.brand_logo is not None else None,
+            "plan": self.plan,
+            "tokens": self.opts.tokens,
+            "run_args": self.run_args,
+            "steps": [self.step_name(i) for i in range(len(self.plan))],
+            "step_status": _step_status(self.frames, len(self.plan), failed, self.aborted),
+            "step_seeds": self.seeds_used,
+            "drift": [None if score is None else round(score, 4) for score in self.drift_scores],
+            "frames": [p.name if p is not None else None for p in self.frames.paths()],
+            "resumed_from": resume_from.get("run_id") if resume_from else None,
+        }
+
+    def write_checkpoint(self, status: str) -> Generator[_Blocking, Any, None]:
+        yield _blocking(checkpoint.write_manifest, self.run_path, self.progress(status))
+
+    def fail(self, exc: Exception) -> Generator[_Blocking, Any, None]:
+        """
+        Keep what was paid for: land finished downloads and queued writes, then checkpoint
+        the failure so `resume_restyle_plan` can continue from the first unfinished step.
+        """
+        tracing.set_step(None)
+        for entry in self.pending:
+            try:
+                self._keep_remote(entry, (yield _blocking(entry[1].image)))
+            except Exception:
+                pass
+        for err in (yield _blocking(self.writer.flush)):
+            self.logs.append(err)
+        progress = self.progress("failed", f"{type(exc).__name__}: {exc}", failed=self.step_at)
+        yield _blocking(checkpoint.write_manifest, self.run_path, progress)
+        # Indexed like any other run, so retention can evict it (and its blobs) once it is stale.
+        yield from self.index({**progress, "elapsed_s": round(time.perf_counter() - self.started, 3)}, {})
+        if self.opts.record is not None:
+            self.opts.record.update(progress)
+            self.opts.record["resume_hint"] = checkpoint.resume_hint(self.run_path)
+
+    def index(self, manifest: Dict[str, Any], trace_summary: Dict[str, Any]) -> Generator[_Blocking, Any, None]:
+        """Index the run in the run store (kontext/run_store.py) and apply retention."""
+        if self.store is None:
+            return
         try:
-            logo_path = save_image(brand_logo.convert("RGBA"), run_path, "brand_logo.png")
-            logs.append(f"[logo] Saved brand logo reference to: {logo_path}")
+            evicted = yield _blocking(_index_run, self.store, manifest, dict(self.refs), self.opts.tokens,
+                                      trace_summary, self.opts.linked_run)
+            if evicted:
+                self.logs.append(evicted)
         except Exception as exc:
-            logs.append(f"[logo] Failed to save brand logo reference: {exc}")
+            self.logs.append(f"[store] Failed to index run: {exc}")
 
-    for idx, step in enumerate(plan):
-        step_seed = _resolve_seed(seed, idx, seed_jitter)
-        s = max(0.05, float(step.get("strength", 0.3)) * float(strength_multiplier))
-        prompt = step["prompt"]
-        negative = step["negative_prompt"]
-        region = step.get("region_hint", "global")
-        name = step.get("name", f"step_{idx+1}")
+    # -- persist ---------------------------------------------------------------------
+
+    def _frame_path(self, idx: int, filename: str) -> Path:
+        return frame_ref(self.archive.path, idx) if self.archive is not None else self.run_path / filename
+
+    def _save_step(self, idx: int, img: Image.Image, path: Path, saved: threading.Event) -> Path:
+        """Queue a step frame: into the run's frame archive, else as a PNG like any other frame."""
+        if self.archive is None:
+            return _save_frame(self.writer, self.store, self.refs, img, self.run_path, path.name, saved)
+        self.writer.submit(path.name, _archive_frame, self.archive, idx, img, saved)
+        return path
 
-        # Save prompt as reference
-        (run_path / f"{idx:02d}_{name}_prompt.txt").write_text(
-            f"PROMPT:\n{prompt}\n\nNEGATIVE:\n{negative}\n", encoding="utf-8"
+    def _store_in_cache(self, key: str, img: Any) -> None:
+        self.writer.submit(f"cache entry {key[:12]}", _cache_put, self.step_cache, self.cache_counters, key, img)
+
+    def _keep_remote(self, entry: Tuple[int, RemoteImage, str, Optional[str]], img: Image.Image) -> None:
+        idx, handle, filename, key = entry
+        path = self._frame_path(idx, filename)
+        self._save_step(idx, img, path, self.frames.set(idx, img, path))
+        if self.step_cache is not None and key is not None:
+            self._store_in_cache(key, img)
+        handle.release()
+
+    def _write_prompt(self, idx: int, step: Dict) -> None:
+        self.writer.write_text(
+            self.run_path / f"{idx:02d}_{self.step_name(idx)}_prompt.txt",
+            f"PROMPT:\n{step['prompt']}\n\nNEGATIVE:\n{step['negative_prompt']}\n",
         )
 
-        out = _apply_edit(
-            backend=backend,
-            image=current,
-            prompt=prompt,
-            negative_prompt=negative,
-            strength=s,
-            seed=step_seed,
-            region_hint=region,
+    def _notify(self, update: Dict[str, Any]) -> None:
+        if self.opts.on_step is not None:
+            _emit(self.opts.on_step, update, self.started, self.stream)
+
+    def reuse_step(self, idx: int, step_started: float) -> Generator[_Blocking, Any, None]:
+        """Carry step `idx`'s frame over from the previous (or resumed) run."""
+        previous, name = self.previous, self.step_name(idx)
+        frame = yield _blocking(load_frame, Path(previous["run_path"]) / previous["frames"][idx])
+        self._write_prompt(idx, self.plan[idx])
+        out_path = self._frame_path(idx, f"{idx:02d}_{name}.png")
+        self._save_step(idx, frame, out_path, self.frames.append(frame, out_path))
+        old_seeds, old_drift = previous.get("step_seeds") or [], previous.get("drift") or []
+        self.seeds_used.append(old_seeds[idx] if idx < len(old_seeds) else None)
+        self.drift_scores.append(old_drift[idx] if idx < len(old_drift) else None)
+        if self.step_cache is not None:
+            self.digest = yield _blocking(image_digest, frame)
+        self.logs.append(f"[{idx+1}/{len(self.plan)}] {name} (reused from run {previous.get('run_id')}) → {out_path}")
+        self._notify({
+            "step": idx, "name": name, "total": len(self.plan), "frame": frame, "path": str(out_path),
+            "log": self.logs[-1], "drift": self.drift_scores[-1], "reused": True,
+            "step_s": round(time.perf_counter() - step_started, 3),
+        })
+        self.previous_input, self.current = self.current, frame
+        tracing.record_span("step", step_started, time.perf_counter() - step_started, reused=True)
+
+    def persist_step(self, idx: int, result: _StepResult, step_started: float) -> None:
+        """Save (or queue the download of) the step's frame, cache it, log it and hand it to `on_step`."""
+        name, out = self.step_name(idx), result.out
+        self.drift_scores.append(result.drift)
+        filename = f"{idx:02d}_{name}.png"
+        out_path = self._frame_path(idx, filename)
+        if isinstance(out, RemoteImage):
+            out.digest = result.digest
+            self.pending.append((idx, out, filename, result.digest if result.fresh else None))
+            self.chained += 1
+            self.frames.append(None)
+        else:
+            self._save_step(idx, out, out_path, self.frames.append(out, out_path))
+            if result.fresh and self.step_cache is not None and result.digest is not None:
+                self._store_in_cache(result.digest, result.cache_payload)
+        self.logs.append(f"[{idx+1}/{len(self.plan)}] {result.label} → {out_path}")
+        if self.opts.on_step is not None:
+            update = {
+                "step": idx, "name": name, "total": len(self.plan), "frame": out, "path": str(out_path),
+                "log": self.logs[-1], "drift": result.drift, "step_s": round(time.perf_counter() - step_started, 3),
+            }
+            if isinstance(out, RemoteImage):
+                out.when_ready(lambda img, u=update: self._notify({**u, "frame": img}))
+            else:
+                self._notify(update)
+        self.previous_input, self.current = self.current, out
+        # Chained frames whose download already landed are saved now, so their pixels can be dropped.
+        for entry in [p for p in self.pending if p[1] is not out and p[1].ready()]:
+            self.pending.remove(entry)
+            with tracing.step(entry[0], self.step_name(entry[0])):
+                self._keep_remote(entry, entry[1].image())
+        tracing.record_span("step", step_started, time.perf_counter() - step_started)
+
+    def abort_step(self, idx: int, result: _StepResult, step_started: float) -> Generator[_Blocking, Any, None]:
+        """The step drifted past `drift_abort`: keep its frame for inspection, but not as a plan output."""
+        name = self.step_name(idx)
+        drifted = yield _blocking(resolve_image, result.out)
+        out_path = _save_frame(self.writer, self.store, self.refs, drifted, self.run_path, f"{idx:02d}_{name}_drifted.png")
+        self.drift_scores.append(result.drift)
+        self.aborted = {"step": idx, "name": name, "drift": round(result.drift, 4), "skipped": len(self.plan) - idx - 1}
+        self.logs.append(f"[{idx+1}/{len(self.plan)}] {result.label} → {out_path}")
+        self.logs.append(
+            f"[drift] {name}: {result.drift:.3f} > abort {self.opts.drift_abort:.2f}; stopping the plan "
+            f"({self.aborted['skipped']} step(s) skipped, keeping the previous frame)"
         )
-        out_frames.append(out)
-        out_path = save_image(out, run_path, f"{idx:02d}_{name}.png")
-        logs.append(
-            f"[{idx+1}/{len(plan)}] {name} (seed={step_seed}, strength={s:.2f}) → {out_path}"
+        self._notify({
+            "step": idx, "name": name, "total": len(self.plan), "frame": None, "path": str(out_path),
+            "log": "\n".join(self.logs[-2:]), "drift": result.drift,
+            "step_s": round(time.perf_counter() - step_started, 3), "aborted": True,
+        })
+        tracing.record_span("step", step_started, time.perf_counter() - step_started)
+
+    def drifted_past_abort(self, result: _StepResult) -> bool:
+        return result.drift is not None and self.opts.drift_abort is not None and result.drift > self.opts.drift_abort
+
+    def land_pending(self) -> Generator[_Blocking, Any, None]:
+        """Materialize the remaining chained remote outputs (already downloading in the background)."""
+        while self.pending:
+            entry = self.pending.pop(0)
+            self.step_at = entry[0]
+            with tracing.step(entry[0], self.step_name(entry[0])):
+                self._keep_remote(entry, (yield _blocking(entry[1].image)))
+
+    # -- execute ---------------------------------------------------------------------
+
+    def _step_seed(self, idx: int) -> int:
+        step_seeds = self.opts.step_seeds
+        if step_seeds is not None and idx < len(step_seeds):
+            return int(step_seeds[idx])
+        return _resolve_seed(self.seed, idx, self.seed_jitter)
+
+    def _crop_region(self, name: str, region: str) -> Generator[_Blocking, Any, Tuple[Any, Any, Any, Any, str]]:
+        """
+        Region-scoped steps edit a padded crop and are feathered back in after the edit.
+        Returns (step input, full frame, region box, crop box, log note); boxes are None for global edits.
+        """
+        if (region or "global").strip().lower() == "global":
+            return self.current, None, None, None, ""
+        full = yield _blocking(resolve_image, self.current)
+        region_box = None
+        try:
+            previous_change = None
+            if region.strip().lower() == "changed" and self.previous_input is not None:
+                previous_full = yield _blocking(resolve_image, self.previous_input)
+                previous_change = yield _blocking(diff_region, previous_full, full)
+            region_box = yield _blocking(resolve_region, region, full, previous_change)
+        except ValueError as exc:
+            self.logs.append(f"[region] {name}: {exc}; editing the full frame")
+        if region_box is None:
+            return self.current, full, None, None, f", region={region} → full frame"
+        crop_box = padded_box(region_box, full.size)
+        return full.crop(crop_box), full, region_box, crop_box, f", region={region_box}"
+
+    def _request_options(self, idx: int, name: str, attempt: int, step_backend: str,
+                         cropped: bool) -> Dict[str, Any]:
+        """FAL-only options for one attempt (transfer, chaining, wire stats, inference, hedging)."""
+        if not backends.get_spec(step_backend).remote:
+            return {}
+        opts = self.opts
+        step_stats: Dict[str, Any] = {}
+        self.wire.append((f"{idx+1:02d} {name}" + (f" (retry {attempt})" if attempt else ""), step_stats))
+        fal_options: Dict[str, Any] = {
+            "remote": opts.remote_chain and not cropped,
+            "transfer": opts.transfer_encoding,
+            "final_step": idx == len(self.plan) - 1,
+            "stats": step_stats,
+        }
+        if self.inference:
+            fal_options["inference"] = self.inference
+        if opts.hedge is not None:
+            fal_options["hedge"] = opts.hedge
+        return fal_options
+
+    def execute_step(self, idx: int, step: Dict) -> Generator[_Blocking, Any, _StepResult]:
+        """
+        Run the step's edit: region crop, the backend call (through the step cache),
+        best-of-N scoring and drift retries. Returns the attempt to keep.
+        """
+        opts = self.opts
+        name = self.step_name(idx)
+        step_seed = self._step_seed(idx)
+        strength = max(0.05, float(step.get("strength", 0.3)) * float(self.strength_multiplier))
+        region = step.get("region_hint", "global")
+        step_backend = step.get("backend") or self.backend
+        n_candidates = _candidate_count(step_backend, step.get("candidates") or opts.candidates)
+        backend_note = f", backend={step_backend}" if step_backend != self.backend else ""
+        self._write_prompt(idx, step)
+        step_input, full, region_box, crop_box, region_note = yield from self._crop_region(name, region)
+
+        input_digest = self.digest
+        retries = max(0, int(opts.drift_retries)) if opts.drift_retry is not None else 0
+        attempts: List[Tuple[float, Any, Any, Optional[str], bool, int]] = []
+        for attempt in range(1 + retries):
+            if attempt:
+                step_seed = (step_seed + _RETRY_SEED_STRIDE) % 1_000_000_000
+            out, digest, fresh = yield _blocking(
+                _cached_apply_edit,
+                self.step_cache,
+                self.cache_counters,
+                input_digest,
+                backend=step_backend,
+                image=step_input,
+                prompt=step["prompt"],
+                negative_prompt=step["negative_prompt"],
+                strength=strength,
+                seed=step_seed,
+                region_hint=region,
+                recolor_spec=step.get("recolor"),
+                candidates=n_candidates,
+                **self._request_options(idx, name, attempt, step_backend, crop_box is not None),
+            )
+            if isinstance(out, list):
+                out = yield from self.score_candidates(idx, name, attempt, step_input, out, step.get("goal_colors"))
+            cache_payload = out
+            if crop_box is not None:
+                cache_payload = yield _blocking(resolve_image, out)
+                out = yield _blocking(composite_region, full, cache_payload, crop_box, region_box)
+            if not self.check_drift:
+                self.digest = digest
+                break
+            score = yield _blocking(_drift, self.reference, out)
+            attempts.append((score, out, cache_payload, digest, fresh, step_seed))
+            if opts.drift_retry is None or score <= opts.drift_retry or attempt == retries:
+                break
+            self.drift_retried += 1
+            self.logs.append(
+                f"[drift] {name}: {score:.3f} > {opts.drift_retry:.2f} (seed={step_seed}); "
+                f"retrying with seed {(step_seed + _RETRY_SEED_STRIDE) % 1_000_000_000}"
+            )
+        drift: Optional[float] = None
+        if attempts:
+            drift, out, cache_payload, digest, fresh, step_seed = min(attempts, key=lambda a: a[0])
+            self.digest = digest
+        self.seeds_used.append(step_seed)
+        drift_note = f", drift={drift:.3f}" if drift is not None else ""
+        label = f"{name} (seed={step_seed}, strength={strength:.2f}{region_note}{backend_note}{drift_note})"
+        return _StepResult(out, cache_payload, digest, fresh, step_seed, drift, label)
+
+    # -- score -----------------------------------------------------------------------
+
+    def score_candidates(self, idx: int, name: str, attempt: int, step_input: Any, candidates: List[Any],
+                         goal_colors: Optional[List[str]]) -> Generator[_Blocking, Any, Any]:
+        """Best-of-N: keep the candidate that best preserves the step input's layout and hits its goal colors."""
+        step_reference = yield _blocking(resolve_image, step_input)
+        out, scores = yield _blocking(_pick_best, step_reference, candidates, goal_colors)
+        self.candidate_scores[f"{idx:02d}_{name}" + (f"_retry{attempt}" if attempt else "")] = scores
+        self.logs.append(_format_candidates(name, scores))
+        return out
+
+    def score_drift(self) -> Generator[_Blocking, Any, None]:
+        """
+        Unchecked steps are scored after the fact, so every run records its drift.
+        Spilled frames are reloaded one at a time (off the event loop in async runs).
+        """
+        for i in range(len(self.frames)):
+            if self.drift_scores[i] is None and self.frames.path(i) is not None:
+                with tracing.step(i, self.step_name(i)):
+                    frame = yield _blocking(self.frames.__getitem__, i)
+                    self.drift_scores[i] = yield _blocking(_drift, self.reference, frame)
+        if self.drift_scores:
+            self.logs.append(
+                "[drift] " + ", ".join(f"{self.step_name(i)}={score:.3f}" for i, score in enumerate(self.drift_scores))
+                + (f" ({self.drift_retried} retried)" if self.drift_retried else "")
+            )
+
+    # -- finish ----------------------------------------------------------------------
+
+    def _log_transfer_stats(self) -> Dict[str, int]:
+        """Wire, HTTP, hedging and cache summaries; returns this run's hedging counters."""
+        total_up = total_down = 0
+        for label, st in self.wire:
+            if not st:
+                continue  # served from cache
+            up, down = st.get("upload_bytes", 0), st.get("download_bytes", 0)
+            total_up += up
+            total_down += down
+            up_fmt = st.get("upload_format", "url") if up else "url"
+            self.logs.append(
+                f"[wire] {label}: ↑ {format_bytes(up)} ({up_fmt}) ↓ {format_bytes(down)} "
+                f"({st.get('output_format', '?')})"
+            )
+        if total_up or total_down:
+            self.logs.append(f"[wire] total ↑ {format_bytes(total_up)} ↓ {format_bytes(total_down)}")
+
+        if self.http_before is not None:
+            from kontext.transport import format_stats
+
+            http_after = backends.load(backends.FAL, init=False).transport_stats()
+            self.logs.append(format_stats({k: http_after[k] - self.http_before.get(k, 0) for k in http_after}))
+        hedge_delta: Dict[str, int] = {}
+        if self.hedge_before is not None:
+            hedge_after = hedging.hedge_stats()
+            hedge_delta = {k: hedge_after[k] - self.hedge_before.get(k, 0) for k in hedge_after}
+            if hedge_delta["requests"]:
+                self.logs.append(hedging.format_hedge_stats(hedge_delta))
+
+        if self.step_cache is not None:
+            counters = self.cache_counters
+            self.logs.append(
+                f"[cache] {counters['hits']} hit(s), {counters['misses']} miss(es)"
+                + (f", {counters['errors']} store error(s)" if counters["errors"] else "")
+                + f" — {self.step_cache.root}"
+            )
+        return hedge_delta
+
+    def finish(self) -> Generator[_Blocking, Any, Tuple[FrameList, List[str]]]:
+        """Score, write final.png, run.json and trace.json, index the run; returns (frames, logs)."""
+        opts, logs = self.opts, self.logs
+        if self.chained:
+            logs.append(f"[remote] Chained {self.chained} step(s) by URL; fetched outputs in the background")
+        yield from self.score_drift()
+
+        # Every run gets its own final.png (the last good frame), so concurrent runs never share one.
+        final_index = next((i for i in range(len(self.frames) - 1, -1, -1) if self.frames.path(i) is not None), None)
+        if final_index is not None:
+            final_frame = yield _blocking(self.frames.__getitem__, final_index)
+            _save_frame(self.writer, self.store, self.refs, final_frame, self.run_path, "final.png")
+
+        for err in (yield _blocking(self.writer.flush)):
+            logs.append(err)
+        archive_stats = self.archive.stats() if self.archive is not None else None
+        if archive_stats is not None:
+            logs.append(format_archive_stats(archive_stats))
+        hedge_delta = self._log_transfer_stats()
+
+        status = "aborted" if self.aborted else "cancelled" if self.cancelled is not None else "complete"
+        manifest: Dict[str, Any] = {
+            **self.progress(status),
+            "input_size": list(self.image.size),
+            "render_size": self.render_size,
+            "seed": self.seed,
+            "seed_jitter": self.seed_jitter,
+            "strength_multiplier": self.strength_multiplier,
+            "step_backends": [step.get("backend") or self.backend for step in self.plan],
+            "inference": self.inference or {},
+            "drift_limits": {"retry": opts.drift_retry, "abort": opts.drift_abort, "retries": opts.drift_retries},
+            "drift_retried": self.drift_retried,
+            "aborted": self.aborted,
+            "cancelled_before_step": self.cancelled,
+            "candidates": opts.candidates,
+            "candidate_scores": self.candidate_scores,
+            "trace": "trace.json",
+            "final": "final.png" if final_index is not None else None,
+            "hedge": hedge_delta,
+            "run_key": self.reuse_key,
+            "step_fingerprints": self.fingerprints[:len(self.frames)],
+            "reuse": self.reuse,
+            "frame_archive": archive_stats,
+            "elapsed_s": round(time.perf_counter() - self.started, 3),
+        }
+        if self.rss is not None:
+            memory = self.rss.stop()
+            manifest["memory"] = {**memory, "frames_in_memory": self.frames.keep}
+            if memory["peak_mb"] is not None:
+                logs.append(
+                    f"[memory] peak RSS {memory['peak_mb']:.0f} MB (+{memory['peak_mb'] - (memory['start_mb'] or 0.0):.0f} MB "
+                    f"during the run; process-wide); {self.frames.decoded()} of {len(self.frames)} frame(s) kept decoded"
+                )
+        if self.stream.get("first_frame_s") is not None:
+            manifest["first_frame_s"] = self.stream["first_frame_s"]
+            logs.append(f"[stream] first frame after {self.stream['first_frame_s']:.2f}s")
+        if opts.linked_run:
+            yield from self._link_run(manifest)
+        trace_data = yield _blocking(self.trace.finish, self.run_path / "trace.json", run_id=self.run_id,
+                                     mode=self.mode, backend=self.backend)
+        logs.append(tracing.format_summary(trace_data["summary"]))
+        yield _blocking(checkpoint.write_manifest, self.run_path, manifest)
+        yield from self.index(manifest, trace_data["summary"])
+        if opts.record is not None:
+            opts.record.update(manifest)
+            opts.record["trace_summary"] = trace_data["summary"]
+        if self.track and self.session is not None:
+            incremental.remember(self.session, manifest)
+        return self.frames, logs
+
+    def _link_run(self, manifest: Dict[str, Any]) -> Generator[_Blocking, Any, None]:
+        """Record a final render with the preview it replays (`preview_final_pairs.jsonl`)."""
+        linked_run = self.opts.linked_run
+        gap = manifest["elapsed_s"] - float(linked_run.get("elapsed_s", 0.0))
+        manifest["linked_run"] = {
+            "run_id": linked_run.get("run_id"),
+            "mode": linked_run.get("mode"),
+            "elapsed_s": linked_run.get("elapsed_s"),
+        }
+        yield _blocking(_append_jsonl, self.save_dir / "preview_final_pairs.jsonl", {
+            "preview_run_id": linked_run.get("run_id"),
+            "final_run_id": self.run_id,
+            "preview_elapsed_s": linked_run.get("elapsed_s"),
+            "final_elapsed_s": manifest["elapsed_s"],
+            "gap_s": round(gap, 3),
+        })
+        self.logs.append(
+            f"[preview] {self.mode} render {manifest['elapsed_s']:.1f}s vs {linked_run.get('mode')} "
+            f"{float(linked_run.get('elapsed_s', 0.0)):.1f}s (gap {gap:+.1f}s)"
         )
-        current = out
 
-    return out_frames, logs
+
+def _run_plan(run: _PlanRun) -> Generator[_Blocking, Any, Tuple[FrameList, List[str]]]:
+    plan, cancel = run.plan, run.opts.cancel
+    yield from run.start()
+    try:
+        for idx, step in enumerate(plan):
+            run.step_at = idx
+            yield from run.write_checkpoint("running")
+            if cancel is not None and cancel.is_set():
+                run.cancelled = idx
+                run.logs.append(f"[cancel] Stopped before step {idx+1}/{len(plan)}; keeping {idx} finished step(s)")
+                break
+            step_started = time.perf_counter()
+            tracing.set_step(idx, run.step_name(idx))
+            if idx < run.reused:
+                yield from run.reuse_step(idx, step_started)
+                continue
+            result = yield from run.execute_step(idx, step)
+            if run.drifted_past_abort(result):
+                yield from run.abort_step(idx, result, step_started)
+                break
+            run.persist_step(idx, result, step_started)
+        tracing.set_step(None)
+        yield from run.land_pending()
+    except Exception as exc:
+        yield from run.fail(exc)
+        raise
+    return (yield from run.finish())
+
+
+def _step_status(frames: FrameList, total: int, failed: Optional[int], aborted: Optional[Dict[str, Any]]) -> List[str]:
+    status = []
+    for i in range(total):
+        if i < len(frames):
+            status.append("done" if frames.saved(i) else "failed" if i == failed else "saving")
+        elif i == failed:
+            status.append("failed")
+        elif aborted and aborted["step"] == i:
+            status.append("aborted")
+        else:
+            status.append("pending")
+    return status
+
+
+def _is_model_call(backend: str) -> bool:
+    spec = backends.get_spec(backend)
+    return spec.module is not None and not spec.deterministic
+
+
+def _step_fingerprints(plan: List[Dict], backend: str, strength_multiplier: float, seed: Optional[int],
+                       seed_jitter: bool, step_seeds: Optional[List[int]], candidates: int,
+                       transfer_encoding: str) -> List[str]:
+    """Per-step fingerprints (kontext/incremental.py), with the seeds and settings the plan loop will use."""
+    fingerprints = []
+    for idx, step in enumerate(plan):
+        step_backend = step.get("backend") or backend
+        if step_seeds is not None and idx < len(step_seeds):
+            step_seed: Optional[int] = int(step_seeds[idx])
+        else:
+            step_seed = _resolve_seed(seed, idx, seed_jitter) if seed is not None and seed > 0 else None
+        final = idx == len(plan) - 1
+        fingerprints.append(incremental.step_fingerprint(
+            step,
+            step_backend,
+            max(0.05, float(step.get("strength", 0.3)) * float(strength_multiplier)),
+            step_seed,
+            _candidate_count(step_backend, step.get("candidates") or candidates),
+            output_format_for(transfer_encoding, final) if backends.get_spec(step_backend).remote else "png",
+        ))
+    return fingerprints
+
+
+def downscale_long_edge(img: Image.Image, long_edge: int) -> Image.Image:
+    """Shrink so the longer side is at most `long_edge` (never upscales)."""
+    w, h = img.size
+    if max(w, h) <= long_edge:
+        return img
+    scale = long_edge / float(max(w, h))
+    return img.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+
+
+def _append_jsonl(path: Path, row: Dict[str, Any]) -> None:
+    with path.open("a", encoding="utf-8") as fh:
+        fh.write(json.dumps(row) + "\n")
 
 
 def save_image(img: Image.Image, folder: Path, filename: str) -> Path:
@@ -0,0 +1,422 @@
+"""
+Process-wide scheduler for FAL model requests. Every request from
+`fal_backend.apply_edit` / `apply_edit_async` waits here for a slot:
+  - a token bucket caps the request rate (KONTEXT_FAL_RATE per second, bursts of KONTEXT_FAL_BURST);
+  - at most KONTEXT_FAL_MAX_INFLIGHT requests are in flight at once;
+  - "interactive" waiters (UI sessions) go before "batch" ones, but batch still gets one
+    grant in every KONTEXT_FAL_INTERACTIVE_WEIGHT + 1 while both classes are waiting;
+  - within a class, sessions take turns (round-robin), so one user's 9-step plan
+    cannot starve another user's single edit.
+A 429 / rate-limit error pauses all grants with exponential backoff and the request
+is retried (KONTEXT_FAL_429_RETRIES times). Uploads to FAL storage are not scheduled;
+a hedged duplicate (kontext/hedging.py) takes a slot of its own, and only
+if one is free right away (`try_acquire`).
+
+The session and class come from context variables (like kontext/tracing.py):
+`run_restyle_plan(..., session=..., priority=...)` sets them for a run, or wrap
+code in `with use_session("alice", "interactive"):`.
+Env:
+  KONTEXT_FAL_SCHEDULER=1   KONTEXT_FAL_RATE=10   KONTEXT_FAL_BURST=10   KONTEXT_FAL_MAX_INFLIGHT=16
+  KONTEXT_FAL_INTERACTIVE_WEIGHT=3   KONTEXT_FAL_429_RETRIES=3   KONTEXT_FAL_429_BACKOFF_S=2
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional, Tuple, TypeVar
+
+from kontext import tracing
+
+T = TypeVar("T")
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+DEFAULT_SESSION = "default"
+MAX_BACKOFF_S = 30.0
+
+_SESSION: ContextVar[Tuple[str, str]] = ContextVar("kontext_fal_session", default=(DEFAULT_SESSION, INTERACTIVE))
+_SCHEDULER: Dict[str, Optional["FalScheduler"]] = {"instance": None}
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.getenv("KONTEXT_FAL_SCHEDULER", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def activate(session: Optional[str] = None, priority: Optional[str] = None) -> Token:
+    """Tag following FAL requests (in this context); None keeps the enclosing value."""
+    current_session, current_priority = _SESSION.get()
+    priority = priority or current_priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {priority!r}; expected one of {PRIORITIES}")
+    return _SESSION.set((str(session or current_session), priority))
+
+
+def deactivate(token: Token) -> None:
+    _SESSION.reset(token)
+
+
+@contextmanager
+def use_session(session: Optional[str] = None, priority: Optional[str] = None) -> Iterator[None]:
+    token = activate(session, priority)
+    try:
+        yield
+    finally:
+        deactivate(token)
+
+
+def current_session() -> Tuple[str, str]:
+    return _SESSION.get()
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """True for HTTP 429 / rate-limit errors (status on the error or its response, else the message)."""
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429
+    text = str(exc).lower()
+    return "429" in text or "rate limit" in text or "too many requests" in text
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Waiter:
+    __slots__ = ("session", "priority", "enqueued", "notify", "granted", "waited")
+
+    def __init__(self, session: str, priority: str, notify: Callable[[], None]):
+        self.session = session
+        self.priority = priority
+        self.enqueued = time.perf_counter()
+        self.notify = notify
+        self.granted = False
+        self.waited = 0.0
+
+
+class FalScheduler:
+    """Token bucket + in-flight cap + priority classes + per-session round-robin; thread- and loop-safe."""
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: float = 10.0,
+        max_inflight: int = 16,
+        interactive_weight: int = 3,
+        retries_429: int = 3,
+        backoff_429: float = 2.0,
+    ):
+        self.rate = float(rate)            # tokens per second; <= 0 = unlimited
+        self.burst = max(1.0, float(burst))
+        self.max_inflight = max(1, int(max_inflight))
+        self.interactive_weight = max(1, int(interactive_weight))
+        self.retries_429 = max(0, int(retries_429))
+        self.backoff_429 = float(backoff_429)
+        self._lock = threading.Lock()
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._tokens = self.burst
+        self._refilled = time.perf_counter()
+        self._inflight = 0
+        self._streak = 0                   # interactive grants in a row while batch waited
+        self._paused_until = 0.0
+        self._consecutive_429 = 0
+        self._timer: Optional[threading.Timer] = None
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self._counters: Dict[str, int] = {
+            "granted": 0,
+            "throttled": 0,      # times grants were held back by the token bucket or a 429 pause
+            "rate_limited": 0,   # 429s seen
+            "retried": 0,
+            "abandoned": 0,      # waiters cancelled before their turn
+            "peak_queued": 0,
+            "peak_inflight": 0,
+        }
+        self._granted_by: Dict[str, int] = {p: 0 for p in PRIORITIES}
+
+    # -- queueing (call with self._lock held) -------------------------------------------
+
+    def _queued(self) -> int:
+        return sum(len(w) for queue in self._queues.values() for w in queue.values())
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        self._queues[waiter.priority].setdefault(waiter.session, deque()).append(waiter)
+        self._counters["peak_queued"] = max(self._counters["peak_queued"], self._queued())
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.priority]
+        waiters = queue.get(waiter.session)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del queue[waiter.session]
+            self._counters["abandoned"] += 1
+
+    def _next_waiter(self) -> _Waiter:
+        interactive, batch = self._queues[INTERACTIVE], self._queues[BATCH]
+        if interactive and (not batch or self._streak < self.interactive_weight):
+            queue = interactive
+            self._streak = self._streak + 1 if batch else 0
+        else:
+            queue = batch
+            self._streak = 0
+        session, waiters = next(iter(queue.items()))
+        waiter = waiters.popleft()
+        if waiters:
+            queue.move_to_end(session)  # round-robin: the session goes to the back of its class
+        else:
+            del queue[session]
+        return waiter
+
+    def _refill(self, now: float) -> None:
+        if self.rate <= 0:
+            self._tokens = self.burst
+        else:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _dispatch(self) -> None:
+        now = time.perf_counter()
+        self._refill(now)
+        while self._inflight < self.max_inflight and (self._queues[INTERACTIVE] or self._queues[BATCH]):
+            if now < self._paused_until:
+                self._arm(self._paused_until - now)
+                return
+            if self._tokens < 1.0:
+                self._arm((1.0 - self._tokens) / self.rate)
+                return
+            waiter = self._next_waiter()
+            self._tokens -= 1.0
+            self._inflight += 1
+            waiter.granted = True
+            waiter.waited = now - waiter.enqueued
+            self._waits.append(waiter.waited)
+            self._counters["granted"] += 1
+            self._granted_by[waiter.priority] += 1
+            self._counters["peak_inflight"] = max(self._counters["peak_inflight"], self._inflight)
+            waiter.notify()
+
+    def _arm(self, delay: float) -> None:
+        """Re-dispatch once the next token (or the end of a 429 pause) is due."""
+        if self._timer is not None:
+            return
+        self._counters["throttled"] += 1
+        self._timer = threading.Timer(max(0.001, delay), self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    # -- slots ----------------------------------------------------------------------------
+
+    def acquire(self) -> float:
+        """Block until this context's session gets a slot; returns the seconds waited."""
+        session, priority = _SESSION.get()
+        granted = threading.Event()
+        waiter = _Waiter(session, priority, granted.set)
+        with self._lock:
+            self._enqueue(waiter)
+            self._dispatch()
+        granted.wait()
+        tracing.record_span("sched_wait", waiter.enqueued, waiter.waited, priority=priority)
+        return waiter.waited
+
+    async def acquire_async(self) -> float:
+        """`acquire` for an event loop; cancelling the wait gives up the place in line."""
+        session, priority = _SESSION.get()
+        loop = asyncio.get_running_loop()
+        granted: "asyncio.Future[None]" = loop.create_future()
+
+        def _resolve() -> None:
+            if not granted.done():
+                granted.set_result(None)
+
+        waiter = _Waiter(session, priority, lambda: loop.call_soon_threadsafe(_resolve))
+        with self._lock:
+            self._enqueue(waiter)
+            self._dispatch()
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._release_locked()
+                else:
+                    self._remove(waiter)
+            raise
+        tracing.record_span("sched_wait", waiter.enqueued, waiter.waited, priority=priority)
+        return waiter.waited
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free now and nobody is waiting; never queues. `release` it after."""
+        with self._lock:
+            now = time.perf_counter()
+            self._refill(now)
+            if (self._queued() or now < self._paused_until or self._inflight >= self.max_inflight
+                    or self._tokens < 1.0):
+                return False
+            self._tokens -= 1.0
+            self._inflight += 1
+            self._counters["granted"] += 1
+            self._counters["peak_inflight"] = max(self._counters["peak_inflight"], self._inflight)
+            return True
+
+    def _release_locked(self) -> None:
+        self._inflight = max(0, self._inflight - 1)
+        self._dispatch()
+
+    def release(self) -> None:
+        with self._lock:
+            self._release_locked()
+
+    def _rate_limited(self, exc: BaseException) -> None:
+        """Pause every grant: Retry-After if the provider sent one, else exponential backoff."""
+        with self._lock:
+            self._consecutive_429 += 1
+            self._counters["rate_limited"] += 1
+            delay = _retry_after(exc)
+            if delay is None:
+                delay = min(MAX_BACKOFF_S, self.backoff_429 * (2 ** (self._consecutive_429 - 1)))
+            now = time.perf_counter()
+            self._paused_until = max(self._paused_until, now + delay)
+            self._tokens, self._refilled = 0.0, now
+        print(f"[scheduler] FAL rate limit hit; pausing requests for {delay:.1f}s")
+
+    def _succeeded(self) -> None:
+        with self._lock:
+            self._consecutive_429 = 0
+
+    # -- calls ----------------------------------------------------------------------------
+
+    def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run `fn` in a slot, retrying (in a fresh slot) when it fails with a rate-limit error."""
+        for attempt in range(self.retries_429 + 1):
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as exc:
+                if attempt < self.retries_429 and is_rate_limited(exc):
+                    self._rate_limited(exc)
+                    with self._lock:
+                        self._counters["retried"] += 1
+                    continue
+                raise
+            finally:
+                self.release()
+            self._succeeded()
+            return result
+        raise AssertionError("unreachable")
+
+    async def call_async(self, fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """`call` for a coroutine function."""
+        for attempt in range(self.retries_429 + 1):
+            await self.acquire_async()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as exc:
+                if attempt < self.retries_429 and is_rate_limited(exc):
+                    self._rate_limited(exc)
+                    with self._lock:
+                        self._counters["retried"] += 1
+                    continue
+                raise
+            finally:
+                self.release()
+            self._succeeded()
+            return result
+        raise AssertionError("unreachable")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            queued = {p: sum(len(w) for w in q.values()) for p, q in self._queues.items()}
+            sessions = sum(len(q) for q in self._queues.values())
+            counters = dict(self._counters)
+            granted_by = dict(self._granted_by)
+            inflight = self._inflight
+            tokens = self._tokens
+
+        def _pct(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else 0.0
+
+        return {
+            **counters,
+            "queued": queued,
+            "sessions_waiting": sessions,
+            "inflight": inflight,
+            "tokens": round(tokens, 2),
+            "granted_by_priority": granted_by,
+            "wait_p50_s": _pct(0.5),
+            "wait_p90_s": _pct(0.9),
+            "wait_max_s": round(waits[-1], 4) if waits else 0.0,
+        }
+
+
+def configure(**kwargs: Any) -> FalScheduler:
+    """Replace the shared scheduler (e.g. to change the rate or in-flight cap)."""
+    with _SCHEDULER_LOCK:
+        _SCHEDULER["instance"] = FalScheduler(**kwargs)
+        return _SCHEDULER["instance"]
+
+
+def get_scheduler() -> FalScheduler:
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER["instance"] is None:
+            _SCHEDULER["instance"] = FalScheduler(
+                rate=float(os.getenv("KONTEXT_FAL_RATE", "10")),
+                burst=float(os.getenv("KONTEXT_FAL_BURST", "10")),
+                max_inflight=int(os.getenv("KONTEXT_FAL_MAX_INFLIGHT", "16")),
+                interactive_weight=int(os.getenv("KONTEXT_FAL_INTERACTIVE_WEIGHT", "3")),
+                retries_429=int(os.getenv("KONTEXT_FAL_429_RETRIES", "3")),
+                backoff_429=float(os.getenv("KONTEXT_FAL_429_BACKOFF_S", "2")),
+            )
+        return _SCHEDULER["instance"]
+
+
+def call(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a FAL request through the shared scheduler (directly when KONTEXT_FAL_SCHEDULER=0)."""
+    if not enabled():
+        return fn(*args, **kwargs)
+    return get_scheduler().call(fn, *args, **kwargs)
+
+
+async def call_async(fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+    if not enabled():
+        return await fn(*args, **kwargs)
+    return await get_scheduler().call_async(fn, *args, **kwargs)
+
+
+def try_acquire() -> bool:
+    """A slot outside `call` (e.g. a hedged duplicate), only if one is free now; pair with `release`."""
+    if not enabled():
+        return True
+    return get_scheduler().try_acquire()
+
+
+def release() -> None:
+    if enabled():
+        get_scheduler().release()
+
+
+def scheduler_stats() -> Dict[str, Any]:
+    return get_scheduler().stats()
+
+
+def format_scheduler_stats(stats: Dict[str, Any]) -> str:
+    queued = stats["queued"]
+    return (
+        f"[scheduler] granted={stats['granted']} queued={queued[INTERACTIVE]}+{queued[BATCH]} "
+        f"inflight={stats['inflight']} peak_inflight={stats['peak_inflight']} "
+        f"wait p50={stats['wait_p50_s']:.2f}s p90={stats['wait_p90_s']:.2f}s max={stats['wait_max_s']:.2f}s "
+        f"throttled={stats['throttled']} rate_limited={stats['rate_limited']}"
+    )
@@ -0,0 +1,174 @@
+"""
+Structured timing spans for a restyle run.
+A `Trace` is activated for the duration of `run_restyle_plan`; code anywhere in
+the pipeline records spans with `span(...)` / `record_span(...)`, which are
+no-ops when no trace is active. The active trace and step live in context
+variables, so work handed to pool threads (prefetch, background writes) keeps
+its step attribution when submitted through `contextvars.copy_context().run`.
+
+Phases: plan_build, encode, upload, queue_wait, inference, download, decode,
+save (plus step, drift, cache_put). Each run writes `trace.json` next to its
+artifacts; finished traces are also passed to exporters registered with
+`add_exporter(fn)` or named in the env:
+  KONTEXT_TRACE_EXPORTER=package.module:function   # called with the trace dict
+"""
+import importlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PHASES = ("plan_build", "encode", "upload", "queue_wait", "inference", "download", "decode", "save")
+
+_TRACE: "ContextVar[Optional[Trace]]" = ContextVar("kontext_trace", default=None)
+_STEP: ContextVar[Optional[Tuple[int, str]]] = ContextVar("kontext_trace_step", default=None)
+_EXPORTERS: List[Callable[[Dict[str, Any]], None]] = []
+
+
+class Trace:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float, **attrs: Any) -> None:
+        """Record a span; `start` is a `time.perf_counter()` value."""
+        step = _STEP.get()
+        entry: Dict[str, Any] = {
+            "name": name,
+            "start_s": round(start - self.started, 6),
+            "duration_s": round(max(0.0, duration), 6),
+            "thread": threading.current_thread().name,
+        }
+        if step is not None:
+            entry["step"], entry["step_name"] = step
+        if attrs:
+            entry["attrs"] = attrs
+        with self._lock:
+            self.spans.append(entry)
+
+    def summary(self) -> Dict[str, Any]:
+        """Total seconds per phase, overall and per step."""
+        with self._lock:
+            spans = list(self.spans)
+        phases: Dict[str, float] = {}
+        steps: Dict[int, Dict[str, Any]] = {}
+        for s in spans:
+            phases[s["name"]] = phases.get(s["name"], 0.0) + s["duration_s"]
+            if "step" in s:
+                st = steps.setdefault(s["step"], {"step": s["step"], "name": s["step_name"], "phases": {}})
+                st["phases"][s["name"]] = st["phases"].get(s["name"], 0.0) + s["duration_s"]
+        return {
+            "wall_s": round(time.perf_counter() - self.started, 4),
+            "phases": {k: round(v, 4) for k, v in phases.items()},
+            "steps": [
+                {**st, "phases": {k: round(v, 4) for k, v in st["phases"].items()}}
+                for _, st in sorted(steps.items())
+            ],
+        }
+
+    def to_dict(self, **meta: Any) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_s"])
+        return {**meta, "started_at": self.started_at, "summary": self.summary(), "spans": spans}
+
+    def finish(self, path: Optional[Path] = None, **meta: Any) -> Dict[str, Any]:
+        """Write the trace JSON (if `path`) and hand it to exporters. Returns the trace dict."""
+        data = self.to_dict(**meta)
+        if path is not None:
+            path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        export(data)
+        return data
+
+
+def activate(trace: Trace) -> Token:
+    return _TRACE.set(trace)
+
+
+def deactivate(token: Token) -> None:
+    _TRACE.reset(token)
+    _STEP.set(None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _TRACE.get()
+
+
+def set_step(index: Optional[int], name: str = "") -> None:
+    """Attribute following spans (in this context) to a plan step; None clears it."""
+    _STEP.set(None if index is None else (index, name))
+
+
+@contextmanager
+def step(index: int, name: str) -> Iterator[None]:
+    token = _STEP.set((index, name))
+    try:
+        yield
+    finally:
+        _STEP.reset(token)
+
+
+def record_span(name: str, start: float, duration: float, **attrs: Any) -> None:
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.add(name, start, duration, **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[None]:
+    trace = _TRACE.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start, **attrs)
+
+
+def add_exporter(fn: Callable[[Dict[str, Any]], None]) -> None:
+    if fn not in _EXPORTERS:
+        _EXPORTERS.append(fn)
+
+
+def remove_exporter(fn: Callable[[Dict[str, Any]], None]) -> None:
+    if fn in _EXPORTERS:
+        _EXPORTERS.remove(fn)
+
+
+def _env_exporter() -> Optional[Callable[[Dict[str, Any]], None]]:
+    target = os.getenv("KONTEXT_TRACE_EXPORTER", "").strip()
+    if not target:
+        return None
+    module, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module), attr or "export")
+
+
+def export(data: Dict[str, Any]) -> None:
+    """Send a finished trace to every exporter; exporter errors are printed, never raised."""
+    exporters = list(_EXPORTERS)
+    try:
+        env = _env_exporter()
+    except Exception as exc:
+        print(f"[trace] Failed to load KONTEXT_TRACE_EXPORTER: {exc}")
+        env = None
+    if env is not None:
+        exporters.append(env)
+    for fn in exporters:
+        try:
+            fn(data)
+        except Exception as exc:
+            print(f"[trace] Exporter {getattr(fn, '__name__', fn)} failed: {exc}")
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    phases = summary.get("phases", {})
+    parts = [f"{p} {phases[p]:.2f}s" for p in PHASES if p in phases]
+    parts += [f"{p} {v:.2f}s" for p, v in phases.items() if p not in PHASES and p != "step"]
+    return "[trace] " + " · ".join(parts) + f" (wall {summary.get('wall_s', 0.0):.2f}s)"
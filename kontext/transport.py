@@ -0,0 +1,199 @@
+"""
+Shared HTTP transport for the FAL backend.
+One keep-alive `requests.Session` with a sized connection pool, per-phase timeouts
+(connect / read / whole transfer), jittered exponential retry on transient errors,
+and response bodies streamed straight into the PIL decoder.
+Env (all optional):
+  KONTEXT_HTTP_POOL_SIZE=16  KONTEXT_HTTP_CONNECT_TIMEOUT=10  KONTEXT_HTTP_READ_TIMEOUT=60
+  KONTEXT_HTTP_TOTAL_TIMEOUT=180  KONTEXT_HTTP_RETRIES=3
+"""
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+import requests
+from PIL import Image, ImageFile
+from requests.adapters import HTTPAdapter
+
+from kontext import tracing
+
+T = TypeVar("T")
+
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+CHUNK_SIZE = 256 * 1024
+
+_TRANSPORT: Dict[str, Optional["Transport"]] = {"instance": None}
+_TRANSPORT_LOCK = threading.Lock()
+
+
+class TransientHTTPError(RuntimeError):
+    """Retryable HTTP status (429 / 5xx)."""
+
+
+def _counting_pool(pool_cls: type, count: Callable[[str], None]) -> type:
+    """`pool_cls` that reports every connection it opens."""
+
+    def _new_conn(self: Any) -> Any:
+        count("new_connections")
+        return pool_cls._new_conn(self)
+
+    return type(pool_cls.__name__, (pool_cls,), {"_new_conn": _new_conn})
+
+
+class _CountingAdapter(HTTPAdapter):
+    """
+    Counts requests sent and connections opened as they happen, so the totals only grow;
+    urllib3's per-pool counters vanish when the PoolManager evicts a pool.
+    """
+
+    def __init__(self, count: Callable[[str], None], **kwargs: Any):
+        self._count = count  # set first: HTTPAdapter.__init__ builds the pool manager
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        manager = self.poolmanager
+        manager.pool_classes_by_scheme = {
+            scheme: _counting_pool(cls, self._count) for scheme, cls in manager.pool_classes_by_scheme.items()
+        }
+
+    def send(self, request: Any, *args: Any, **kwargs: Any) -> Any:
+        self._count("requests")
+        return super().send(request, *args, **kwargs)
+
+
+class Transport:
+    """Thread-safe pooled HTTP client; share one instance per process via `get_transport()`."""
+
+    def __init__(
+        self,
+        pool_size: int = 16,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 60.0,
+        total_timeout: float = 180.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+    ):
+        self.pool_size = int(pool_size)
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+        self.total_timeout = float(total_timeout)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self._lock = threading.Lock()
+        self._retries_done = 0
+        self._failures = 0
+        self._counts = {"requests": 0, "new_connections": 0}
+
+        self.session = requests.Session()
+        self._adapter = _CountingAdapter(self._count, pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                                         max_retries=0)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+    def _sleep_before_retry(self, attempt: int) -> None:
+        # Full jitter: spreads retries from concurrent steps instead of stampeding.
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt))))
+
+    def call_with_retry(self, fn: Callable[..., T], *args: Any, retry_on: tuple = (), **kwargs: Any) -> T:
+        """Run `fn`, retrying transient network errors (plus `retry_on`) with jittered backoff."""
+        transient = TRANSIENT_ERRORS + (TransientHTTPError,) + tuple(retry_on)
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except transient as exc:
+                if attempt >= self.retries:
+                    with self._lock:
+                        self._failures += 1
+                    raise RuntimeError(f"HTTP request failed after {attempt + 1} attempt(s): {exc}") from exc
+                with self._lock:
+                    self._retries_done += 1
+                self._sleep_before_retry(attempt)
+                attempt += 1
+
+    def _get_image_once(self, url: str) -> Tuple[Image.Image, int]:
+        started = time.perf_counter()
+        decode_s = 0.0
+        deadline = time.monotonic() + self.total_timeout
+        with self.session.get(url, stream=True, timeout=(self.connect_timeout, self.read_timeout)) as resp:
+            if resp.status_code in RETRY_STATUS:
+                raise TransientHTTPError(f"HTTP {resp.status_code} for {url}")
+            resp.raise_for_status()
+            parser = ImageFile.Parser()
+            received = 0
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if time.monotonic() > deadline:
+                    raise requests.Timeout(f"Download exceeded {self.total_timeout:.0f}s: {url}")
+                received += len(chunk)
+                t0 = time.perf_counter()
+                parser.feed(chunk)
+                decode_s += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            img = parser.close()
+            decode_s += time.perf_counter() - t0
+        # Chunks are decoded as they arrive; split the wall time into network wait and decode work.
+        tracing.record_span("download", started, time.perf_counter() - started - decode_s, bytes=received)
+        tracing.record_span("decode", started, decode_s)
+        return img, received
+
+    def fetch_image(self, url: str) -> Tuple[Image.Image, int]:
+        """Download and decode an image, decoding chunks as they arrive. Returns (image, bytes received)."""
+        return self.call_with_retry(self._get_image_once, url)
+
+    def get_image(self, url: str) -> Image.Image:
+        return self.fetch_image(url)[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Counters since the transport was created: HTTP requests sent, connections opened, reuses, retries."""
+        with self._lock:
+            return {
+                "requests": self._counts["requests"],
+                "new_connections": self._counts["new_connections"],
+                "reuses": max(0, self._counts["requests"] - self._counts["new_connections"]),
+                "retries": self._retries_done,
+                "failures": self._failures,
+            }
+
+
+def configure(**kwargs: Any) -> Transport:
+    """Replace the shared transport (e.g. to change pool size or timeouts)."""
+    with _TRANSPORT_LOCK:
+        old = _TRANSPORT["instance"]
+        _TRANSPORT["instance"] = Transport(**kwargs)
+        if old is not None:
+            old.session.close()
+        return _TRANSPORT["instance"]
+
+
+def get_transport() -> Transport:
+    with _TRANSPORT_LOCK:
+        if _TRANSPORT["instance"] is None:
+            _TRANSPORT["instance"] = Transport(
+                pool_size=int(os.getenv("KONTEXT_HTTP_POOL_SIZE", "16")),
+                connect_timeout=float(os.getenv("KONTEXT_HTTP_CONNECT_TIMEOUT", "10")),
+                read_timeout=float(os.getenv("KONTEXT_HTTP_READ_TIMEOUT", "60")),
+                total_timeout=float(os.getenv("KONTEXT_HTTP_TOTAL_TIMEOUT", "180")),
+                retries=int(os.getenv("KONTEXT_HTTP_RETRIES", "3")),
+            )
+        return _TRANSPORT["instance"]
+
+
+def format_stats(stats: Dict[str, int]) -> str:
+    return (
+        f"[http] requests={stats['requests']} new_connections={stats['new_connections']} "
+        f"reuses={stats['reuses']} retries={stats['retries']} failures={stats['failures']}"
+    )
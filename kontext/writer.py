@@ -0,0 +1,145 @@
+"""
+Background artifact writer: a bounded queue drained by worker threads, so PNG
+encoding and prompt files are written while the next backend call is in flight.
+`flush()` blocks until everything queued so far is on disk and returns the errors
+collected since the last flush; errors are also printed as they happen.
+Runs sharing one writer each write through their own `group()`, whose `flush()`
+waits only for that run's writes and returns only its errors.
+"""
+import contextvars
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+
+from PIL import Image
+
+from kontext import tracing
+
+_STOP = object()
+
+
+def _traced_save(img: Image.Image, path: Path) -> None:
+    with tracing.span("save", file=path.name):
+        img.save(path)
+
+
+class WriteGroup:
+    """Writes queued on an `ArtifactWriter` by one caller; flushed and error-checked apart from the rest."""
+
+    def __init__(self, writer: "ArtifactWriter"):
+        self._writer = writer
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._errors: List[str] = []
+
+    def submit(self, label: str, fn: Callable[..., Any], *args: Any) -> None:
+        """Queue `fn(*args)`; blocks only when the writer's `max_pending` writes are already waiting."""
+        with self._cond:
+            self._pending += 1
+        try:
+            self._writer._put(self, label, fn, args)
+        except BaseException:
+            self._done(None)
+            raise
+
+    def _done(self, error: Optional[str]) -> None:
+        with self._cond:
+            self._pending -= 1
+            if error is not None:
+                self._errors.append(error)
+            self._cond.notify_all()
+
+    def save_image(self, img: Image.Image, folder: Path, filename: str) -> Path:
+        """Queue a PNG save; returns the destination path immediately. `img` must not be mutated afterwards."""
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / filename
+        self.submit(str(path), _traced_save, img, path)
+        return path
+
+    def write_text(self, path: Path, text: str) -> Path:
+        self.submit(str(path), path.write_text, text, "utf-8")
+        return path
+
+    def flush(self) -> List[str]:
+        """Wait for this group's queued writes; return (and clear) its errors collected so far."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending == 0)
+            errors, self._errors = self._errors, []
+        return errors
+
+
+class ArtifactWriter:
+    def __init__(self, workers: int = 2, max_pending: int = 8, name: str = "artifact-writer"):
+        # Bounded so a slow disk applies backpressure instead of buffering every frame in RAM.
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, max_pending))
+        self._default = WriteGroup(self)
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._drain, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _drain(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                group, label, fn, args, ctx = item
+                error = None
+                try:
+                    ctx.run(fn, *args)
+                except Exception as exc:
+                    error = f"[io] Failed to write {label}: {exc}"
+                    print(error)
+                finally:
+                    group._done(error)
+            finally:
+                self._queue.task_done()
+
+    def _put(self, group: WriteGroup, label: str, fn: Callable[..., Any], args: Tuple[Any, ...]) -> None:
+        if self._closed:
+            raise RuntimeError("ArtifactWriter is closed")
+        # The caller's context travels with the job, so trace spans keep their step.
+        item: Tuple[WriteGroup, str, Callable[..., Any], Tuple[Any, ...], contextvars.Context] = (
+            group, label, fn, args, contextvars.copy_context()
+        )
+        self._queue.put(item)
+
+    def group(self) -> WriteGroup:
+        """A new group of writes on this writer (one per run when runs share it)."""
+        return WriteGroup(self)
+
+    def submit(self, label: str, fn: Callable[..., Any], *args: Any) -> None:
+        """Queue `fn(*args)`; blocks only when `max_pending` writes are already waiting."""
+        self._default.submit(label, fn, *args)
+
+    def save_image(self, img: Image.Image, folder: Path, filename: str) -> Path:
+        return self._default.save_image(img, folder, filename)
+
+    def write_text(self, path: Path, text: str) -> Path:
+        return self._default.write_text(path, text)
+
+    def flush(self) -> List[str]:
+        """Wait for all queued writes; return (and clear) the errors of writes not made through a `group()`."""
+        self._queue.join()
+        return self._default.flush()
+
+    def close(self) -> List[str]:
+        errors = self.flush()
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._queue.put(_STOP)
+            for t in self._threads:
+                t.join()
+        return errors
+
+    def __enter__(self) -> "ArtifactWriter":
+        return self
+
+    def __exit__(self, *exc: Optional[BaseException]) -> None:
+        self.close()
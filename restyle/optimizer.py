@@ -0,0 +1,105 @@
+from typing import Dict, List
+
+PLAN_PROFILES: List[str] = ["faithful", "balanced", "fast"]
+DEFAULT_PROFILE = "faithful"
+
+# Steps that may share one Kontext call, per profile. A group's steps are fused only
+# where they follow each other in the plan and their region/backend settings agree.
+FUSION_GROUPS: Dict[str, List[List[str]]] = {
+    "faithful": [],
+    "balanced": [
+        ["primary_actions", "secondary_and_links", "charts_and_dataviz"],
+        ["corner_radii", "shadows_and_elevation", "hairlines_and_outlines"],
+    ],
+    "fast": [
+        [
+            "convert_light_mode",
+            "convert_dark_mode",
+            "global_brand_refresh",
+            "primary_actions",
+            "secondary_and_links",
+            "surfaces_and_background",
+            "charts_and_dataviz",
+        ],
+        ["corner_radii", "shadows_and_elevation", "hairlines_and_outlines"],
+    ],
+}
+
+
+def _compatible(a: Dict, b: Dict) -> bool:
+    return (
+        a.get("region_hint", "global") == b.get("region_hint", "global")
+        and a.get("backend") == b.get("backend")
+        and a.get("negative_prompt") == b.get("negative_prompt")
+    )
+
+
+def fuse_steps(steps: List[Dict]) -> Dict:
+    """
+    Merge steps into one. The first paragraph of each prompt is its instruction;
+    the remaining paragraphs (palette, radii, shadows, logo reference) are shared
+    references and are kept once, in first-seen order.
+    """
+    if len(steps) == 1:
+        return dict(steps[0])
+    instructions: List[str] = []
+    references: List[str] = []
+    for step in steps:
+        paragraphs = [p.strip() for p in step["prompt"].split("\n\n") if p.strip()]
+        if not paragraphs:
+            continue
+        instructions.append(paragraphs[0])
+        for ref in paragraphs[1:]:
+            if ref not in references:
+                references.append(ref)
+    numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(instructions, start=1))
+    prompt = "Apply ALL of the following edits together in a single pass, preserving layout and content:\n" + numbered
+    if references:
+        prompt += "\n\n" + "\n\n".join(references)
+
+    fused = {k: v for k, v in steps[0].items() if k not in ("key", "name", "prompt", "strength")}
+    fused.update({
+        "key": "+".join(s.get("key", s.get("name", "")) for s in steps),
+        "name": " + ".join(s.get("name", "") for s in steps),
+        "prompt": prompt,
+        "strength": max(float(s.get("strength", 0.3)) for s in steps),
+        "fused_from": [s.get("key") for s in steps],
+        "goal_colors": list(dict.fromkeys(c for s in steps for c in s.get("goal_colors", []))),
+        "depends_on": sorted({f for s in steps for f in s.get("depends_on", [])}),
+    })
+    return fused
+
+
+def optimize_plan(plan: List[Dict], profile: str = DEFAULT_PROFILE) -> List[Dict]:
+    """
+    Compile a plan into fewer Kontext calls for the given profile.
+    Only consecutive steps of the same group are fused, so every edit keeps its place in the plan.
+    """
+    if profile not in FUSION_GROUPS:
+        raise ValueError(f"Unknown plan profile {profile!r}; expected one of {PLAN_PROFILES}")
+    group_of: Dict[str, int] = {}
+    for gi, group in enumerate(FUSION_GROUPS[profile]):
+        for key in group:
+            group_of[key] = gi
+
+    ordered: List[List[Dict]] = []
+    last_group = None
+    for step in plan:
+        gi = group_of.get(step.get("key", ""))
+        if gi is not None and gi == last_group and _compatible(ordered[-1][0], step):
+            ordered[-1].append(step)
+        else:
+            ordered.append([step])
+        last_group = gi
+    return [fuse_steps(members) for members in ordered]
+
+
+def profile_call_counts(plan: List[Dict]) -> Dict[str, int]:
+    """Expected backend calls for each profile."""
+    return {profile: len(optimize_plan(plan, profile)) for profile in PLAN_PROFILES}
+
+
+def describe_call_counts(plan: List[Dict], selected: str = DEFAULT_PROFILE) -> str:
+    counts = profile_call_counts(plan)
+    parts = [f"{p}: {counts[p]}" for p in PLAN_PROFILES]
+    return "[plan] calls per profile — " + ", ".join(parts) + f" (running {selected})"
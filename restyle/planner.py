@@ -61,6 +61,23 @@ NEGATIVE_CONSTRAINTS = (
 )
 
 
+# Pure color steps that can run as a local pixel recolor instead of a model call.
+RECOLOR_BACKEND = "recolor (pixels)"  # kontext.recolor_backend.BACKEND_NAME
+RECOLOR_STEP_KEYS: List[str] = ["surfaces_and_background", "hairlines_and_outlines"]
+
+# Token colors each step should make visible; best-of-N candidates are scored on them.
+# Steps not listed (radii, shadows, hairlines) are scored on layout alone.
+GOAL_COLOR_ROLES: Dict[str, List[str]] = {
+    "convert_light_mode": ["background", "surface"],
+    "convert_dark_mode": ["background", "surface"],
+    "global_brand_refresh": ["primary", "secondary", "background", "surface"],
+    "primary_actions": ["primary"],
+    "secondary_and_links": ["secondary", "link"],
+    "surfaces_and_background": ["background", "surface"],
+    "charts_and_dataviz": ["primary", "secondary", "success", "warning", "error"],
+}
+
+
 def load_tokens_from_json(text: str) -> Dict:
     import json
 
@@ -116,6 +133,34 @@ def steps_from_labels(labels: List[str]) -> List[str]:
     return [STEP_LABEL_TO_KEY.get(label, label) for label in labels]
 
 
+# Token groups / fields each step's prompt reads; a group ("colors") stands for all of its fields.
+# Goal colors, recolor specs and the logo reference add their own fields in `build_edit_plan`.
+STEP_TOKEN_FIELDS: Dict[str, List[str]] = {
+    "convert_light_mode": ["colors"],
+    "convert_dark_mode": ["colors"],
+    "global_brand_refresh": ["brand", "colors", "radius", "shadow"],
+    "primary_actions": ["brand", "colors"],
+    "secondary_and_links": ["colors"],
+    "surfaces_and_background": ["colors"],
+    "corner_radii": ["radius"],
+    "shadows_and_elevation": ["shadow"],
+    "hairlines_and_outlines": [],
+    "charts_and_dataviz": ["colors"],
+}
+
+
+def token_fields(tokens: Dict, names: List[str]) -> List[str]:
+    """Expand groups to dotted field paths ("colors" → "colors.primary", ...), sorted."""
+    fields = set()
+    for name in names:
+        group = tokens.get(name)
+        if isinstance(group, dict):
+            fields.update(f"{name}.{key}" for key in group)
+        else:
+            fields.add(name)
+    return sorted(fields)
+
+
 def labels_from_keys(keys: List[str]) -> List[str]:
     return [STEP_KEY_TO_LABEL.get(key, key) for key in keys]
 
@@ -155,38 +200,10 @@ def _prompt_shadow(tokens: Dict) -> str:
     )
 
 
-def _rgb_to_hex(rgb: tuple) -> str:
-    r, g, b = rgb[:3]
-    return f"#{r:02X}{g:02X}{b:02X}"
-
-
-def _logo_colors_description(logo: Image.Image, top_n: int = 5) -> str:
-    try:
-        preview = logo.convert("RGBA").resize((64, 64))
-    except Exception:
-        return ""
-    max_colors = preview.size[0] * preview.size[1]
-    colors = preview.getcolors(max_colors)
-    if not colors:
-        return ""
-    dominant: List[str] = []
-    for count, color in sorted(colors, key=lambda item: item[0], reverse=True):
-        if len(color) == 4 and color[3] < 25:
-            continue
-        hex_code = _rgb_to_hex(color)
-        if hex_code not in dominant:
-            dominant.append(hex_code)
-        if len(dominant) >= top_n:
-            break
-    if not dominant:
-        return ""
-    return ", ".join(dominant)
-
-
-def _logo_prompt(brand_logo: Optional[Image.Image], brand: str) -> str:
+def _logo_prompt(brand_logo: Optional[Image.Image], brand: str, logo_colors: Optional[List[str]]) -> str:
     if brand_logo is None:
         return ""
-    colors = _logo_colors_description(brand_logo)
+    colors = ", ".join(logo_colors or [])
     if colors:
         return (
             f"Logo reference: Preserve the {brand} logo exactly as in the uploaded asset. "
@@ -198,16 +215,36 @@ def _logo_prompt(brand_logo: Optional[Image.Image], brand: str) -> str:
     )
 
 
-def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.Image] = None) -> List[Dict]:
+def build_edit_plan(
+    tokens: Dict,
+    steps: List[str],
+    brand_logo: Optional[Image.Image] = None,
+    region_hints: Optional[Dict[str, str]] = None,
+    recolor_steps: Optional[List[str]] = None,
+    logo_colors: Optional[List[str]] = None,
+) -> List[Dict]:
     """
     Builds an ordered list of edit steps for Kontext.
-    Each step has: name, prompt, negative_prompt, region_hint, strength.
+    Each step has: key, name, prompt, negative_prompt, region_hint, strength, goal_colors,
+    and `depends_on`: the token fields (dotted paths) its prompt, goal colors and recolor
+    spec read, so a re-run can tell which steps a token edit affects.
+    `region_hints` maps step keys to a region (see kontext/regions.py); default "global".
+    Keys in `recolor_steps` (see RECOLOR_STEP_KEYS) also get `backend` and a `recolor`
+    spec, so they run as a local pixel recolor with no model call.
+    `logo_colors` ("#RRGGBB", dominant first) names the logo's colors in the logo prompt;
+    async callers pass `kontext.brand_assets.plan_logo_colors(brand_logo)` computed off the
+    event loop. When omitted with a `brand_logo`, they are derived here.
     """
+    if logo_colors is None and brand_logo is not None:
+        from kontext.brand_assets import plan_logo_colors
+
+        logo_colors = plan_logo_colors(brand_logo)
+    regions = region_hints or {}
     brand = tokens.get("brand", "Brand")
     colors = _prompt_colors(tokens)
     radii = _prompt_radius(tokens)
     shadows = _prompt_shadow(tokens)
-    logo_prompt = _logo_prompt(brand_logo, brand)
+    logo_prompt = _logo_prompt(brand_logo, brand, logo_colors)
 
     def add_logo(text: str) -> str:
         return text + ("\n\n" + logo_prompt if logo_prompt else "")
@@ -221,8 +258,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
 
     if "convert_light_mode" in requested:
         plan.append({
+            "key": "convert_light_mode",
             "name": "Convert to light mode",
-            "region_hint": "global",
+            "region_hint": regions.get("convert_light_mode", "global"),
             "strength": 0.34,
             "prompt": add_logo(
                 f"Convert the interface to a LIGHT MODE foundation while preserving layout. "
@@ -234,8 +272,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
 
     if "convert_dark_mode" in requested:
         plan.append({
+            "key": "convert_dark_mode",
             "name": "Convert to dark mode",
-            "region_hint": "global",
+            "region_hint": regions.get("convert_dark_mode", "global"),
             "strength": 0.34,
             "prompt": add_logo(
                 f"Convert the interface to a DARK MODE foundation while preserving layout. "
@@ -247,8 +286,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
 
     if "global_brand_refresh" in requested:
         plan.append({
+            "key": "global_brand_refresh",
             "name": "Global brand refresh",
-            "region_hint": "global",
+            "region_hint": regions.get("global_brand_refresh", "global"),
             "strength": 0.36,
             "prompt": add_logo(
                 f"Perform a comprehensive {brand} brand refresh on the entire UI screenshot while preserving layout and textual content. "
@@ -275,8 +315,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
             continue
         if key == "primary_actions":
             plan.append({
+                "key": "primary_actions",
                 "name": "Primary actions",
-                "region_hint": "global",
+                "region_hint": regions.get("primary_actions", "global"),
                 "strength": 0.33,
                 "prompt": add_logo(
                     f"Apply the {brand} design system to PRIMARY actions and interactive elements. "
@@ -287,8 +328,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
             })
         elif key == "secondary_and_links":
             plan.append({
+                "key": "secondary_and_links",
                 "name": "Secondary & Links",
-                "region_hint": "global",
+                "region_hint": regions.get("secondary_and_links", "global"),
                 "strength": 0.31,
                 "prompt": add_logo(
                     f"Style SECONDARY actions and LINKS. Use the exact hex values {tokens['colors']['secondary']} and {tokens['colors']['link']} for secondary accents and links while keeping iconography and text unchanged. "
@@ -298,8 +340,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
             })
         elif key == "surfaces_and_background":
             plan.append({
+                "key": "surfaces_and_background",
                 "name": "Surfaces & Background",
-                "region_hint": "global",
+                "region_hint": regions.get("surfaces_and_background", "global"),
                 "strength": 0.31,
                 "prompt": add_logo(
                     f"Normalize BACKGROUNDS and SURFACES to the brand tokens. Set the page background and app surfaces to the exact hex values {tokens['colors']['background']} and {tokens['colors']['surface']} with no color drift. "
@@ -309,8 +352,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
             })
         elif key == "corner_radii":
             plan.append({
+                "key": "corner_radii",
                 "name": "Corner radii",
-                "region_hint": "global",
+                "region_hint": regions.get("corner_radii", "global"),
                 "strength": 0.29,
                 "prompt": add_logo(
                     f"Adjust corner radii of UI rectangles to match the brand tokens without moving elements. Buttons → {tokens['radius']['button']}px; "
@@ -321,8 +365,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
             })
         elif key == "shadows_and_elevation":
             plan.append({
+                "key": "shadows_and_elevation",
                 "name": "Shadows & Elevation",
-                "region_hint": "global",
+                "region_hint": regions.get("shadows_and_elevation", "global"),
                 "strength": 0.27,
                 "prompt": add_logo(
                     f"Apply subtle brand-consistent shadows to cards, modals, and popovers. Use elevation1 for small components and elevation2 for raised surfaces. "
@@ -332,8 +377,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
             })
         elif key == "hairlines_and_outlines":
             plan.append({
+                "key": "hairlines_and_outlines",
                 "name": "Hairlines & Outlines",
-                "region_hint": "global",
+                "region_hint": regions.get("hairlines_and_outlines", "global"),
                 "strength": 0.25,
                 "prompt": add_logo(
                     "Unify hairlines, dividers, and input outlines to neutral tints that match the brand surfaces while keeping contrast. "
@@ -343,8 +389,9 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
             })
         elif key == "charts_and_dataviz":
             plan.append({
+                "key": "charts_and_dataviz",
                 "name": "Charts & Dataviz",
-                "region_hint": "global",
+                "region_hint": regions.get("charts_and_dataviz", "global"),
                 "strength": 0.29,
                 "prompt": add_logo(
                     f"Recolor chart lines, bars, and category swatches to the brand palette (primary, secondary, success, warning, error) while preserving data positions and exact chart geometry. "
@@ -353,4 +400,23 @@ def build_edit_plan(tokens: Dict, steps: List[str], brand_logo: Optional[Image.I
                 "negative_prompt": negative,
             })
 
+    recolor_specs = {
+        "surfaces_and_background": {
+            "mode": "surfaces",
+            "colors": {"background": tokens["colors"]["background"], "surface": tokens["colors"]["surface"]},
+        },
+        "hairlines_and_outlines": {"mode": "outlines", "colors": {"surface": tokens["colors"]["surface"]}},
+    }
+    for step in plan:
+        roles = GOAL_COLOR_ROLES.get(step["key"], [])
+        step["goal_colors"] = [tokens["colors"][role] for role in roles if tokens["colors"].get(role)]
+        depends = STEP_TOKEN_FIELDS.get(step["key"], []) + [f"colors.{role}" for role in roles]
+        if logo_prompt:
+            depends.append("brand")
+        if step["key"] in (recolor_steps or []) and step["key"] in recolor_specs:
+            step["backend"] = RECOLOR_BACKEND
+            step["recolor"] = recolor_specs[step["key"]]
+            depends += [f"colors.{role}" for role in step["recolor"]["colors"]]
+        step["depends_on"] = token_fields(tokens, depends)
+
     return plan
@@ -0,0 +1,24 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kontext import fake_fal as fake_fal_module  # noqa: E402
+from kontext.bench import synthetic_screenshot  # noqa: E402
+
+
+@pytest.fixture
+def fake_fal():
+    """In-process FAL with no latency (kontext/fake_fal.py)."""
+    service = fake_fal_module.install(queue="fixed:0.0", inference="fixed:0.0")
+    try:
+        yield service
+    finally:
+        fake_fal_module.uninstall()
+
+
+@pytest.fixture
+def screenshot():
+    return synthetic_screenshot(320, 200)
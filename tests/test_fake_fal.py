@@ -0,0 +1,43 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from kontext import fake_fal, fal_backend, hedging, scheduler
+
+
+def _edit(screenshot, run_async):
+    kwargs = dict(seed=7, hedge=True, num_images=2)
+    if run_async:
+        return asyncio.run(fal_backend.apply_edit_async(screenshot, "tint", **kwargs))
+    return fal_backend.apply_edit(screenshot, "tint", **kwargs)
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_recorded_hedged_run_replays_every_candidate(monkeypatch, screenshot, tmp_path, run_async):
+    monkeypatch.setenv("KONTEXT_HEDGE_AFTER_S", "0.05")
+    monkeypatch.setenv("KONTEXT_HEDGE_MIN_S", "0")
+    monkeypatch.setenv("KONTEXT_HEDGE_POLL_S", "0.01")
+    monkeypatch.setenv("KONTEXT_HEDGE_MAX_RATIO", "1")
+    monkeypatch.setenv("FAL_KEY", "fake-fal-key")
+    scheduler.configure(rate=0, max_inflight=4)
+    live = fake_fal.FakeFal(queue="fixed:0.2", inference="fixed:0.0")
+    try:
+        fake_fal.install_recorder(str(tmp_path), client=live.module())
+        hedges = hedging.hedge_stats()["hedges"]
+        recorded = _edit(screenshot, run_async)
+        assert hedging.hedge_stats()["hedges"] > hedges
+    finally:
+        fake_fal.uninstall()
+        live.close()
+
+    replay = fake_fal.install(replay=str(tmp_path), transform="invert", inference="fixed:0.0")
+    try:
+        replayed = _edit(screenshot, run_async)
+    finally:
+        fake_fal.uninstall()
+        scheduler.configure()
+    assert replay.counters["requests"] >= 1
+    assert len(replayed) == len(recorded) == 2
+    for a, b in zip(recorded, replayed):
+        assert np.array_equal(np.asarray(a), np.asarray(b))
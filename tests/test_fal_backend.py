@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+
+from kontext import fake_fal, fal_backend, tracing
+
+
+def test_async_requests_split_queue_wait_from_inference(screenshot):
+    service = fake_fal.install(queue="fixed:0.05", inference="fixed:0.05")
+    trace = tracing.Trace()
+    token = tracing.activate(trace)
+    try:
+        asyncio.run(fal_backend.apply_edit_async(screenshot, "tint", seed=1, hedge=False))
+    finally:
+        tracing.deactivate(token)
+        fake_fal.uninstall()
+    spans = {span["name"]: span for span in trace.spans}
+    assert "queue_wait" in spans and "inference" in spans
+    assert "queue_split" not in spans["inference"].get("attrs", {})
+    (call,) = service.calls
+    # The fake's own queue and inference time; polling adds a few milliseconds to each span.
+    assert spans["queue_wait"]["duration_s"] == pytest.approx(call["queue_s"], abs=0.03)
+    assert spans["queue_wait"]["duration_s"] + spans["inference"]["duration_s"] == pytest.approx(
+        call["queue_s"] + call["inference_s"], abs=0.04)
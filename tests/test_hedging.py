@@ -0,0 +1,61 @@
+import io
+
+import pytest
+
+from kontext import fake_fal, hedging, scheduler
+
+
+@pytest.fixture
+def slow_queue(monkeypatch):
+    """Every request sits 0.3s in the queue; hedge after 0.05s, polling every 10ms."""
+    monkeypatch.setenv("KONTEXT_HEDGE_AFTER_S", "0.05")
+    monkeypatch.setenv("KONTEXT_HEDGE_MIN_S", "0")
+    monkeypatch.setenv("KONTEXT_HEDGE_POLL_S", "0.01")
+    monkeypatch.setenv("KONTEXT_HEDGE_MAX_RATIO", "1")
+    service = fake_fal.install(queue="fixed:0.3", inference="fixed:0.0")
+    yield service.module()
+    fake_fal.uninstall()
+    scheduler.configure()
+
+
+def _hedge_run(client, image, max_inflight):
+    png = io.BytesIO()
+    image.save(png, format="PNG")
+    args = {"image_url": client.upload(png.getvalue(), "image/png", "input.png"), "prompt": "tint", "seed": 1}
+    sched = scheduler.configure(rate=0, max_inflight=max_inflight)
+    before = hedging.hedge_stats()
+    scheduler.call(hedging.run_hedged, client, fake_fal.ENDPOINT, args)
+    after = hedging.hedge_stats()
+    return sched, {k: after[k] - before[k] for k in after}
+
+
+def test_duplicate_takes_its_own_slot(slow_queue, screenshot):
+    sched, delta = _hedge_run(slow_queue, screenshot, max_inflight=2)
+    assert delta["hedges"] == 1
+    assert sched.stats()["peak_inflight"] == 2
+    assert sched.stats()["inflight"] == 0
+
+
+def test_no_duplicate_without_a_free_slot(slow_queue, screenshot):
+    sched, delta = _hedge_run(slow_queue, screenshot, max_inflight=1)
+    assert delta["hedges"] == 0
+    assert delta["no_slot"] == 1
+    assert sched.stats()["inflight"] == 0
+
+
+def test_error_after_the_duplicate_cancels_both_copies(slow_queue, screenshot, monkeypatch):
+    handles = []
+    submit = slow_queue.submit
+
+    def _submit(*args, **kwargs):
+        handles.append(submit(*args, **kwargs))
+        if len(handles) == 2:
+            monkeypatch.setattr(handles[0], "status", lambda with_logs=False: 1 / 0)
+        return handles[-1]
+
+    monkeypatch.setattr(slow_queue, "submit", _submit)
+    with pytest.raises(ZeroDivisionError):
+        _hedge_run(slow_queue, screenshot, max_inflight=2)
+    assert len(handles) == 2
+    assert all(handle._cancelled for handle in handles)
+    assert scheduler.get_scheduler().stats()["inflight"] == 0
@@ -0,0 +1,57 @@
+import copy
+
+from kontext.backends import FAL
+from kontext.runner import run_restyle_plan
+from restyle.planner import DEFAULT_STEP_KEYS, EXAMPLE_TOKENS, build_edit_plan
+
+# The global brand refresh reads every token group, so reuse past it needs a plan without it.
+WITHOUT_GLOBAL = [key for key in DEFAULT_STEP_KEYS if key != "global_brand_refresh"]
+
+
+def _run(image, tokens, save_dir, keys=DEFAULT_STEP_KEYS, **options):
+    record = {}
+    run_restyle_plan(image, build_edit_plan(tokens, list(keys)), 12345, FAL, 1.0, True, save_dir,
+                     record=record, tokens=tokens, session="designer", **options)
+    return record
+
+
+def _radius_edit():
+    tokens = copy.deepcopy(EXAMPLE_TOKENS)
+    tokens["radius"]["button"] += 4
+    return tokens
+
+
+def test_radius_edit_reuses_the_steps_before_corner_radii(fake_fal, screenshot, tmp_path):
+    first = _run(screenshot, EXAMPLE_TOKENS, tmp_path, WITHOUT_GLOBAL)
+    calls = fake_fal.counters["requests"]
+    assert calls == len(WITHOUT_GLOBAL)
+
+    second = _run(screenshot, _radius_edit(), tmp_path, WITHOUT_GLOBAL)
+
+    reused = WITHOUT_GLOBAL.index("corner_radii")
+    assert second["reuse"]["from_run"] == first["run_id"]
+    assert second["reuse"]["steps"] == reused
+    assert second["reuse"]["changed"] == ["radius.button"]
+    assert fake_fal.counters["requests"] - calls == len(WITHOUT_GLOBAL) - reused
+
+
+def test_radius_edit_reruns_a_plan_starting_with_the_global_step(fake_fal, screenshot, tmp_path):
+    _run(screenshot, EXAMPLE_TOKENS, tmp_path)
+    record = _run(screenshot, _radius_edit(), tmp_path)
+    assert record["reuse"]["steps"] == 0
+
+
+def test_color_edit_reruns_from_the_first_step(fake_fal, screenshot, tmp_path):
+    _run(screenshot, EXAMPLE_TOKENS, tmp_path)
+    tokens = copy.deepcopy(EXAMPLE_TOKENS)
+    tokens["colors"]["link"] = "#123456"
+    record = _run(screenshot, tokens, tmp_path)
+    assert record["reuse"]["steps"] == 0
+
+
+def test_unchanged_tokens_reuse_every_step(fake_fal, screenshot, tmp_path):
+    _run(screenshot, EXAMPLE_TOKENS, tmp_path)
+    calls = fake_fal.counters["requests"]
+    record = _run(screenshot, EXAMPLE_TOKENS, tmp_path)
+    assert record["reuse"]["steps"] == len(DEFAULT_STEP_KEYS)
+    assert fake_fal.counters["requests"] == calls
@@ -0,0 +1,10 @@
+from PIL import Image, ImageDraw
+
+from restyle.planner import DEFAULT_STEP_KEYS, EXAMPLE_TOKENS, build_edit_plan
+
+
+def test_logo_colors_are_derived_when_not_passed():
+    logo = Image.new("RGBA", (200, 100), (0, 0, 0, 0))
+    ImageDraw.Draw(logo).rectangle((10, 10, 190, 90), fill=(37, 99, 235, 255))
+    plan = build_edit_plan(EXAMPLE_TOKENS, list(DEFAULT_STEP_KEYS), brand_logo=logo)
+    assert "ensure logo colors stay true to #2563EB" in plan[0]["prompt"]
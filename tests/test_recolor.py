@@ -0,0 +1,18 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from kontext.recolor_backend import recolor
+
+
+def test_near_white_surfaces_follow_a_dark_token():
+    img = Image.new("RGB", (400, 300), "#F5F6F8")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((20, 20, 200, 200), fill="#FFFFFF")   # card
+    draw.rectangle((250, 20, 380, 80), fill="#F8F9FB")   # just lighter than the background
+    out, remapped = recolor(img, {"mode": "surfaces", "colors": {"background": "#0B0B0B", "surface": "#121212"}})
+    o = np.asarray(out).astype(int)
+    assert remapped == 2
+    assert np.abs(o[250, 300] - 11).max() <= 2
+    assert np.abs(o[100, 100] - 18).max() <= 2
+    assert o[50, 300].max() < 40
+    assert o[100, 100].sum() > o[250, 300].sum()  # the card stays lighter than the background
@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from kontext import checkpoint
+from kontext.backends import FAL
+from kontext.fake_fal import InjectedFailure
+from kontext.run_store import get_run_store
+from kontext.runner import RunOptions, resume_restyle_plan, run_restyle_plan
+from restyle.planner import DEFAULT_STEP_KEYS, EXAMPLE_TOKENS, build_edit_plan
+
+PLAN = build_edit_plan(EXAMPLE_TOKENS, list(DEFAULT_STEP_KEYS))
+
+
+def _run(image, save_dir, **options):
+    record = {}
+    frames, logs = run_restyle_plan(image, PLAN, 12345, FAL, 1.0, True, save_dir, record=record,
+                                    tokens=EXAMPLE_TOKENS, **options)
+    return record, frames, logs
+
+
+def test_resume_after_injected_failure_reruns_only_the_failed_steps(fake_fal, screenshot, tmp_path):
+    failed_at = 3
+
+    def _fail_after(update):
+        if update["step"] == failed_at - 1:
+            fake_fal.failure_rate = 1.0
+
+    record = {}
+    with pytest.raises(InjectedFailure):
+        run_restyle_plan(screenshot, PLAN, 12345, FAL, 1.0, True, tmp_path, record=record, tokens=EXAMPLE_TOKENS,
+                         on_step=_fail_after, use_cache=False)
+    assert record["status"] == "failed"
+    assert record["step_status"][:failed_at + 1] == ["done"] * failed_at + ["failed"]
+    assert record["resume_hint"] == checkpoint.resume_hint(Path(record["run_path"]))
+    assert checkpoint.load_manifest(Path(record["run_path"]))["status"] == "failed"
+    assert get_run_store(tmp_path).get_run(record["run_id"])["status"] == "failed"
+
+    fake_fal.failure_rate = 0.0
+    calls = fake_fal.counters["requests"]
+    resumed = {}
+    frames, _ = resume_restyle_plan(Path(record["run_path"]), record=resumed)
+    assert resumed["status"] == "complete"
+    assert resumed["reuse"]["steps"] == failed_at
+    assert fake_fal.counters["requests"] - calls == len(PLAN) - failed_at
+    assert checkpoint.load_manifest(Path(record["run_path"]))["resumed_by"] == resumed["run_id"]
+
+    fresh, _, _ = _run(screenshot, tmp_path / "fresh", use_cache=False, reuse_prefix=False)
+    final = Path(fresh["run_path"]) / fresh["final"]
+    with Image.open(final) as expected:
+        assert np.array_equal(np.asarray(frames[-1].convert("RGB")), np.asarray(expected.convert("RGB")))
+
+
+def test_cache_hits_skip_model_calls(fake_fal, screenshot, tmp_path):
+    _run(screenshot, tmp_path, reuse_prefix=False)
+    calls = fake_fal.counters["requests"]
+    record, _, logs = _run(screenshot, tmp_path, reuse_prefix=False)
+    assert fake_fal.counters["requests"] == calls
+    assert f"[cache] {len(PLAN)} hit(s), 0 miss(es)" in "\n".join(logs)
+    assert record["reuse"] is None
+
+
+def test_previous_run_prefix_is_reused(fake_fal, screenshot, tmp_path):
+    first, _, _ = _run(screenshot, tmp_path, use_cache=False)
+    calls = fake_fal.counters["requests"]
+    options = RunOptions(use_cache=False, previous_run=first, tokens=EXAMPLE_TOKENS)
+    record = {}
+    frames, _ = run_restyle_plan(screenshot, PLAN, 12345, FAL, 1.0, True, tmp_path, options, record=record)
+    assert record["reuse"]["from_run"] == first["run_id"]
+    assert record["reuse"]["steps"] == len(PLAN)
+    assert fake_fal.counters["requests"] == calls
+    assert len(frames) == len(PLAN)
+
+
+def test_unknown_option_is_rejected(screenshot, tmp_path):
+    with pytest.raises(TypeError):
+        run_restyle_plan(screenshot, PLAN, 12345, FAL, 1.0, True, tmp_path, drift_limit=0.3)
+
+
+def test_unknown_backend_is_rejected(screenshot, tmp_path):
+    with pytest.raises(ValueError, match="Unknown backend"):
+        run_restyle_plan(screenshot, PLAN, 12345, "FAL", 1.0, True, tmp_path)
@@ -0,0 +1,12 @@
+from kontext.transport import Transport
+
+
+def test_counters_survive_pool_eviction(fake_fal):
+    url = fake_fal.put_blob(b"ok", "text/plain", "txt")
+    transport = Transport(pool_size=1)
+    for _ in range(3):
+        transport.session.get(url).close()
+    transport._adapter.poolmanager.clear()  # what eviction does to urllib3's per-pool counters
+    transport.session.get(url).close()
+    stats = transport.stats()
+    assert (stats["requests"], stats["new_connections"], stats["reuses"]) == (4, 2, 2)
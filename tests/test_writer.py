@@ -0,0 +1,23 @@
+import threading
+
+from kontext.writer import ArtifactWriter
+
+
+def _fail() -> None:
+    raise OSError("disk full")
+
+
+def test_group_flush_waits_for_and_reports_only_its_own_writes():
+    release = threading.Event()
+    with ArtifactWriter(workers=2) as writer:
+        slow, fast = writer.group(), writer.group()
+        slow.submit("slow", release.wait)
+        slow.submit("broken", _fail)
+        done = []
+        fast.submit("fast", done.append, 1)
+        assert fast.flush() == []
+        assert done == [1]
+        assert not release.is_set()
+        release.set()
+        assert slow.flush() == ["[io] Failed to write broken: disk full"]
+        assert writer.flush() == []